@@ -0,0 +1,55 @@
+from stexs.domain import model
+from stexs.domain.broker import ArrayLedger, Client, Ledger
+from stexs.services.exchange import Exchange
+from stexs.services.admission import AdmissionControl
+from stexs.services.broker import Broker
+import stexs.config as config
+import time
+
+def bootstrap_exchange(clock=None, journal=None):
+    # Stand up the demo exchange shared by the server entrypoints. Captured
+    # and replayed exchanges run on the exchange clock throughout, rate limits
+    # included, so a replay of the same setup makes the same decisions
+    deterministic = clock is not None or journal is not None
+    stex = Exchange(async_settlement=config.get_async_settlement(), clock=clock or time.time, journal=journal)
+    if config.get_broker_rate_limit() or config.get_account_rate_limit():
+        stex.admission = AdmissionControl(
+            broker_limit=config.get_broker_rate_limit(),
+            account_limit=config.get_account_rate_limit(),
+            clock=stex.now if deterministic else time.monotonic,
+        )
+    stocks = [
+        model.Stock(symbol="STI.", name="Sam and Tom Industrys"),
+        model.Stock(symbol="ARRM", name="AbeRystwyth RISC Machines"),
+        model.Stock(symbol="ELAN", name="Elan Dataworks"),
+    ]
+    stex.add_stocks(stocks)
+
+    ledger = ArrayLedger() if config.get_broker_ledger() == "array" else Ledger()
+    broker = Broker(code="MAGENTA", name="Magenta Holdings Plc.", ledger=ledger)
+    stex.add_broker(broker)
+
+    clients = [
+        Client(csid="1", name="Sam"),
+    ]
+    broker.add_users(clients)
+    broker.adjust_balance(csid="1", adjust_balance=+100000)
+    broker.adjust_holding(csid="1", symbol="STI.", adjust_qty=+10000)
+    broker.adjust_holding(csid="1", symbol="ELAN", adjust_qty=+10000)
+
+    add_load_accounts(broker, [stock.symbol for stock in stocks], config.get_bootstrap_accounts())
+
+    return stex
+
+def load_account_id(i):
+    return "load-%d" % i
+
+def add_load_accounts(broker, symbols, n_accounts, balance=1000000, holding=1000000):
+    # Accounts for the load generator, funded to trade on both sides of every book
+    if n_accounts <= 0:
+        return
+    broker.add_users([Client(csid=load_account_id(i), name="Load %d" % i) for i in range(n_accounts)])
+    for i in range(n_accounts):
+        broker.adjust_balance(csid=load_account_id(i), adjust_balance=+balance)
+        for symbol in symbols:
+            broker.adjust_holding(csid=load_account_id(i), symbol=symbol, adjust_qty=+holding)
@@ -11,3 +11,38 @@ def get_socket_host_and_port():
         int(os.getenv("STEX_EXCHANGE_PORT"))
     )
 
+def get_async_settlement():
+    return os.getenv("STEX_ASYNC_SETTLEMENT", "0").lower() in ["1", "true", "yes"]
+
+def get_bootstrap_accounts():
+    # Number of extra funded accounts to create for load generation
+    return int(os.getenv("STEX_BOOTSTRAP_ACCOUNTS", "0"))
+
+def get_unix_socket_path():
+    return os.getenv("STEX_EXCHANGE_UNIX_PATH")
+
+def get_shm_gateways():
+    # Names of the shared memory ring gateways to serve, one per co-located client
+    return [name for name in os.getenv("STEX_EXCHANGE_SHM_GATEWAYS", "").split(",") if name]
+
+def _get_rate_limit(name):
+    # Limits are given as RATE:BURST in messages per second
+    limit = os.getenv(name)
+    if not limit:
+        return None
+    rate, burst = limit.split(":")
+    return (float(rate), float(burst))
+
+def get_broker_rate_limit():
+    return _get_rate_limit("STEX_BROKER_RATE_LIMIT")
+
+def get_account_rate_limit():
+    return _get_rate_limit("STEX_ACCOUNT_RATE_LIMIT")
+
+def get_broker_ledger():
+    # "array" keeps broker ledgers in NumPy arrays, needs numpy
+    return os.getenv("STEX_BROKER_LEDGER", "dict").lower()
+
+def get_capture_journal():
+    # Path to journal every message the exchange receives to, for replay
+    return os.getenv("STEX_CAPTURE_JOURNAL")
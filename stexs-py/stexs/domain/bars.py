@@ -0,0 +1,68 @@
+from typing import List
+
+# Bar intervals in seconds each MarketStall keeps, and how many bars of each
+BAR_INTERVALS = [1, 60, 300]
+BAR_HISTORY = 512
+
+# Fields of a bar in the order they are kept
+_START, _OPEN, _HIGH, _LOW, _CLOSE, _VOLUME, _N_TRADES = range(7)
+
+class BarSeries:
+    # OHLCV bars of one interval built from trades as they print.
+    #
+    # The most recent `size` bars are kept in a ring, so adding a trade is O(1)
+    # whether it extends the current bar or starts the next one, and the
+    # oldest bar is overwritten once the ring is full. Intervals with no
+    # trades have no bar. A trade stamped before the current bar (clocks are
+    # not always kind) is folded into the current bar rather than reopening
+    # an old one.
+
+    def __init__(self, interval: int, size: int = BAR_HISTORY):
+        self.interval = interval
+        self.size = size
+        self._bars = [None] * size
+        self._head = -1 # Index of the current bar
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, ts, price, volume):
+        start = int(ts // self.interval * self.interval)
+        bar = self._bars[self._head] if self._count else None
+        if bar is None or start > bar[_START]:
+            self._head = (self._head + 1) % self.size
+            self._bars[self._head] = [start, price, price, price, price, volume, 1]
+            self._count = min(self._count + 1, self.size)
+            return
+
+        if price > bar[_HIGH]:
+            bar[_HIGH] = price
+        if price < bar[_LOW]:
+            bar[_LOW] = price
+        bar[_CLOSE] = price
+        bar[_VOLUME] += volume
+        bar[_N_TRADES] += 1
+
+    def latest(self, n: int = None) -> List[list]:
+        # Up to n of the most recent bars, oldest first
+        if n is None or n > self._count:
+            n = self._count
+        if n <= 0:
+            return []
+        return [list(self._bars[(self._head - i) % self.size]) for i in range(n - 1, -1, -1)]
+
+    @staticmethod
+    def serialise(bar):
+        return {
+            "ts": bar[_START],
+            "open": str(bar[_OPEN]), # TODO CRIT str
+            "high": str(bar[_HIGH]),
+            "low": str(bar[_LOW]),
+            "close": str(bar[_CLOSE]),
+            "volume": bar[_VOLUME],
+            "num_trades": bar[_N_TRADES],
+        }
+
+def default_bar_series():
+    return {interval: BarSeries(interval) for interval in BAR_INTERVALS}
@@ -1,7 +1,13 @@
 from .broker import Client
+from .holdings import Holdings, intern_symbol
+from .ledger import (
+    CASH,
+    Ledger,
+    LedgerEntry,
+)
+from .array_ledger import ArrayLedger
 from .broker_exception import (
     OrderScreeningException,
     InsufficientBalanceException,
     InsufficientHoldingException,
 )
-
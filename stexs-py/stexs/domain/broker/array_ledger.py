@@ -0,0 +1,185 @@
+from .broker_exception import (
+    InsufficientBalanceException,
+    InsufficientHoldingException,
+)
+from .ledger import CASH, LedgerEntry
+from typing import Dict
+import threading
+
+class ArrayLedger:
+    # Ledger backed by NumPy arrays, a drop-in for Ledger.
+    #
+    # Cash balances sit in one array and stock in a dense (account x symbol)
+    # matrix, with csids and symbols interned to row and column indices as they
+    # are first seen. A batch of settlements becomes one scatter-add per array
+    # and valuing every account is one matrix-vector product, no per-account
+    # objects exist until get_account asks for one.
+    #
+    # NumPy is only needed once an ArrayLedger is made.
+
+    def __init__(self, n_accounts=1024, n_symbols=16):
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ImportError("ArrayLedger needs numpy, use Ledger instead") from e
+        self._np = np
+
+        self._rows = {} # csid -> row
+        self._cols = {} # symbol -> col
+        self._csids = []
+        self._symbols = []
+
+        self._balance = np.zeros(n_accounts, dtype=np.float64)
+        self._balance_reserved = np.zeros(n_accounts, dtype=np.float64)
+        self._holding = np.zeros((n_accounts, n_symbols), dtype=np.int64)
+        self._holding_reserved = np.zeros((n_accounts, n_symbols), dtype=np.int64)
+        # Distinguishes an empty holding from no holding at all
+        self._held = np.zeros((n_accounts, n_symbols), dtype=bool)
+
+        self._lock = threading.Lock()
+
+    def _grow(self, n_accounts, n_symbols):
+        # Double whichever dimension ran out so interning stays amortised O(1)
+        np = self._np
+        rows, cols = self._holding.shape
+        if n_accounts > rows:
+            new_rows = max(n_accounts, rows * 2)
+            self._balance = np.resize(self._balance, new_rows)
+            self._balance[rows:] = 0
+            self._balance_reserved = np.resize(self._balance_reserved, new_rows)
+            self._balance_reserved[rows:] = 0
+            rows = new_rows
+        if n_symbols > cols:
+            cols = max(n_symbols, cols * 2)
+        if (rows, cols) != self._holding.shape:
+            for name in ["_holding", "_holding_reserved", "_held"]:
+                old = getattr(self, name)
+                new = np.zeros((rows, cols), dtype=old.dtype)
+                new[:old.shape[0], :old.shape[1]] = old
+                setattr(self, name, new)
+
+    def _row(self, csid):
+        return self._rows[str(csid)]
+
+    def _col(self, symbol):
+        col = self._cols.get(symbol)
+        if col is None:
+            col = len(self._symbols)
+            self._grow(len(self._csids), col + 1)
+            self._cols[symbol] = col
+            self._symbols.append(symbol)
+        return col
+
+    def open_account(self, csid, balances: Dict[str, float]):
+        with self._lock:
+            if str(csid) in self._rows:
+                return
+            row = len(self._csids)
+            self._grow(row + 1, len(self._symbols))
+            self._rows[str(csid)] = row
+            self._csids.append(str(csid))
+            for asset, amount in balances.items():
+                if asset == CASH:
+                    self._balance[row] = amount
+                else:
+                    col = self._col(asset)
+                    self._holding[row, col] = amount
+                    self._held[row, col] = True
+
+    def has_account(self, csid):
+        return str(csid) in self._rows
+
+    def accounts(self):
+        with self._lock:
+            return list(self._csids)
+
+    def get_account(self, csid):
+        with self._lock:
+            row = self._row(csid)
+            account = {CASH: LedgerEntry(float(self._balance[row]), float(self._balance_reserved[row]))}
+            for col in self._np.flatnonzero(self._held[row]):
+                account[self._symbols[col]] = LedgerEntry(int(self._holding[row, col]), int(self._holding_reserved[row, col]))
+            return account
+
+    def get(self, csid, asset):
+        with self._lock:
+            row = self._row(csid)
+            if asset == CASH:
+                return LedgerEntry(float(self._balance[row]), float(self._balance_reserved[row]))
+            col = self._cols.get(asset)
+            if col is None or not self._held[row, col]:
+                return LedgerEntry()
+            return LedgerEntry(int(self._holding[row, col]), int(self._holding_reserved[row, col]))
+
+    def deposit(self, csid, asset, amount):
+        with self._lock:
+            row = self._row(csid)
+            if asset == CASH:
+                self._balance[row] += amount
+            else:
+                col = self._col(asset)
+                self._holding[row, col] += amount
+                self._held[row, col] = True
+
+    def reserve(self, csid, asset, amount, force=False):
+        with self._lock:
+            row = self._row(csid)
+            if asset == CASH:
+                if not force and self._balance[row] - self._balance_reserved[row] < amount:
+                    raise InsufficientBalanceException("Insufficient balance")
+                self._balance_reserved[row] += amount
+                return
+
+            col = self._col(asset)
+            if not force:
+                if not self._held[row, col]:
+                    raise InsufficientHoldingException("No holding")
+                elif self._holding[row, col] - self._holding_reserved[row, col] < amount:
+                    raise InsufficientHoldingException("Insufficient holding")
+            self._holding_reserved[row, col] += amount
+            self._held[row, col] = True
+
+    def release(self, csid, asset, amount):
+        self.settle(csid, asset, amount, 0)
+
+    def settle(self, csid, asset, release_amount, settle_amount):
+        self.settle_many([(csid, asset, release_amount, settle_amount)])
+
+    def settle_many(self, rows):
+        # Settle a batch of (csid, asset, release_amount, settle_amount) rows,
+        # the batch is split into cash and stock and each applied with one
+        # scatter-add so repeated accounts in a batch accumulate
+        np = self._np
+        with self._lock:
+            cash_rows, cash_release, cash_settle = [], [], []
+            stock_rows, stock_cols, stock_release, stock_settle = [], [], [], []
+            for csid, asset, release_amount, settle_amount in rows:
+                if asset == CASH:
+                    cash_rows.append(self._row(csid))
+                    cash_release.append(release_amount)
+                    cash_settle.append(settle_amount)
+                else:
+                    stock_rows.append(self._row(csid))
+                    stock_cols.append(self._col(asset))
+                    stock_release.append(release_amount)
+                    stock_settle.append(settle_amount)
+
+            if cash_rows:
+                np.add.at(self._balance_reserved, cash_rows, -np.asarray(cash_release, dtype=np.float64))
+                np.add.at(self._balance, cash_rows, np.asarray(cash_settle, dtype=np.float64))
+                self._balance_reserved[cash_rows] = np.maximum(self._balance_reserved[cash_rows], 0)
+            if stock_rows:
+                index = (np.asarray(stock_rows), np.asarray(stock_cols))
+                np.add.at(self._holding_reserved, index, -np.asarray(stock_release, dtype=np.int64))
+                np.add.at(self._holding, index, np.asarray(stock_settle, dtype=np.int64))
+                self._holding_reserved[index] = np.maximum(self._holding_reserved[index], 0)
+                self._held[index] = True
+
+    def valuations(self, prices: Dict[str, float]):
+        # Settled cash plus settled holdings at the given prices, per account
+        np = self._np
+        with self._lock:
+            n = len(self._csids)
+            price_vector = np.array([prices.get(symbol, 0) for symbol in self._symbols], dtype=np.float64)
+            values = self._balance[:n] + (self._holding[:n, :len(self._symbols)] @ price_vector)
+            return dict(zip(self._csids, values.tolist()))
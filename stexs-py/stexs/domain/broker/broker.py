@@ -2,15 +2,32 @@ from .broker_exception import (
     InsufficientBalanceException,
     InsufficientHoldingException,
 )
-from dataclasses import dataclass, field
+from .holdings import Holdings
+from dataclasses import dataclass
 from typing import List, Dict
+import sys
 
-@dataclass
+# Slotted to keep the per-client overhead down with many accounts, holdings are
+# kept as interned symbol ids (see Holdings) but may be given as a plain dict.
+# Slots are declared by hand (dataclass slots= needs py3.10) which rules out
+# field defaults, so they live in __init__
+@dataclass(init=False)
 class Client:
+    __slots__ = ("csid", "name", "balance", "holdings")
     csid: str
     name: str
-    balance: float = 0
-    holdings: Dict[str, int] = field(default_factory = dict)
+    balance: float
+    holdings: Holdings
+
+    def __init__(self, csid, name, balance=0, holdings=None):
+        self.csid = sys.intern(csid) if isinstance(csid, str) else csid
+        self.name = name
+        self.balance = balance
+        self.holdings = holdings if isinstance(holdings, Holdings) else Holdings(holdings)
+
+    def __deepcopy__(self, memo):
+        # The memory store copies clients on every checkout
+        return Client(self.csid, self.name, self.balance, self.holdings.__copy__())
 
     @property
     def stexid(self):
@@ -22,9 +39,7 @@ class Client:
 
     # TODO CRIT what about <0 holdings
     def adjust_holding(self, symbol, adjust_qty):
-        if symbol not in self.holdings:
-            self.holdings[symbol] = 0
-        self.holdings[symbol] += adjust_qty
+        self.holdings.adjust(symbol, adjust_qty)
 
     def screen_order(self, side, symbol, price, volume):
         if side == "BUY":
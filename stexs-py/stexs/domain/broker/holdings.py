@@ -0,0 +1,135 @@
+from array import array
+from collections.abc import MutableMapping
+import threading
+
+# Symbols are interned to small ints shared by every client, so a holding costs
+# a slot in two arrays rather than a dict entry and a string reference
+_symbol_ids = {}
+_symbols = []
+_symbols_lock = threading.Lock()
+
+def intern_symbol(symbol: str):
+    symbol_id = _symbol_ids.get(symbol)
+    if symbol_id is None:
+        with _symbols_lock:
+            symbol_id = _symbol_ids.get(symbol)
+            if symbol_id is None:
+                symbol_id = len(_symbols)
+                _symbols.append(symbol)
+                _symbol_ids[symbol] = symbol_id
+    return symbol_id
+
+def symbol_name(symbol_id: int):
+    return _symbols[symbol_id]
+
+def _whole(qty):
+    # Quantities are whole shares, whole floats such as 1.0 are taken as ints
+    if isinstance(qty, float) and qty.is_integer():
+        return int(qty)
+    if not isinstance(qty, int):
+        raise TypeError("Holding quantities must be whole numbers, not %r" % (qty,))
+    return qty
+
+
+class Holdings(MutableMapping):
+    # Symbol to quantity mapping stored as sorted (symbol id, quantity) pairs
+    # packed into one array, which is only allocated once there is a holding.
+    #
+    # Retail portfolios are small and sparse so a binary search over a few ids
+    # is as quick as hashing and costs far less memory than a dict. Behaves as
+    # a dict of symbol to int everywhere else.
+
+    __slots__ = ("_pairs",)
+
+    def __init__(self, holdings=None):
+        self._pairs = None
+        if holdings:
+            self._pairs = array("q")
+            for symbol_id, qty in sorted((intern_symbol(symbol), _whole(qty)) for symbol, qty in holdings.items()):
+                self._pairs.append(symbol_id)
+                self._pairs.append(qty)
+
+    def _search(self, symbol_id):
+        # Index of the pair for symbol_id, or where it would be inserted
+        pairs = self._pairs
+        lo = 0
+        hi = len(pairs) // 2 if pairs else 0
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if pairs[mid * 2] < symbol_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo * 2
+
+    def _index(self, symbol):
+        # Position of the symbol's quantity in the pairs or None
+        symbol_id = _symbol_ids.get(symbol)
+        if symbol_id is None or not self._pairs:
+            return None
+        i = self._search(symbol_id)
+        if i < len(self._pairs) and self._pairs[i] == symbol_id:
+            return i + 1
+        return None
+
+    def __getitem__(self, symbol):
+        i = self._index(symbol)
+        if i is None:
+            raise KeyError(symbol)
+        return self._pairs[i]
+
+    def __setitem__(self, symbol, qty):
+        qty = _whole(qty)
+        i = self._index(symbol)
+        if i is not None:
+            self._pairs[i] = qty
+            return
+        symbol_id = intern_symbol(symbol)
+        if self._pairs is None:
+            self._pairs = array("q")
+        i = self._search(symbol_id)
+        self._pairs[i:i] = array("q", [symbol_id, qty])
+
+    def __delitem__(self, symbol):
+        i = self._index(symbol)
+        if i is None:
+            raise KeyError(symbol)
+        del self._pairs[i - 1:i + 1]
+
+    def __contains__(self, symbol):
+        return self._index(symbol) is not None
+
+    def __iter__(self):
+        if not self._pairs:
+            return iter(())
+        return (symbol_name(symbol_id) for symbol_id in self._pairs[::2])
+
+    def __len__(self):
+        return len(self._pairs) // 2 if self._pairs else 0
+
+    def __eq__(self, other):
+        if isinstance(other, Holdings):
+            return (self._pairs or array("q")) == (other._pairs or array("q"))
+        return super().__eq__(other)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def adjust(self, symbol, adjust_qty):
+        adjust_qty = _whole(adjust_qty)
+        i = self._index(symbol)
+        if i is None:
+            self[symbol] = adjust_qty
+            return adjust_qty
+        self._pairs[i] += adjust_qty
+        return self._pairs[i]
+
+    def __copy__(self):
+        holdings = Holdings()
+        if self._pairs:
+            holdings._pairs = array("q", self._pairs)
+        return holdings
+
+    def __deepcopy__(self, memo):
+        # Nothing inside is mutable besides the array itself
+        return self.__copy__()
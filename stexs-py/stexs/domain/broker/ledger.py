@@ -0,0 +1,111 @@
+from .broker_exception import (
+    InsufficientBalanceException,
+    InsufficientHoldingException,
+)
+from dataclasses import dataclass
+from typing import Dict
+import threading
+
+# Cash is kept in the ledger as one more asset alongside the stock symbols
+CASH = "XST"
+
+@dataclass
+class LedgerEntry:
+    settled: float = 0
+    reserved: float = 0
+
+    @property
+    def available(self):
+        return self.settled - self.reserved
+
+
+class Ledger:
+    # Settled and reserved amounts of cash and each stock per account.
+    #
+    # Screening an order reserves what it could spend (cash for a buy, stock for
+    # a sell) so concurrent orders cannot commit the same funds twice. Each
+    # operation touches one or two entries under a single lock, so a
+    # check-and-reserve is atomic and costs the same however big the account is.
+
+    def __init__(self):
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    def _account(self, csid):
+        # Accounts are keyed on the string csid as they are in the client store
+        return self._accounts[str(csid)]
+
+    def open_account(self, csid, balances: Dict[str, float]):
+        with self._lock:
+            if str(csid) not in self._accounts:
+                self._accounts[str(csid)] = {asset: LedgerEntry(settled=amount) for asset, amount in balances.items()}
+
+    def has_account(self, csid):
+        return str(csid) in self._accounts
+
+    def accounts(self):
+        with self._lock:
+            return list(self._accounts)
+
+    def get_account(self, csid):
+        with self._lock:
+            return {asset: LedgerEntry(entry.settled, entry.reserved) for asset, entry in self._account(csid).items()}
+
+    def get(self, csid, asset):
+        with self._lock:
+            entry = self._account(csid).get(asset)
+            return LedgerEntry(entry.settled, entry.reserved) if entry else LedgerEntry()
+
+    def _entry(self, csid, asset):
+        account = self._account(csid)
+        if asset not in account:
+            account[asset] = LedgerEntry()
+        return account[asset]
+
+    def deposit(self, csid, asset, amount):
+        # Move the settled amount, negative to withdraw
+        with self._lock:
+            self._entry(csid, asset).settled += amount
+
+    def reserve(self, csid, asset, amount, force=False):
+        with self._lock:
+            entry = self._account(csid).get(asset)
+            if not force:
+                if asset == CASH:
+                    if entry is None or entry.available < amount:
+                        raise InsufficientBalanceException("Insufficient balance")
+                elif entry is None:
+                    raise InsufficientHoldingException("No holding")
+                elif entry.available < amount:
+                    raise InsufficientHoldingException("Insufficient holding")
+            if entry is None:
+                entry = self._entry(csid, asset)
+            entry.reserved += amount
+
+    def release(self, csid, asset, amount):
+        with self._lock:
+            entry = self._entry(csid, asset)
+            entry.reserved = max(entry.reserved - amount, 0)
+
+    def settle(self, csid, asset, release_amount, settle_amount):
+        # Drop a reservation and move the settled amount in one step
+        with self._lock:
+            entry = self._entry(csid, asset)
+            entry.reserved = max(entry.reserved - release_amount, 0)
+            entry.settled += settle_amount
+
+    def settle_many(self, rows):
+        # Settle a batch of (csid, asset, release_amount, settle_amount) rows
+        with self._lock:
+            for csid, asset, release_amount, settle_amount in rows:
+                entry = self._entry(csid, asset)
+                entry.reserved = max(entry.reserved - release_amount, 0)
+                entry.settled += settle_amount
+
+    def valuations(self, prices: Dict[str, float]):
+        # Settled cash plus settled holdings at the given prices, per account
+        with self._lock:
+            return {
+                csid: sum(entry.settled * (1 if asset == CASH else prices.get(asset, 0)) for asset, entry in account.items())
+                for csid, account in self._accounts.items()
+            }
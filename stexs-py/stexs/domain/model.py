@@ -1,11 +1,14 @@
 from dataclasses import dataclass, field
 from dataclasses import replace as dataclass_replace
 from typing import List, Dict
+from bisect import bisect_left
 import time
 import copy
 import uuid
 
 from stexs.services.logger import log # TODO Remove service dependency
+from stexs.domain.bars import BarSeries, default_bar_series
+from stexs.domain.rolling import RollingWindow, default_rolling_windows
 
 @dataclass
 class Stock:
@@ -114,9 +117,9 @@ class Trade:
 
         return price
 
-    def clear_trade(self):
+    def clear_trade(self, ts=None):
         self.closed = True
-        self.ts = int(time.time())
+        self.ts = int(time.time()) if ts is None else ts
 
 @dataclass
 class MarketStall:
@@ -126,7 +129,11 @@ class MarketStall:
     max_price: float = None
     n_trades: int = 0
     v_trades: float = 0
+    notional: float = 0 # Sum of price * volume over the session
     order_history: List[object] = field(default_factory = list)
+    trade_ts: List[int] = field(default_factory = list) # ts of each trade in order_history, never decreasing
+    bars: Dict[int, BarSeries] = field(default_factory = default_bar_series) # by interval
+    rolling: List[RollingWindow] = field(default_factory = default_rolling_windows)
 
     def __rich__(self):
         return ' '.join([
@@ -140,6 +147,8 @@ class MarketStall:
 
     def log_trade(self, trade):
         self.order_history.append(trade)
+        # Clamp so the index stays sorted should the clock step back
+        self.trade_ts.append(max(trade.ts, self.trade_ts[-1]) if self.trade_ts else trade.ts)
 
         # Update summary
         if not self.last_price:
@@ -156,6 +165,47 @@ class MarketStall:
 
         self.n_trades += 1
         self.v_trades += trade.volume
+        self.notional += trade.avg_price * trade.volume
+        for series in self.bars.values():
+            series.add(trade.ts, trade.avg_price, trade.volume)
+        for window in self.rolling:
+            window.add(trade.ts, trade.avg_price, trade.volume)
         log.info("[bold cyan]TRDE[/] " + self.__rich__())
 
-
+    @property
+    def vwap(self):
+        if not self.v_trades:
+            return None
+        return self.notional / self.v_trades
+
+    def rolling_summary(self, now=None):
+        # Stats for each rolling window, time windows aged to `now` first
+        if now is None:
+            now = time.time()
+        summary = {}
+        for window in self.rolling:
+            window.expire(now)
+            summary[window.name] = window.summary()
+        return summary
+
+    def trade_window(self, since_seq=None, since_ts=None, until_ts=None, limit=None):
+        # [start, end) of order_history for the trades after since_seq, at or
+        # after since_ts and before until_ts. A trade's seq is its position in
+        # order_history counting from 1. Limited windows take the first trades
+        # after a since_* bound and the most recent otherwise
+        start = 0
+        end = len(self.order_history)
+        if since_seq is not None:
+            start = max(start, min(int(since_seq), end))
+        if since_ts is not None:
+            start = max(start, bisect_left(self.trade_ts, since_ts))
+        if until_ts is not None:
+            end = min(end, bisect_left(self.trade_ts, until_ts))
+        end = max(start, end)
+
+        if limit is not None:
+            if since_seq is not None or since_ts is not None:
+                end = min(end, start + limit)
+            else:
+                start = max(start, end - limit)
+        return start, end
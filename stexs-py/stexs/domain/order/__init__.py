@@ -1,5 +1,6 @@
-from .order import Order
+from .order import Order, TIME_IN_FORCE
 from .order_exception import (
+    AmendOrderVolumeException,
     SplitOrderBuyException,
     SplitOrderVolumeException,
 )
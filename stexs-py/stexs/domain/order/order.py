@@ -2,6 +2,10 @@ from dataclasses import dataclass, field
 from dataclasses import replace as dataclass_replace
 from . import order_exception
 
+# GTC rests until filled or cancelled, IOC trades what it can at once and drops
+# the rest, FOK trades in full at once or not at all and GTT rests until expire_ts
+TIME_IN_FORCE = ["GTC", "IOC", "FOK", "GTT"]
+
 @dataclass
 class Order:
     txid: str
@@ -12,11 +16,29 @@ class Order:
     price: float
     volume: int
     closed: bool = False
+    tif: str = "GTC" # Time in force, see TIME_IN_FORCE
+    expire_ts: float = None # When a GTT order expires
+    stop_price: float = None # Held off the book until the last price reaches this
+
+    @property
+    def is_stop(self):
+        return self.stop_price is not None
 
     @property
     def stexid(self):
         return self.txid
 
+    @staticmethod
+    def split_txid(txid: str):
+        # Fiddle the txid so we know it is a split
+        if '/' in txid:
+            parent, split = txid.split('/')
+            split_num = int(split)+1
+        else:
+            parent = txid
+            split_num = 1
+        return '%s/%d' % (parent, split_num)
+
     # TODO I guess this doesn't need to be static and we can just call it ON the order to split
     @staticmethod
     def split_sell(filled_sell: "Order", excess_volume: int):
@@ -29,17 +51,21 @@ class Order:
             raise order_exception.SplitOrderVolumeException("Cannot split sell without excess volume.")
 
         filled_sell.volume -= excess_volume
-
-        # Fiddle the txid so we know it is a split
-        if '/' in filled_sell.txid:
-            parent, split = filled_sell.txid.split('/')
-            split_num = int(split)+1
-        else:
-            parent = filled_sell.txid
-            split_num = 1
-        new_txid = '%s/%d' % (parent, split_num)
+        new_txid = Order.split_txid(filled_sell.txid)
 
         remainder_sell = dataclass_replace(filled_sell, txid=new_txid, volume=excess_volume, closed=False)
         return filled_sell, remainder_sell
 
+    def amend_volume(self, volume: int):
+        # Only reducing an order keeps its time priority, anything else is a new order
+        if self.closed:
+            raise order_exception.AmendOrderVolumeException("Cannot amend closed order.")
+        if volume <= 0 or volume >= self.volume:
+            raise order_exception.AmendOrderVolumeException("Can only amend volume down.")
+        self.volume = volume
+        return self
 
+    @property
+    def immediate(self):
+        # IOC and FOK orders never rest on the book
+        return self.tif in ["IOC", "FOK"]
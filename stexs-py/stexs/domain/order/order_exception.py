@@ -4,3 +4,5 @@ class SplitOrderBuyException(Exception):
 class SplitOrderVolumeException(Exception):
     pass
 
+class AmendOrderVolumeException(Exception):
+    pass
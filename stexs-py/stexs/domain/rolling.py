@@ -0,0 +1,91 @@
+from collections import deque
+import math
+
+# Rolling windows each MarketStall keeps, over a number of trades and over a
+# number of seconds
+ROLLING_TRADES = [100]
+ROLLING_SECONDS = [300]
+
+class RollingWindow:
+    # Volume, notional and price spread over the last `n` trades or the last
+    # `seconds` of trades, kept as running sums.
+    #
+    # Each trade is added once and evicted once, so keeping the window up to
+    # date is O(1) amortised per trade and reading it is O(1). Prices are
+    # summed relative to the first price seen so the variance does not lose
+    # its precision to large prices.
+
+    def __init__(self, n=None, seconds=None):
+        self.n = n
+        self.seconds = seconds
+        self._trades = deque() # (ts, price, volume)
+        self._shift = None
+        self.volume = 0
+        self.notional = 0.0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def __len__(self):
+        return len(self._trades)
+
+    def _evict(self):
+        ts, price, volume = self._trades.popleft()
+        d = price - self._shift
+        self.volume -= volume
+        self.notional -= price * volume
+        self._sum -= d
+        self._sum_sq -= d * d
+
+    def expire(self, now):
+        # Drop trades that have aged out of a time window
+        if self.seconds is None:
+            return
+        while self._trades and self._trades[0][0] <= now - self.seconds:
+            self._evict()
+
+    def add(self, ts, price, volume):
+        if self._shift is None:
+            self._shift = price
+        d = price - self._shift
+        self._trades.append((ts, price, volume))
+        self.volume += volume
+        self.notional += price * volume
+        self._sum += d
+        self._sum_sq += d * d
+
+        if self.n is not None and len(self._trades) > self.n:
+            self._evict()
+        self.expire(ts)
+
+    @property
+    def vwap(self):
+        if self.volume == 0:
+            return None
+        return self.notional / self.volume
+
+    @property
+    def price_stddev(self):
+        # Population standard deviation of trade prices in the window
+        n = len(self._trades)
+        if n == 0:
+            return None
+        mean = self._sum / n
+        return math.sqrt(max(self._sum_sq / n - mean * mean, 0.0))
+
+    @property
+    def name(self):
+        if self.n is not None:
+            return "trades_%d" % self.n
+        return "seconds_%d" % self.seconds
+
+    def summary(self):
+        return {
+            "num_trades": len(self._trades),
+            "volume": self.volume,
+            "notional": self.notional,
+            "vwap": str(self.vwap) if self.vwap is not None else None, # TODO CRIT str
+            "price_stddev": self.price_stddev,
+        }
+
+def default_rolling_windows():
+    return [RollingWindow(n=n) for n in ROLLING_TRADES] + [RollingWindow(seconds=seconds) for seconds in ROLLING_SECONDS]
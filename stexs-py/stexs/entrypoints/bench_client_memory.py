@@ -0,0 +1,59 @@
+import argparse
+import copy
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Dict
+
+from stexs.domain.broker import Client
+
+# Measures the heap cost of a client record and of checking one out of the
+# memory store (a deepcopy), for the slotted Client against the plain dataclass
+# with a dict of holdings it replaced.
+
+@dataclass
+class DictClient:
+    csid: str
+    name: str
+    balance: float = 0
+    holdings: Dict[str, int] = field(default_factory = dict)
+
+def make_clients(cls, n, n_holdings, n_symbols):
+    return [
+        cls(
+            csid="client-%d" % i,
+            name="Client %d" % i,
+            balance=1000.0,
+            holdings={"SYM%d" % ((i + j) % n_symbols): 100 for j in range(n_holdings)},
+        )
+        for i in range(n)
+    ]
+
+def measure(cls, n, n_holdings, n_symbols):
+    # Build once first so interned symbols are not counted against the clients
+    make_clients(cls, 1, n_symbols, n_symbols)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    clients = make_clients(cls, n, n_holdings, n_symbols)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for client in clients:
+        copy.deepcopy(client)
+    checkout = time.perf_counter() - start
+    return (after - before) / n, checkout / n * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure memory per client")
+    parser.add_argument("-n", type=int, default=100000)
+    parser.add_argument("--symbols", type=int, default=500)
+    args = parser.parse_args()
+
+    print("%-12s %10s %14s %14s" % ("client", "holdings", "bytes/client", "checkout us"))
+    for n_holdings in [0, 1, 5, 20]:
+        for name, cls in [("dict", DictClient), ("compact", Client)]:
+            per_client, checkout_us = measure(cls, args.n, n_holdings, args.symbols)
+            print("%-12s %10d %14d %14.2f" % (name, n_holdings, per_client, checkout_us))
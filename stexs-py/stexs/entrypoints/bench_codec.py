@@ -0,0 +1,89 @@
+import argparse
+import timeit
+
+from stexs.io.wire import JSON_CODEC, BINARY_CODEC
+
+# Times a serialise and parse round trip of each hot message type with the
+# JSON and binary codecs. The JSON new_order round trip includes the float()
+# the exchange needs to apply to its string price.
+
+MESSAGES = {
+    "new_order": {
+        "message_type": "new_order",
+        "txid": "a1b2-1234",
+        "broker_id": "MAGENTA",
+        "account_id": "1",
+        "side": "BUY",
+        "symbol": "STI.",
+        "price": "1.013",
+        "volume": 7,
+        "sender_ts": 1660000000,
+    },
+    "order_ack": {
+        "order": {
+            "txid": "a1b2-1234",
+            "csid": "1",
+            "ts": 1660000000,
+            "side": "BUY",
+            "symbol": "STI.",
+            "price": 1.013,
+            "volume": 7,
+            "closed": False,
+        },
+        "response_type": "new_order",
+        "response_code": 0,
+        "msg": "ok",
+    },
+    "trade": {
+        "response_type": "trade",
+        "response_code": 0,
+        "msg": "ok",
+        "symbol": "STI.",
+        "seq": 1234,
+        "tid": "9f8e7",
+        "ts": 1660000000,
+        "price": "1.013",
+        "volume": 7,
+        "buy_txid": "a1b2-1234",
+        "sell_txids": ["c3d4-99", "c3d4-100"],
+    },
+    "book_delta": {
+        "response_type": "book_delta",
+        "response_code": 0,
+        "msg": "ok",
+        "symbol": "STI.",
+        "seq": 1235,
+        "deltas": [
+            {"side": "BUY", "price": "1.013", "volume": 0},
+            {"side": "SELL", "price": "1.02", "volume": 40},
+        ],
+    },
+}
+
+def round_trip(codec, msg, parse_price):
+    decoded = codec.decode(codec.encode(msg))
+    if parse_price:
+        float(decoded["price"])
+    return decoded
+
+def bench(codec, msg, parse_price, n):
+    return min(timeit.repeat(lambda: round_trip(codec, msg, parse_price), number=n, repeat=5)) / n
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the exchange wire codecs")
+    parser.add_argument("-n", type=int, default=100000)
+    args = parser.parse_args()
+
+    print("%-12s %10s %10s %8s %8s %8s" % ("message", "json us", "binary us", "speedup", "json B", "binary B"))
+    for name, msg in MESSAGES.items():
+        parse_price = name == "new_order"
+        json_s = bench(JSON_CODEC, msg, parse_price, args.n)
+        binary_s = bench(BINARY_CODEC, msg, parse_price, args.n)
+        print("%-12s %10.3f %10.3f %7.1fx %8d %8d" % (
+            name,
+            json_s * 1e6,
+            binary_s * 1e6,
+            json_s / binary_s,
+            len(JSON_CODEC.encode(msg)),
+            len(BINARY_CODEC.encode(msg)),
+        ))
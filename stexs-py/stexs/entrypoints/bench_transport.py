@@ -0,0 +1,96 @@
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from stexs.bootstrap import load_account_id
+from stexs.entrypoints.main_loadtest_connections import start_server
+from stexs.io.client import ExchangeClient
+from stexs.io.shm import ShmExchangeClient, ShmException
+from stexs.io.wire import JSON_CODEC, BINARY_CODEC
+from stexs.services.metrics import LatencyHistogram
+
+# Compares round trip latency into the asyncio exchange over each transport a
+# co-located client can use: TCP loopback, the Unix domain socket and the
+# shared memory ring gateway. Each transport sends the same stream of crossing
+# buy and sell orders one at a time, so the book stays small and the time spent
+# in the exchange is about the same for every order. Matching an order costs far
+# more than moving it, so the same is done with instrument_summary requests to
+# show the transport on its own.
+
+def order(i, run_id, transport):
+    return {
+        "message_type": "new_order",
+        "txid": "%s-%d-%d" % (run_id, transport, i),
+        "broker_id": "MAGENTA",
+        "account_id": load_account_id(i % 2),
+        "side": "BUY" if i % 2 == 0 else "SELL",
+        "symbol": "STI.",
+        "price": "1.00",
+        "volume": 1,
+        "sender_ts": int(time.time()),
+    }
+
+def summary(i, run_id, transport):
+    return {
+        "message_type": "instrument_summary",
+        "symbol": "STI.",
+    }
+
+def bench(name, client, make_msg, n, warmup, run_id, transport):
+    hist = LatencyHistogram()
+    with client:
+        for i in range(warmup + n):
+            msg = make_msg(i, run_id, transport)
+            start = time.perf_counter()
+            reply = client.request(msg)
+            elapsed = time.perf_counter() - start
+            if reply.get("response_code") != 0:
+                raise Exception("%s request rejected: %s" % (name, reply))
+            if i >= warmup:
+                hist.record(elapsed * 1e6)
+    return hist
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the co-located exchange transports")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5500)
+    parser.add_argument("-n", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:4]
+    path = os.path.join(tempfile.mkdtemp(), "stex.sock")
+    ring_name = "stex-%s" % run_id
+    proc = start_server("main_exchange_async.py", args.host, args.port, extra_env={
+        "STEX_BOOTSTRAP_ACCOUNTS": "2",
+        "STEX_EXCHANGE_UNIX_PATH": path,
+        "STEX_EXCHANGE_SHM_GATEWAYS": ring_name,
+    })
+    try:
+        # Gateway rings appear once the server is up, give them a moment
+        deadline = time.time() + 10
+        while True:
+            try:
+                ShmExchangeClient(ring_name).connect().close()
+                break
+            except ShmException:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        transports = [
+            ("tcp json", lambda: ExchangeClient(args.host, args.port, codec=JSON_CODEC, timeout=5)),
+            ("tcp binary", lambda: ExchangeClient(args.host, args.port, codec=BINARY_CODEC, timeout=5)),
+            ("unix binary", lambda: ExchangeClient(path=path, codec=BINARY_CODEC, timeout=5)),
+            ("shm ring", lambda: ShmExchangeClient(ring_name, timeout=5)),
+        ]
+        print("%-20s %10s %10s %10s %10s" % ("transport", "p50 us", "p90 us", "p99 us", "max us"))
+        for message, make_msg in [("order", order), ("summary", summary)]:
+            for transport, (name, make_client) in enumerate(transports):
+                stats = bench(name, make_client(), make_msg, args.n, args.warmup, run_id, transport).summary()
+                print("%-20s %10d %10d %10d %10d" % ("%s %s" % (name, message), stats["p50"], stats["p90"], stats["p99"], stats["max"]))
+    finally:
+        proc.kill()
+        proc.wait()
@@ -1,54 +1,172 @@
-from stexs.domain import model
-from stexs.domain.broker import Client
-from stexs.services.exchange import Exchange
-from stexs.services.broker import Broker
+from stexs.bootstrap import bootstrap_exchange
+from stexs.io.journal import JournalWriter
+from stexs.io.server import MALFORMED_MESSAGE_REPLY
+from stexs.io.wire import (
+    FrameReader,
+    WireException,
+    JSON_CODEC,
+    encode_message,
+    decode_message,
+    negotiate_codec,
+)
 from stexs.services.logger import log
 import stexs.config as config
 
+import queue
 import socket
-import json
+import threading
+
+# How often a streaming thread checks whether its subscriber has gone
+STREAM_POLL_SECONDS = 0.5
 
 if __name__ == "__main__":
-    stex = Exchange()
-    stocks = [
-        model.Stock(symbol="STI.", name="Sam and Tom Industrys"),
-        model.Stock(symbol="ARRM", name="AbeRystwyth RISC Machines"),
-        model.Stock(symbol="ELAN", name="Elan Dataworks"),
-    ]
-    stex.add_stocks(stocks)
-
-    broker = Broker(code="MAGENTA", name="Magenta Holdings Plc.")
-    stex.add_broker(broker)
-
-    clients = [
-        Client(csid="1", name="Sam"),
-    ]
-    broker.add_users(clients)
-    broker.adjust_balance(csid="1", adjust_balance=+100000)
-    broker.adjust_holding(csid="1", symbol="STI.", adjust_qty=+10000)
-    broker.adjust_holding(csid="1", symbol="ELAN", adjust_qty=+10000)
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(config.get_socket_host_and_port())
-        log.debug("Listening: %s" % str(config.get_socket_host_and_port()))
-        s.listen()
-
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                log.debug("Connection from %s" % str(addr))
-                while True:
-                    data = conn.recv(1024)
+    journal = JournalWriter(config.get_capture_journal()) if config.get_capture_journal() else None
+    stex = bootstrap_exchange(journal=journal)
+
+    def answer(payload, codec):
+        # Reply to one framed message, returning the reply and the codec for
+        # the replies after it
+        next_codec = codec
+        try:
+            msg = decode_message(payload)
+            if isinstance(msg, dict) and msg.get("message_type") == "hello":
+                # Encoding is per connection so never reaches the exchange
+                next_codec, reply = negotiate_codec(msg, codec)
+            else:
+                reply = stex.recv(msg)
+        except (ValueError, WireException) as e:
+            log.debug(e)
+            reply = MALFORMED_MESSAGE_REPLY
+        except Exception as e:
+            log.debug(e)
+            reply = {
+                "response_type": "exception",
+                "response_code": 70,
+                "msg": str(e),
+            }
+        return reply, next_codec
+
+    def is_subscribed(reply):
+        return isinstance(reply, dict) and reply.get("response_type") == "market_data_subscribe" and reply.get("response_code") == 0
+
+    def serve_subscriber(conn, frames, payloads, codec, sid):
+        # Streams each of the connection's subscriptions from a thread of its
+        # own while this thread goes on reading the connection, so subscribers
+        # can unsubscribe and a disconnect is noticed however quiet the feed
+        send_lock = threading.Lock()
+        gone = threading.Event()
+        sids = []
+
+        def send(data):
+            with send_lock:
+                conn.sendall(data)
+
+        def stream(sub, codec):
+            try:
+                while not sub.closed and not gone.is_set():
+                    try:
+                        msg = sub.get(timeout=STREAM_POLL_SECONDS)
+                    except queue.Empty:
+                        continue
+                    send(encode_message(msg, codec))
+            except OSError as e:
+                log.debug(e)
+                gone.set()
+                try:
+                    # Wake the reader so the connection is torn down
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        def subscribe(sid, codec):
+            sub = stex.feed.get_subscription(sid)
+            if sub:
+                sids.append(sid)
+                threading.Thread(target=stream, args=(sub, codec), daemon=True).start()
+
+        subscribe(sid, codec)
+        with conn:
+            try:
+                while not gone.is_set():
+                    out = []
+                    subscribed = []
+                    for payload in payloads:
+                        reply, next_codec = answer(payload, codec)
+                        out.append(encode_message(reply, codec))
+                        if is_subscribed(reply):
+                            subscribed.append((reply["subscription_id"], codec))
+                        codec = next_codec
+                    if out:
+                        send(b"".join(out))
+                    # Only stream once the subscriber has its reply
+                    for sid, sub_codec in subscribed:
+                        subscribe(sid, sub_codec)
+
+                    data = conn.recv(65536)
                     if not data:
                         break
+                    payloads = frames.feed(data)
+            except (OSError, WireException) as e:
+                log.debug(e)
+            finally:
+                gone.set()
+                for sid in sids:
+                    stex.feed.unsubscribe(sid)
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(config.get_socket_host_and_port())
+            log.debug("Listening: %s" % str(config.get_socket_host_and_port()))
+            s.listen()
 
+            while True:
+                conn, addr = s.accept()
+                log.debug("Connection from %s" % str(addr))
+                frames = FrameReader()
+                codec = JSON_CODEC
+                streaming = False
+                while not streaming:
                     try:
-                        payload = json.loads( data.decode("ascii") )
-                        reply = stex.recv(payload)
+                        data = conn.recv(65536)
+                        if not data:
+                            break
+                        payloads = frames.feed(data)
+                    except (OSError, WireException) as e:
+                        log.debug(e)
+                        break
 
-                        payload = json.dumps(reply).encode("ascii")
-                        conn.send(payload)
-                    except Exception as e:
+                    # Pipelined messages are all answered before the socket is written
+                    out = []
+                    for i, payload in enumerate(payloads):
+                        reply, next_codec = answer(payload, codec)
+                        out.append(encode_message(reply, codec))
+                        codec = next_codec
+
+                        if is_subscribed(reply):
+                            streaming = True
+                            break
+
+                    try:
+                        conn.sendall(b"".join(out))
+                    except OSError as e:
                         log.debug(e)
-                        pass # lol
+                        if streaming:
+                            stex.feed.unsubscribe(reply["subscription_id"])
+                            streaming = False
+                        break
+
+                    if streaming:
+                        # Hand the connection over to a thread of its own so the
+                        # subscriber does not block everyone else, along with
+                        # anything it sent after subscribing
+                        threading.Thread(
+                            target=serve_subscriber,
+                            args=(conn, frames, payloads[i + 1:], codec, reply["subscription_id"]),
+                            daemon=True,
+                        ).start()
 
+                if not streaming:
+                    conn.close()
+    finally:
+        if journal:
+            journal.close()
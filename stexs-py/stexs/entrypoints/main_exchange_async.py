@@ -0,0 +1,28 @@
+from stexs.bootstrap import bootstrap_exchange
+from stexs.io.journal import JournalWriter
+from stexs.io.server import AsyncExchangeServer
+import stexs.config as config
+
+import asyncio
+
+async def serve():
+    journal = JournalWriter(config.get_capture_journal()) if config.get_capture_journal() else None
+    stex = bootstrap_exchange(journal=journal)
+    host, port = config.get_socket_host_and_port()
+    server = AsyncExchangeServer(stex, host=host, port=port, path=config.get_unix_socket_path())
+    await server.start()
+    shm_gateways = config.get_shm_gateways()
+    if shm_gateways:
+        # multiprocessing.shared_memory needs py3.8, so only import it when asked to
+        from stexs.io.shm import RingGateway
+        for name in shm_gateways:
+            server.add_ring_gateway(RingGateway(name))
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        if journal:
+            journal.close()
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,32 @@
+import argparse
+import logging
+
+from stexs.bootstrap import bootstrap_exchange
+from stexs.io.export import export_exchange, FORMATS, EXPORT_CHUNK_SIZE
+from stexs.io.journal import read_journal
+from stexs.services.logger import log
+from stexs.services.replay import replay_journal
+
+# Rebuilds an exchange from a journal captured with STEX_CAPTURE_JOURNAL, run
+# with the same environment it was captured in, and exports its orders,
+# trades and positions as columnar files for offline analysis.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a captured exchange as columnar files")
+    parser.add_argument("journal")
+    parser.add_argument("directory")
+    parser.add_argument("--format", action="append", choices=FORMATS, dest="formats",
+            help="npz (the default) and parquet if pyarrow is installed unless given")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument("--verbose", action="store_true", help="Keep the exchange log")
+    args = parser.parse_args()
+    if not args.verbose:
+        log.setLevel(logging.WARNING)
+
+    report = replay_journal(read_journal(args.journal), lambda clock: bootstrap_exchange(clock=clock))
+    exchange = report["exchange"]
+    counts = export_exchange(exchange, args.directory, formats=args.formats, chunk_size=args.chunk_size)
+    exchange.close()
+
+    for table, n in counts.items():
+        print("%s: %d rows" % (table, n))
@@ -7,14 +7,72 @@ from rich.prompt import Prompt
 from datetime import datetime
 import random
 from time import sleep, time
-import stexs.config as config
-import socket
-import json
+from stexs.io.client import ExchangeClient, ClientException
+import threading
+import uuid
 import sys
 import tty
 import termios
 from pynput import keyboard
 
+SYMBOL = "STI."
+POLL_INTERVAL = 0.25
+MAX_FPS = 25
+MAX_BOOK_ROWS = 25
+MAX_HISTORY_ROWS = 10
+
+class TickerModel:
+    # Latest data behind each panel, written by the poller and input handling
+    # and read by the render loop. A panel's version only moves when its data
+    # actually changes, so panels that have not changed are never re-rendered.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._panels = {} # panel -> (data, version)
+        self._changed = threading.Event()
+
+    def update(self, panel, data):
+        with self._lock:
+            current = self._panels.get(panel)
+            if current is not None and current[0] == data:
+                return False
+            self._panels[panel] = (data, current[1] + 1 if current else 1)
+        self._changed.set()
+        return True
+
+    def changes(self, versions):
+        # Panels whose version has moved on from those in `versions`
+        with self._lock:
+            return {panel: entry for panel, entry in self._panels.items() if versions.get(panel) != entry[1]}
+
+    def wait(self, timeout):
+        changed = self._changed.wait(timeout)
+        self._changed.clear()
+        return changed
+
+def poll_instrument(model, symbol, interval, poll_now, stop):
+    # Runs on its own thread and connection so the screen never waits on the
+    # network, `poll_now` cuts the wait short after an order goes in
+    try:
+        with ExchangeClient(timeout=5) as client:
+            while not stop.is_set():
+                payload = client.request({
+                    "message_type": "instrument_snapshot",
+                    "symbol": symbol,
+                    "depth": MAX_BOOK_ROWS,
+                    "history": MAX_HISTORY_ROWS,
+                })
+                if payload.get("response_code") == 0:
+                    model.update("info", payload["summary"])
+                    model.update("summary", payload["orderbook_summary"])
+                    model.update("history", payload["trade_history"])
+                    model.update("buys", payload["buy_book"])
+                    model.update("sells", payload["sell_book"])
+                poll_now.wait(interval)
+                poll_now.clear()
+    except (OSError, ClientException) as e:
+        model.update("status", "[bold white on red]Lost connection to exchange: %s[/]" % e)
+
 if __name__ == "__main__":
     layout = Layout()
     layout.split_column(
@@ -220,13 +278,40 @@ if __name__ == "__main__":
         else:
             return status
 
-    def recv_payload(client):
-        data = client.recv(65536)
-        if not data:
-            return None
-        payload = json.loads( data.decode("ascii") )
-        layout["footer"].update(make_footer(payload))
-        return payload
+    def make_info_from_summary(summary):
+        #TODO Open/close, last_trade vol/ts
+        return make_info(
+            summary["symbol"],
+            summary["name"],
+            summary["last_trade_price"],
+            summary["min_price"],
+            summary["max_price"],
+            summary["vol_trades"],
+            summary["num_trades"],
+        )
+
+    RENDERERS = {
+        "info": make_info_from_summary,
+        "summary": make_summary,
+        "history": make_trade_history,
+        "buys": lambda rows: make_order_table(rows, direction="BUY", title="Buy Book", n=MAX_BOOK_ROWS),
+        "sells": lambda rows: make_order_table(rows, direction="SELL", title="Sell Book", n=MAX_BOOK_ROWS),
+        "messages": make_messages,
+        "footer": make_footer,
+        "status": make_status,
+    }
+
+    def render(model, live, stop):
+        # Only this thread touches the layout. Wakes for changes, or once a
+        # second for the clock, and redraws at most MAX_FPS times a second
+        versions = {}
+        while not stop.is_set():
+            model.wait(1.0)
+            for panel, (data, version) in model.changes(versions).items():
+                layout[panel].update(RENDERERS[panel](data))
+                versions[panel] = version
+            live.refresh()
+            sleep(1 / MAX_FPS)
 
     def hoot_char():
         # jfc what the f am i doing
@@ -258,11 +343,20 @@ if __name__ == "__main__":
         return ch
 
 
-    with Live(layout, refresh_per_second=25, screen=True) as l:
+    model = TickerModel()
+    stop = threading.Event()
+    poll_now = threading.Event()
+
+    # Screen is only redrawn by the render thread when something changed, the
+    # order connection is kept for the whole session
+    with Live(layout, auto_refresh=False, screen=True) as live, ExchangeClient() as client:
+        threading.Thread(target=poll_instrument, args=(model, SYMBOL, POLL_INTERVAL, poll_now, stop), daemon=True).start()
+        threading.Thread(target=render, args=(model, live, stop), daemon=True).start()
+
         txid = 1
         random_client_id = str(uuid.uuid4())[:4]
         while True:
-            layout["status"].update(make_status())
+            model.update("status", None)
             auto_order = True
             manual_order = ""
             manual_side = manual_price = manual_vol = None
@@ -274,6 +368,7 @@ if __name__ == "__main__":
                         break
                     elif hasattr(event.key, "char"):
                         if event.key.char == 'q':
+                            stop.set()
                             sys.exit(0)
                         elif event.key.char == 'o':
                             auto_order = False
@@ -286,7 +381,7 @@ if __name__ == "__main__":
                 manual_prompt = manual_prompt_base
                 not_valid = True
                 while not_valid:
-                    layout["status"].update(make_status(manual_prompt))
+                    model.update("status", manual_prompt)
 
                     char = hoot_char()
 
@@ -311,77 +406,26 @@ if __name__ == "__main__":
                         manual_prompt += str(char)
 
 
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
-                client.connect(config.get_socket_host_and_port())
-                if client:
-                    # Send an order
-                    msg = {
-                        "message_type": "new_order",
-                        "type": "order",
-                        "txid": "%s-%d" % (random_client_id, txid),
-                        "broker_id": "MAGENTA",
-                        "account_id": "1",
-                        "side": random.choice(["BUY", "SELL"]),
-                        "symbol": "STI.",
-                        "price": str(round(random.gauss(1, 0.25), 3)),
-                        "volume": int(random.uniform(1, 10)),
-                        "sender_ts": int(time()),
-                    }
-                    if not auto_order:
-                        msg["side"] = manual_side
-                        msg["price"] = manual_price
-                        msg["volume"] = int(manual_vol)
-                        auto_order = True
-
-                    client.send(json.dumps(msg).encode("ascii"))
-                    layout["messages"].update(make_messages([msg]))
-
-                    payload = recv_payload(client)
-
-                    # Update GUI
-                    client.send(json.dumps({
-                        "message_type": "instrument_summary",
-                        "symbol": "STI.",
-                    }).encode('ascii'))
-                    payload = recv_payload(client)
-
-                    last_buy = payload["last_trade_price"]
-                    min_price = payload["min_price"]
-                    max_price = payload["max_price"]
-                    tot_vol = payload["vol_trades"]
-                    n_trade = payload["num_trades"]
-                    symbol = payload["symbol"]
-                    name = payload["name"]
-                    #TODO Open/close, last_trade vol/ts
-                    layout["info"].update(make_info(symbol, name, last_buy, min_price, max_price, tot_vol, n_trade))
-
-                    client.send(json.dumps({
-                        "message_type": "instrument_trade_history",
-                        "symbol": "STI.",
-                    }).encode('ascii'))
-                    payload = recv_payload(client)
-                    layout["history"].update(make_trade_history(payload["trade_history"][-10:]))
-
-                    client.send(json.dumps({
-                        "message_type": "instrument_orderbook_summary",
-                        "symbol": "STI.",
-                    }).encode('ascii'))
-                    payload = recv_payload(client)
-                    layout["summary"].update(make_summary(payload))
-
-                    client.send(json.dumps({
-                        "message_type": "instrument_orderbook",
-                        "symbol": "STI.",
-                    }).encode('ascii'))
-                    payload = recv_payload(client)
-
-                    buys_book = payload["buy_book"]
-                    sells_book = payload["sell_book"]
-                    layout["buys"].update(make_order_table(buys_book, direction="BUY", title="Buy Book"))
-                    layout["sells"].update(make_order_table(sells_book, direction="SELL", title="Sell Book"))
-
-                client.shutdown(1)
-                client.close()
-                txid += 1
-                sleep(0.1)
-
+            # Send an order
+            msg = {
+                "message_type": "new_order",
+                "type": "order",
+                "txid": "%s-%d" % (random_client_id, txid),
+                "broker_id": "MAGENTA",
+                "account_id": "1",
+                "side": random.choice(["BUY", "SELL"]),
+                "symbol": SYMBOL,
+                "price": str(round(random.gauss(1, 0.25), 3)),
+                "volume": int(random.uniform(1, 10)),
+                "sender_ts": int(time()),
+            }
+            if not auto_order:
+                msg["side"] = manual_side
+                msg["price"] = manual_price
+                msg["volume"] = int(manual_vol)
+                auto_order = True
+
+            model.update("messages", [msg])
+            model.update("footer", client.request(msg))
+            poll_now.set()
+            txid += 1
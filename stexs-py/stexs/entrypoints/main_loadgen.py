@@ -0,0 +1,239 @@
+import argparse
+import multiprocessing
+import random
+import socket
+import threading
+import time
+import uuid
+
+from stexs.bootstrap import load_account_id
+from stexs.entrypoints.main_loadtest_connections import SERVERS, start_server
+from stexs.io.client import ExchangeClient, ConnectionClosedException
+from stexs.io.wire import BINARY_CODEC, JSON_CODEC
+from stexs.services.metrics import LatencyHistogram
+
+# Drives the exchange with orders from many worker processes at once.
+#
+# Each worker trades on its own accounts over one persistent connection and
+# replays a weighted mix of order kinds, either at a target rate or flat out.
+# Every order is timed from send to ack, and a second connection subscribed to
+# the market data feed times each order to the first trade print naming it.
+# The per-worker latency histograms are merged into a single report.
+#
+# With a target rate, latency is measured from when the order was due to be
+# sent rather than when it was sent, so a stalled exchange shows up as latency
+# on every order queued behind the stall instead of being hidden by the worker
+# waiting on it (coordinated omission).
+#
+# Accounts come from the exchange bootstrap, start the server with
+# STEX_BOOTSTRAP_ACCOUNTS of at least workers * accounts, or pass --server to
+# have one started here.
+
+ORDER_KINDS = ["limit_buy", "limit_sell", "market_buy", "market_sell"]
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        kind, weight = part.split("=")
+        if kind not in ORDER_KINDS:
+            raise argparse.ArgumentTypeError("Unknown order kind %s, expected one of %s" % (kind, ','.join(ORDER_KINDS)))
+        weights[kind] = float(weight)
+    return weights
+
+def make_order(rng, kind, txid, account_id, symbol, mid_price, spread):
+    side = "BUY" if kind.endswith("buy") else "SELL"
+    price = None
+    if kind.startswith("limit"):
+        price = str(round(max(rng.gauss(mid_price, spread), 0.01), 2))
+    return {
+        "message_type": "new_order",
+        "txid": txid,
+        "broker_id": "MAGENTA",
+        "account_id": account_id,
+        "side": side,
+        "symbol": symbol,
+        "price": price,
+        "volume": rng.randint(1, 10),
+        "sender_ts": int(time.time()),
+    }
+
+def watch_trades(client, sent_at, order_to_trade, stop):
+    # Time each order to the first trade that fills any of it
+    while not stop.is_set():
+        try:
+            msg = client.recv()
+        except socket.timeout:
+            continue
+        except (ConnectionClosedException, OSError):
+            return
+        if msg.get("response_type") != "trade":
+            continue
+        now = time.perf_counter()
+        for txid in [msg["buy_txid"]] + msg["sell_txids"]:
+            # Remainders of split orders trade under txid/n
+            start = sent_at.pop(txid.split('/')[0], None)
+            if start is not None:
+                order_to_trade.record((now - start) * 1e6)
+
+def run_worker(worker_id, args, barrier, results):
+    try:
+        results.put(drive_orders(worker_id, args, barrier))
+    except Exception as e:
+        # Release everyone else waiting to start rather than leave them hanging
+        barrier.abort()
+        results.put({
+            "worker": worker_id,
+            "error": "%s: %s" % (type(e).__name__, e),
+        })
+
+def drive_orders(worker_id, args, barrier):
+    rng = random.Random(args.seed + worker_id)
+    run_id = str(uuid.uuid4())[:4]
+    accounts = [load_account_id((worker_id * args.accounts) + i) for i in range(args.accounts)]
+    kinds = list(args.mix)
+    weights = [args.mix[kind] for kind in kinds]
+    codec = BINARY_CODEC if args.binary else JSON_CODEC
+
+    send_to_ack = LatencyHistogram()
+    order_to_trade = LatencyHistogram()
+    codes = {}
+    sent_at = {}
+    n_sent = 0
+
+    feed = ExchangeClient(args.host, args.port, timeout=0.5).connect()
+    feed.subscribe(args.symbols)
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch_trades, args=(feed, sent_at, order_to_trade, stop), daemon=True)
+    watcher.start()
+
+    with ExchangeClient(args.host, args.port, codec=codec, timeout=args.timeout) as client:
+        barrier.wait()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        interval = (1 / args.rate) if args.rate > 0 else 0
+        due = start
+
+        while time.perf_counter() < deadline and (args.orders == 0 or n_sent < args.orders):
+            if interval:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                t0 = due
+                due += interval
+            else:
+                t0 = time.perf_counter()
+
+            txid = "%s-%d-%d" % (run_id, worker_id, n_sent)
+            msg = make_order(rng, rng.choices(kinds, weights)[0], txid, rng.choice(accounts), rng.choice(args.symbols), args.price, args.spread)
+            sent_at[txid] = t0
+            try:
+                reply = client.request(msg)
+            except (socket.timeout, ConnectionClosedException):
+                codes["timeout"] = codes.get("timeout", 0) + 1
+                break
+            send_to_ack.record((time.perf_counter() - t0) * 1e6)
+            n_sent += 1
+
+            code = reply.get("response_code")
+            codes[code] = codes.get(code, 0) + 1
+            if code != 0:
+                # Rejected orders will never trade
+                sent_at.pop(txid, None)
+
+        elapsed = time.perf_counter() - start
+
+    # Give the feed a moment to catch up with the last orders
+    time.sleep(args.drain)
+    stop.set()
+    watcher.join()
+    feed.close()
+
+    return {
+        "worker": worker_id,
+        "sent": n_sent,
+        "elapsed": elapsed,
+        "codes": codes,
+        "send_to_ack": send_to_ack,
+        "order_to_trade": order_to_trade,
+    }
+
+def format_histogram(name, hist):
+    summary = hist.summary()
+    if summary["count"] == 0:
+        return "%-15s count=0" % name
+    return "%-15s count=%-8d min=%.3fms p50=%.3fms p90=%.3fms p99=%.3fms p99.9=%.3fms max=%.3fms" % (
+        name,
+        summary["count"],
+        summary["min"] / 1000,
+        summary["p50"] / 1000,
+        summary["p90"] / 1000,
+        summary["p99"] / 1000,
+        summary["p99.9"] / 1000,
+        summary["max"] / 1000,
+    )
+
+def run(args):
+    barrier = multiprocessing.Barrier(args.workers)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker, args=(i, args, barrier, results)) for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    for report in reports:
+        if "error" in report:
+            print("worker %d failed: %s" % (report["worker"], report["error"]))
+    reports = [report for report in reports if "error" not in report]
+    if len(reports) == 0:
+        return
+
+    send_to_ack = LatencyHistogram()
+    order_to_trade = LatencyHistogram()
+    codes = {}
+    for report in reports:
+        send_to_ack.merge(report["send_to_ack"])
+        order_to_trade.merge(report["order_to_trade"])
+        for code, count in report["codes"].items():
+            codes[code] = codes.get(code, 0) + count
+
+    n_sent = sum(report["sent"] for report in reports)
+    elapsed = max(report["elapsed"] for report in reports)
+    print("workers=%d orders=%d elapsed=%.2fs rate=%.1f/s" % (args.workers, n_sent, elapsed, n_sent / elapsed if elapsed else 0))
+    print("response codes %s" % ' '.join("%s=%d" % (code, count) for code, count in sorted(codes.items(), key=lambda item: str(item[0]))))
+    print(format_histogram("send_to_ack", send_to_ack))
+    print(format_histogram("order_to_trade", order_to_trade))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-process order load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5500)
+    parser.add_argument("--server", choices=[name for name, _ in SERVERS], help="Start this exchange server for the run")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--accounts", type=int, default=5, help="Accounts per worker")
+    parser.add_argument("--rate", type=float, default=0, help="Orders per second per worker, 0 for flat out")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--orders", type=int, default=0, help="Orders per worker, 0 for no limit")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("limit_buy=0.45,limit_sell=0.45,market_buy=0.05,market_sell=0.05"))
+    parser.add_argument("--symbols", nargs="+", default=["STI."])
+    parser.add_argument("--price", type=float, default=1.0)
+    parser.add_argument("--spread", type=float, default=0.02)
+    parser.add_argument("--binary", action="store_true", help="Negotiate the binary codec")
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--drain", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    proc = None
+    if args.server:
+        script = dict(SERVERS)[args.server]
+        proc = start_server(script, args.host, args.port, extra_env={
+            "STEX_BOOTSTRAP_ACCOUNTS": str(args.workers * args.accounts),
+        })
+    try:
+        run(args)
+    finally:
+        if proc:
+            proc.kill()
+            proc.wait()
@@ -0,0 +1,133 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from stexs.io.client import ExchangeClient, ConnectionClosedException
+
+# Compares how the blocking and asyncio exchange servers cope with many
+# concurrent connections. Each server is started in turn, a number of idle
+# connections are opened (clients that connect and then say nothing) and a set
+# of active clients then time simple requests on their own connections.
+
+SERVERS = [
+    ("blocking", "main_exchange.py"),
+    ("asyncio", "main_exchange_async.py"),
+]
+
+def start_server(script, host, port, extra_env=None):
+    env = dict(os.environ)
+    env.update(extra_env or {})
+    env["STEX_EXCHANGE_HOST"] = host
+    env["STEX_EXCHANGE_PORT"] = str(port)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), env.get("PYTHONPATH", "")])
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), script)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    # Wait for the listener, the probe connection is closed straight away
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise Exception("Server %s did not start" % script)
+
+def run_client(host, port, n_requests, timeout, results):
+    latencies = []
+    timeouts = 0
+    try:
+        with ExchangeClient(host, port, timeout=timeout) as client:
+            for _ in range(n_requests):
+                start = time.perf_counter()
+                try:
+                    client.request({
+                        "message_type": "instrument_summary",
+                        "symbol": "STI.",
+                    })
+                    latencies.append(time.perf_counter() - start)
+                except socket.timeout:
+                    # Connection is no longer usable once a reply goes missing
+                    timeouts += 1
+                    break
+                except ConnectionClosedException:
+                    break
+    except OSError:
+        timeouts += 1
+    results.append((latencies, timeouts))
+
+def run_load(name, host, port, n_idle, n_clients, n_requests, timeout):
+    idle = []
+    for _ in range(n_idle):
+        idle.append(socket.create_connection((host, port)))
+
+    results = []
+    threads = [threading.Thread(target=run_client, args=(host, port, n_requests, timeout, results)) for _ in range(n_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for conn in idle:
+        conn.close()
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    timeouts = sum(client_timeouts for _, client_timeouts in results)
+    latencies.sort()
+    return {
+        "server": name,
+        "idle": n_idle,
+        "clients": n_clients,
+        "ok": len(latencies),
+        "timeouts": timeouts,
+        "elapsed": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else None,
+    }
+
+def format_result(result):
+    return "%-9s idle=%-4d clients=%-4d ok=%-6d timeouts=%-4d rps=%-9.1f p50=%s p99=%s" % (
+        result["server"],
+        result["idle"],
+        result["clients"],
+        result["ok"],
+        result["timeouts"],
+        result["rps"],
+        "%.3fms" % result["p50_ms"] if result["p50_ms"] is not None else "-",
+        "%.3fms" % result["p99_ms"] if result["p99_ms"] is not None else "-",
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connection scalability load test of the exchange servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5500)
+    parser.add_argument("--idle", type=int, nargs="+", default=[0, 1, 100])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    args = parser.parse_args()
+
+    for i, (name, script) in enumerate(SERVERS):
+        for j, n_idle in enumerate(args.idle):
+            # Fresh server per run so starved connections do not carry over
+            port = args.port + (i * len(args.idle)) + j
+            proc = start_server(script, args.host, port)
+            try:
+                result = run_load(name, args.host, port, n_idle, args.clients, args.requests, args.timeout)
+                print(format_result(result), flush=True)
+            finally:
+                proc.kill()
+                proc.wait()
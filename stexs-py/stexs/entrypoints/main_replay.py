@@ -0,0 +1,39 @@
+import argparse
+import json
+import logging
+import sys
+
+from stexs.bootstrap import bootstrap_exchange
+from stexs.io.journal import read_journal
+from stexs.services.logger import log
+from stexs.services.replay import replay_journal
+
+# Replays a journal captured with STEX_CAPTURE_JOURNAL into a fresh exchange,
+# bootstrapped the same way as the captured one (so run it with the same
+# environment), as fast as it will go. Checks every trade comes out as it
+# was captured and reports the throughput. Exits non-zero on a mismatch.
+# Rendering the exchange's log costs far more than the exchange itself so it
+# is quietened unless asked for.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a captured exchange journal")
+    parser.add_argument("journal")
+    parser.add_argument("--verbose", action="store_true", help="Keep the exchange log")
+    args = parser.parse_args()
+    if not args.verbose:
+        log.setLevel(logging.WARNING)
+
+    report = replay_journal(read_journal(args.journal), lambda clock: bootstrap_exchange(clock=clock))
+    exchange = report.pop("exchange")
+    exchange.close()
+
+    print("%d messages, %d ticks, %d trades in %.3fs (%.3fs in the exchange)" % (
+        report["messages"], report["ticks"], report["trades"], report["seconds"], report["exchange_seconds"],
+    ))
+    print("%.0f messages/s" % report["messages_per_second"])
+    if report["identical"]:
+        print("Trades identical")
+    else:
+        print("Trades differ:")
+        print(json.dumps(report["mismatch"], indent=2))
+        sys.exit(1)
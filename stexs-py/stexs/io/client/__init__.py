@@ -0,0 +1,8 @@
+from .client import (
+    ExchangeClient,
+    AsyncExchangeClient,
+)
+from .client_exception import (
+    ClientException,
+    ConnectionClosedException,
+)
@@ -0,0 +1,280 @@
+import asyncio
+from collections import deque
+import socket
+
+import stexs.config as config
+from stexs.io.wire import (
+    FrameReader,
+    WireException,
+    JSON_CODEC,
+    encode_message,
+    decode_message,
+)
+
+from .client_exception import ClientException, ConnectionClosedException
+
+def _resolve_host_and_port(host, port, path=None):
+    if path is None and (host is None or port is None):
+        default_host, default_port = config.get_socket_host_and_port()
+        host = default_host if host is None else host
+        port = default_port if port is None else port
+    return host, port
+
+
+class ExchangeClient:
+    # Blocking client that keeps one connection to the exchange open for any
+    # number of requests.
+    #
+    # The exchange answers requests on a connection in the order they were sent,
+    # so requests can be written back to back and their replies read afterwards
+    # (`pipeline`) without waiting a round trip for each. Once subscribed to
+    # market data the connection only carries the feed, read it with `stream`.
+    #
+    # Pass `path` rather than host and port to connect over the exchange's Unix
+    # domain socket.
+
+    def __init__(self, host=None, port=None, path=None, codec=JSON_CODEC, timeout=None, read_size=65536):
+        self.host, self.port = _resolve_host_and_port(host, port, path)
+        self.path = path
+        self.timeout = timeout
+        self.read_size = read_size
+
+        # Replies stay JSON until the exchange accepts the requested codec
+        self.requested_codec = codec
+        self.codec = JSON_CODEC
+
+        self._sock = None
+        self._frames = None
+        self.n_outstanding = 0
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def connect(self):
+        if self._sock:
+            return self
+        if self.path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(self.timeout)
+            try:
+                self._sock.connect(self.path)
+            except OSError:
+                self._sock.close()
+                self._sock = None
+                raise
+        else:
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._frames = FrameReader()
+        self.codec = JSON_CODEC
+        self.n_outstanding = 0
+
+        if self.requested_codec is not JSON_CODEC:
+            self.hello(self.requested_codec)
+        return self
+
+    def close(self):
+        if self._sock:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_sock(self):
+        if not self._sock:
+            raise ClientException("Not connected")
+        return self._sock
+
+    def send(self, msg):
+        self.send_many([msg])
+
+    def send_many(self, msgs):
+        # Everything goes in one write so a pipeline costs one syscall
+        self._get_sock().sendall(b"".join(encode_message(msg, self.codec) for msg in msgs))
+        self.n_outstanding += len(msgs)
+
+    def recv(self):
+        payload = self._frames.read_frame(self._get_sock(), self.read_size)
+        if payload is None:
+            self.close()
+            raise ConnectionClosedException("Connection closed by exchange")
+        if self.n_outstanding > 0:
+            self.n_outstanding -= 1
+        return decode_message(payload)
+
+    def request(self, msg):
+        self.send(msg)
+        return self.recv()
+
+    def pipeline(self, msgs):
+        self.send_many(msgs)
+        return [self.recv() for _ in msgs]
+
+    def hello(self, codec):
+        reply = self.request({
+            "message_type": "hello",
+            "encoding": codec.name,
+        })
+        if reply.get("response_code") == 0:
+            self.codec = codec
+        return reply
+
+    def subscribe(self, symbols):
+        return self.request({
+            "message_type": "market_data_subscribe",
+            "symbols": symbols,
+        })
+
+    def stream(self):
+        # Feed messages as they arrive, until the exchange hangs up
+        while True:
+            try:
+                yield self.recv()
+            except ConnectionClosedException:
+                return
+
+
+class AsyncExchangeClient:
+    # asyncio flavour of ExchangeClient.
+    #
+    # Many tasks may share one client and call `request` at once. Each request
+    # queues a future for its reply and a reader task resolves them in order as
+    # replies come back, anything arriving with no request waiting on it (the
+    # market data feed) is queued for `stream` instead.
+
+    def __init__(self, host=None, port=None, path=None, codec=JSON_CODEC, read_size=65536):
+        self.host, self.port = _resolve_host_and_port(host, port, path)
+        self.path = path
+        self.read_size = read_size
+
+        self.requested_codec = codec
+        self.codec = JSON_CODEC
+
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._waiting = deque()
+        self._feed = None
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._read_task.done()
+
+    @property
+    def n_outstanding(self):
+        return len(self._waiting)
+
+    async def connect(self):
+        if self._writer:
+            return self
+        if self.path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            sock = self._writer.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.codec = JSON_CODEC
+        self._waiting = deque()
+        self._feed = asyncio.Queue()
+        self._read_task = asyncio.create_task(self._read_replies())
+
+        if self.requested_codec is not JSON_CODEC:
+            await self.hello(self.requested_codec)
+        return self
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self._writer = None
+        if self._read_task:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _read_replies(self):
+        frames = FrameReader()
+        try:
+            while True:
+                data = await self._reader.read(self.read_size)
+                if not data:
+                    break
+                for payload in frames.feed(data):
+                    msg = decode_message(payload)
+                    if len(self._waiting) > 0:
+                        fut = self._waiting.popleft()
+                        if not fut.done():
+                            fut.set_result(msg)
+                    else:
+                        self._feed.put_nowait(msg)
+        except (ConnectionError, OSError, ValueError, WireException) as e:
+            self._feed.put_nowait(e)
+        finally:
+            # Nothing else is coming so fail anyone still waiting
+            while len(self._waiting) > 0:
+                fut = self._waiting.popleft()
+                if not fut.done():
+                    fut.set_exception(ConnectionClosedException("Connection closed by exchange"))
+            self._feed.put_nowait(None)
+
+    def send(self, msg):
+        # Write a request without waiting, returning a future for its reply
+        if not self.connected:
+            raise ClientException("Not connected")
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting.append(fut)
+        self._writer.write(encode_message(msg, self.codec))
+        return fut
+
+    async def request(self, msg):
+        fut = self.send(msg)
+        await self._writer.drain()
+        return await fut
+
+    async def pipeline(self, msgs):
+        futs = [self.send(msg) for msg in msgs]
+        await self._writer.drain()
+        return await asyncio.gather(*futs)
+
+    async def hello(self, codec):
+        reply = await self.request({
+            "message_type": "hello",
+            "encoding": codec.name,
+        })
+        if reply.get("response_code") == 0:
+            self.codec = codec
+        return reply
+
+    async def subscribe(self, symbols):
+        return await self.request({
+            "message_type": "market_data_subscribe",
+            "symbols": symbols,
+        })
+
+    async def stream(self):
+        while True:
+            msg = await self._feed.get()
+            if msg is None:
+                return
+            if isinstance(msg, Exception):
+                raise ConnectionClosedException("Connection to exchange failed") from msg
+            yield msg
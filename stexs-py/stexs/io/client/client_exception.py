@@ -0,0 +1,5 @@
+class ClientException(Exception):
+    pass
+
+class ConnectionClosedException(ClientException):
+    pass
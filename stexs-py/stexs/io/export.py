@@ -0,0 +1,249 @@
+import math
+import os
+import struct
+import zipfile
+
+from stexs.services import orderbook
+
+# Bulk export of the order store, the trade tapes and the broker positions as
+# columnar files for offline analysis. Tables are read a chunk at a time,
+# each chunk under its symbol's lock and the lock let go in between, so an
+# export of a busy exchange only ever holds up matching for one chunk.
+#
+# NumPy is needed for .npy and .npz files and pyarrow for Parquet, both are
+# only imported once an export asks for them.
+
+EXPORT_CHUNK_SIZE = 65536
+
+# Columns as NumPy dtypes. Strings are fixed width ASCII in .npy files and
+# anything longer is cut short, Parquet keeps them whole
+ORDER_COLUMNS = [
+    ("txid", "S64"),
+    ("csid", "S64"),
+    ("symbol", "S16"),
+    ("side", "S4"),
+    ("ts", "i8"),
+    ("price", "f8"), # NaN for market orders
+    ("volume", "i8"),
+    ("closed", "?"),
+    ("tif", "S3"),
+    ("expire_ts", "f8"),
+    ("stop_price", "f8"),
+]
+TRADE_COLUMNS = [
+    ("symbol", "S16"),
+    ("seq", "i8"),
+    ("tid", "S16"),
+    ("ts", "i8"),
+    ("buy_txid", "S64"),
+    ("sell_txids", "S256"), # Comma separated
+    ("avg_price", "f8"),
+    ("total_price", "f8"),
+    ("volume", "i8"),
+    ("excess", "i8"),
+]
+POSITION_COLUMNS = [
+    ("broker", "S16"),
+    ("csid", "S64"),
+    ("asset", "S16"),
+    ("settled", "f8"),
+    ("reserved", "f8"),
+]
+
+FORMATS = ["npy", "npz", "parquet"]
+
+def _import_numpy():
+    try:
+        import numpy as np
+    except ImportError as e:
+        raise ImportError("Exporting needs numpy") from e
+    return np
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Exporting to Parquet needs pyarrow") from e
+    return pa, pq
+
+def has_pyarrow():
+    try:
+        _import_pyarrow()
+    except ImportError:
+        return False
+    return True
+
+def _price(price):
+    if price is None or not math.isfinite(price):
+        return math.nan
+    return float(price)
+
+
+class _NpyTable:
+    # Writes rows to a .npy file as they come. The header is written with room
+    # to spare and filled in with the row count on close, so nothing but the
+    # current chunk is ever held in memory
+
+    def __init__(self, np, path, columns):
+        self._np = np
+        self.path = path
+        self.dtype = np.dtype(columns)
+        self.n = 0
+        self._descr = np.lib.format.dtype_to_descr(self.dtype)
+        self._header_size = 64 * math.ceil((11 + len(self._header_dict(2 ** 63))) / 64)
+        self._file = open(path, "wb")
+        self._file.write(self._header(0))
+
+    def _header_dict(self, n):
+        return "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (self._descr, n)
+
+    def _header(self, n):
+        header = self._header_dict(n).ljust(self._header_size - 11) + "\n"
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+    def write(self, rows):
+        self._file.write(self._np.array(rows, dtype=self.dtype).tobytes())
+        self.n += len(rows)
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(self._header(self.n))
+        self._file.close()
+
+
+class _ParquetTable:
+    # Writes each chunk of rows as a row group of a Parquet file
+
+    _TYPES = {"S": "string", "i": "int64", "f": "float64", "b": "bool_"}
+
+    def __init__(self, pa, pq, path, columns):
+        self._pa = pa
+        self.path = path
+        self.schema = pa.schema([(name, getattr(pa, self._TYPES[dtype[0] if dtype != "?" else "b"])()) for name, dtype in columns])
+        self.n = 0
+        self._writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        arrays = [self._pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self.schema))
+        self.n += len(rows)
+
+    def close(self):
+        self._writer.close()
+
+
+def _order_row(order):
+    return (
+        order.txid,
+        str(order.csid),
+        order.symbol,
+        order.side,
+        order.ts,
+        _price(order.price),
+        order.volume,
+        order.closed,
+        order.tif,
+        _price(order.expire_ts),
+        _price(order.stop_price),
+    )
+
+def _order_chunks(exchange, chunk_size):
+    # Orders in the store then the stops still waiting to trigger, which are
+    # kept off the store until they do
+    for symbol in sorted(exchange.stalls):
+        stops = exchange.stop_books[symbol]
+        with exchange.symbol_locks.hold(symbol):
+            txids = orderbook.list_txids_for_symbol(symbol)
+            stop_txids = stops.txids()
+        for i in range(0, len(txids), chunk_size):
+            with exchange.symbol_locks.hold(symbol):
+                yield [_order_row(order) for order in orderbook.peek_orders(symbol, txids[i:i + chunk_size])]
+        for i in range(0, len(stop_txids), chunk_size):
+            with exchange.symbol_locks.hold(symbol):
+                yield [_order_row(order) for order in map(stops.get, stop_txids[i:i + chunk_size]) if order]
+
+def _trade_chunks(exchange, chunk_size):
+    for symbol in sorted(exchange.stalls):
+        stall = exchange.stalls[symbol]
+        with exchange.symbol_locks.hold(symbol):
+            n_trades = len(stall.order_history)
+        for i in range(0, n_trades, chunk_size):
+            with exchange.symbol_locks.hold(symbol):
+                trades = stall.order_history[i:i + chunk_size]
+            yield [
+                (
+                    symbol,
+                    i + j + 1,
+                    trade.tid,
+                    trade.ts,
+                    str(trade.buy_txid),
+                    ",".join(str(txid) for txid in trade.sell_txids),
+                    float(trade.avg_price),
+                    float(trade.total_price),
+                    trade.volume,
+                    trade.excess,
+                )
+                for j, trade in enumerate(trades)
+            ]
+
+def _position_chunks(exchange, chunk_size):
+    for broker_id in sorted(exchange.brokers):
+        ledger = exchange.brokers[broker_id].ledger
+        csids = ledger.accounts()
+        for i in range(0, len(csids), chunk_size):
+            yield [
+                (broker_id, csid, asset, float(entry.settled), float(entry.reserved))
+                for csid in csids[i:i + chunk_size]
+                for asset, entry in sorted(ledger.get_account(csid).items())
+            ]
+
+TABLES = {
+    "orders": (ORDER_COLUMNS, _order_chunks),
+    "trades": (TRADE_COLUMNS, _trade_chunks),
+    "positions": (POSITION_COLUMNS, _position_chunks),
+}
+
+def export_exchange(exchange, directory, formats=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # Write every table to `directory` in each of `formats`, by default an
+    # exchange.npz plus Parquet files when pyarrow is there. Returns the rows
+    # written per table
+    if formats is None:
+        formats = ["npz"] + (["parquet"] if has_pyarrow() else [])
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError("Unknown export format %s" % fmt)
+    np = _import_numpy() if "npy" in formats or "npz" in formats else None
+    pa, pq = _import_pyarrow() if "parquet" in formats else (None, None)
+    os.makedirs(directory, exist_ok=True)
+
+    counts = {}
+    npy_paths = []
+    for name, (columns, chunks) in TABLES.items():
+        tables = []
+        if np:
+            tables.append(_NpyTable(np, os.path.join(directory, "%s.npy" % name), columns))
+            npy_paths.append(tables[-1].path)
+        if pa:
+            tables.append(_ParquetTable(pa, pq, os.path.join(directory, "%s.parquet" % name), columns))
+        try:
+            for rows in chunks(exchange, chunk_size):
+                if len(rows) == 0:
+                    continue
+                for table in tables:
+                    table.write(rows)
+        finally:
+            for table in tables:
+                table.close()
+        counts[name] = tables[0].n
+
+    if "npz" in formats:
+        # Members are stored rather than compressed so bundling streams from disk
+        with zipfile.ZipFile(os.path.join(directory, "exchange.npz"), "w", zipfile.ZIP_STORED, allowZip64=True) as npz:
+            for path in npy_paths:
+                npz.write(path, os.path.basename(path))
+        if "npy" not in formats:
+            for path in npy_paths:
+                os.remove(path)
+    return counts
@@ -0,0 +1,98 @@
+from dataclasses import dataclass
+from typing import Any
+import struct
+import threading
+import time
+
+from stexs.io.wire import JSON_CODEC
+from stexs.services.logger import log
+
+# A journal is an append-only file of records, each a fixed header of kind,
+# payload length, sequence number and timestamp followed by the payload
+# encoded as a JSON frame payload would be. The exchange journals every
+# message it receives and every tick in the order it takes them, along with
+# the trades they produce so a replay has something to check itself against.
+JOURNAL_RECORD = struct.Struct("!BIqd")
+
+KIND_MESSAGE = 1
+KIND_TICK = 2
+KIND_TRADE = 3
+
+# Buffered records are written out once this many bytes or seconds have built
+# up since the last flush, so a crash loses at most that much of the journal
+JOURNAL_FLUSH_BYTES = 256 * 1024
+JOURNAL_FLUSH_SECONDS = 1.0
+
+@dataclass
+class JournalRecord:
+    kind: int
+    seq: int
+    ts: float
+    payload: Any
+
+
+class JournalWriter:
+    # Appends records to a journal file from any number of threads, sequence
+    # numbers follow the order records are written in
+
+    def __init__(self, path, buffering=1024 * 1024, flush_bytes=JOURNAL_FLUSH_BYTES, flush_interval=JOURNAL_FLUSH_SECONDS, clock=time.monotonic):
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._file = open(path, "ab", buffering=buffering)
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self._flushed_at = clock()
+        self.seq = 0
+
+    def append(self, kind, ts, payload=None):
+        data = JSON_CODEC.encode(payload) if payload is not None else b""
+        with self._lock:
+            self.seq += 1
+            self._file.write(JOURNAL_RECORD.pack(kind, len(data), self.seq, ts))
+            self._file.write(data)
+            # The time bound is only checked as records come in, a quiet
+            # journal is flushed by the next record or by closing it
+            self._unflushed += JOURNAL_RECORD.size + len(data)
+            if self._unflushed >= self.flush_bytes or self._clock() - self._flushed_at >= self.flush_interval:
+                self._flush()
+            return self.seq
+
+    def _flush(self):
+        self._file.flush()
+        self._unflushed = 0
+        self._flushed_at = self._clock()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_journal(path):
+    # Yields the JournalRecords in a journal, stopping at a record cut short
+    # by the writer going away mid-write
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(JOURNAL_RECORD.size)
+            if len(header) == 0:
+                return
+            if len(header) < JOURNAL_RECORD.size:
+                log.warning("Journal %s ends in a partial record header" % path)
+                return
+            kind, size, seq, ts = JOURNAL_RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                log.warning("Journal %s ends in a partial record" % path)
+                return
+            yield JournalRecord(kind=kind, seq=seq, ts=ts, payload=JSON_CODEC.decode(data) if size else None)
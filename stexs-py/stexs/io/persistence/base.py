@@ -4,6 +4,7 @@
 import abc
 from stexs.domain import model
 import copy
+import threading
 
 class AbstractRepository(abc.ABC):
 
@@ -46,9 +47,13 @@ class GenericVersionedMemoryDict():
 
         # Keep tabs on object version checked out by `get` and ensure it is matched
         # when committing as a means to detect concurrent commits, effectively provides
-        # compare-and-set (could still be caught in a race condition)
+        # compare-and-set
         self._versions = {}
 
+        # Held to check and apply a commit and to read an object with its
+        # version, so other threads see all of a commit or none of it
+        self._lock = threading.RLock()
+
     def _xget(self, key_path):
         node = self._objects
         for key in key_path.split('>'):
@@ -61,11 +66,12 @@ class GenericVersionedMemoryDict():
         # Providing read committed isolation as only committed data can be
         # read from _objects and _staged_objects cannot be read by other UoW
         # Does not guard against read skew and the like...
-        if key_path not in self._versions:
-            return None, None
+        with self._lock:
+            if key_path not in self._versions:
+                return None, None
 
-        node = self._xget(key_path)
-        return node, self._versions[key_path]
+            node = self._xget(key_path)
+            return node, self._versions[key_path]
 
     def _add(self, key_path, obj):
         node = self._objects
@@ -87,20 +93,71 @@ class GenericVersionedMemoryDict():
                  break
         return node is not None
 
+    def _delete(self, key_path):
+        node = self._objects
+        path = key_path.split('>')
+        for key in path[:-1]:
+            node = node.get(key)
+            if node is None:
+                return
+        node.pop(path[-1], None)
+        self._versions.pop(key_path, None)
+
 class GenericVersionedMemoryDictWrapper():
+    # The store is shared by every UoW but staging is kept per thread, so UoWs
+    # on different threads only meet when they commit and have their versions
+    # checked
 
     def __init__(self, *args, **kwargs):
         self._store = GenericVersionedMemoryDict()
-        self._staged_objects = {}
-        self._staged_versions = {}
+        self._local = threading.local()
+
+    def _staging(self):
+        local = self._local
+        if not hasattr(local, "objects"):
+            local.objects = {}
+            local.versions = {}
+            local.deletes = set()
+        return local
+
+    @property
+    def _staged_objects(self):
+        return self._staging().objects
+
+    @_staged_objects.setter
+    def _staged_objects(self, value):
+        self._staging().objects = value
+
+    @property
+    def _staged_versions(self):
+        return self._staging().versions
+
+    @_staged_versions.setter
+    def _staged_versions(self, value):
+        self._staging().versions = value
+
+    @property
+    def _staged_deletes(self):
+        return self._staging().deletes
+
+    @_staged_deletes.setter
+    def _staged_deletes(self, value):
+        self._staging().deletes = value
 
     def _check(self, key_path):
         return self._store._check(key_path)
 
+    def _delete(self, key_path):
+        # Deleted from the store on commit
+        self._staged_objects.pop(key_path, None)
+        self._staged_versions.pop(key_path, None)
+        self._staged_deletes.add(key_path)
+
     def _add(self, key_path, obj):
         if key_path not in self._staged_objects:
             self._staged_versions[key_path] = 0
         self._staged_objects[key_path] = obj
+        self._staged_deletes.discard(key_path)
 
     def _get(self, key_path):
         # Providing read committed isolation as only committed data can be
@@ -108,6 +165,8 @@ class GenericVersionedMemoryDictWrapper():
         # Does not guard against read skew and the like...
         if key_path in self._staged_objects:
             return self._staged_objects[key_path]
+        elif key_path in self._staged_deletes:
+            return None
         else:
             obj, version = self._store._get(key_path)
 
@@ -125,21 +184,29 @@ class GenericVersionedMemoryDictWrapper():
 
     def _commit(self):
         commits = {}
-
-        for obj_key_path, obj in self._staged_objects.items():
-            if not self._check(obj_key_path):
-                # New
-                self._store._versions[obj_key_path] = 0
-            else:
-                # Check version for concurrent transaction
-                if self._store._versions[obj_key_path] != self._staged_versions[obj_key_path]:
+        staged_objects = self._staged_objects
+        staged_versions = self._staged_versions
+
+        with self._store._lock:
+            # Check every version before applying anything so a rejected commit
+            # leaves the store as it was
+            for obj_key_path in staged_objects:
+                if self._check(obj_key_path) and self._store._versions[obj_key_path] != staged_versions[obj_key_path]:
                     raise Exception("Concurrent commit rejected")
 
-            # Commit to store and increment version
-            self._store._add(obj_key_path, obj)
-            self._store._versions[obj_key_path] += 1
+            for obj_key_path, obj in staged_objects.items():
+                if not self._check(obj_key_path):
+                    # New
+                    self._store._versions[obj_key_path] = 0
+
+                # Commit to store and increment version
+                self._store._add(obj_key_path, obj)
+                self._store._versions[obj_key_path] += 1
+
+                commits[obj_key_path] = self._store._versions[obj_key_path]
 
-            commits[obj_key_path] = self._store._versions[obj_key_path]
+            for obj_key_path in self._staged_deletes:
+                self._store._delete(obj_key_path)
 
         # Reset staged objects?
         # CRIT TODO Could break commit - edit - commit workflow
@@ -150,21 +217,33 @@ class GenericVersionedMemoryDictWrapper():
     def clear(self):
         self._staged_objects.clear()
         self._staged_versions.clear()
+        self._staged_deletes.clear()
+
+    def discard_prefix(self, prefix):
+        # Drop what this thread has staged under prefix without committing it
+        start = "%s>" % prefix
+        for key_path in [k for k in self._staged_objects if k.startswith(start)]:
+            del self._staged_objects[key_path]
+            self._staged_versions.pop(key_path, None)
+        for key_path in [k for k in self._staged_deletes if k.startswith(start)]:
+            self._staged_deletes.discard(key_path)
 
     def clear_prefix(self, prefix):
-        to_del = ["%s>%s" % (prefix, str(kid)) for kid in self._store._objects[prefix]]
-        for k in to_del:
-            del self._store._versions[k]
+        with self._store._lock:
+            to_del = ["%s>%s" % (prefix, str(kid)) for kid in self._store._objects[prefix]]
+            for k in to_del:
+                del self._store._versions[k]
 
-            if k in self._staged_objects:
-                del self._staged_objects[k]
-                del self._staged_versions[k]
-        del self._store._objects[prefix]
+                if k in self._staged_objects:
+                    del self._staged_objects[k]
+                    del self._staged_versions[k]
+            del self._store._objects[prefix]
 
 
     def _clear(self):
-        self._store._objects.clear()
-        self._store._versions.clear()
+        with self._store._lock:
+            self._store._objects.clear()
+            self._store._versions.clear()
 
 
 class GenericMemoryRepository(AbstractRepository):
@@ -193,6 +272,10 @@ class GenericMemoryRepository(AbstractRepository):
     def _commit(self):
         self.store._commit()
 
+    def _rollback(self):
+        # The store is shared with other prefixes so only discard our own
+        self.store.discard_prefix(self.prefix)
+
 
 ###############################################################################
 
@@ -1,5 +1,8 @@
+from bisect import bisect_right
 import copy
 import heapq
+import threading
+from dataclasses import dataclass
 
 from stexs.io.persistence.base import AbstractUoW, GenericVersionedMemoryDictWrapper
 from stexs.domain.order import Order, OrderRepository
@@ -49,14 +52,83 @@ class OrderbookHeap:
         return self.ask_heap[0]
 
 
+@dataclass(init=False)
+class MatcherOrder:
+    # Resting order as the matcher sees it, mutable so amends keep priority.
+    # Slots are declared by hand (dataclass slots= needs py3.10) which rules
+    # out field defaults, so removed is defaulted in __init__
+    __slots__ = ("symbol", "side", "price", "volume", "ts", "txid", "removed")
+    symbol: str
+    side: str
+    price: float
+    volume: int
+    ts: int
+    txid: str
+    removed: bool
+
+    def __init__(self, symbol, side, price, volume, ts, txid, removed=False):
+        self.symbol = symbol
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.ts = ts
+        self.txid = txid
+        self.removed = removed
+
+
+class _LiveOrders:
+    # Best first view of the orders left on one side of an Orderbook, read
+    # lazily so the matcher only walks as far as it needs to
+
+    __slots__ = ("_orders", "_start")
+
+    def __init__(self, orders, start):
+        self._orders = orders
+        self._start = start
+
+    def __iter__(self):
+        orders = self._orders
+        for i in range(self._start, len(orders)):
+            if not orders[i].removed:
+                yield orders[i]
+
+
 class Orderbook:
+    # Each side is a list of orders sorted best first next to a list of their
+    # sort keys, so an order goes in with a bisect (and a memmove) rather than
+    # a re-sort of the side.
+    #
+    # Removing an order only marks it removed. Orders are matched from the best
+    # end, so removed orders there are stepped over by moving the side's head
+    # index past them, and the dead prefix is cut off once it is half the list.
+    # Removed orders further back are swept out in one pass once they outnumber
+    # the live ones. Either way each removal costs O(1) amortised, and the
+    # matcher reads the side lazily from the head (see live). Reading a whole
+    # side with buy_book or sell_book is a pass over it.
+
     def __init__(self, reference_price):
         self.reference_price = reference_price
         self.highest_bid = None
         self.lowest_ask = None
         self._orderheap = OrderbookHeap()
-        self._BUY = []
-        self._SELL = []
+
+        self._orders = {} # Resting orders by txid
+        self._sides = {
+            "BUY": [],
+            "SELL": [],
+        }
+        self._keys = {
+            "BUY": [],
+            "SELL": [],
+        }
+        self._head = {
+            "BUY": 0,
+            "SELL": 0,
+        }
+        self._n_removed = { # Removed but still in the side past its head
+            "BUY": 0,
+            "SELL": 0,
+        }
 
     def add_price(self, side, price):
         if not price or price == float("inf") or price == float("-inf"):
@@ -71,41 +143,76 @@ class Orderbook:
     def remove_price(self, side, price):
         self._orderheap.remove_price(side, price)
 
-    def add_order(self, side, order):
-        if side == "BUY":
-            self._BUY.append(order)
-        elif side == "SELL":
-            self._SELL.append(order)
-
-        # TODO LOW PERF
-        # This is fine for now but we'd be better off using something like `bisect`
-        # which even supports a straightforward `key` parameter in 3.10, avoiding
-        # the need to import something like `sortedcollection`
+    @staticmethod
+    def _key(side, order):
         side_sign = -1 if side == "BUY" else 1
+        return (order.price * side_sign, order.ts, order.txid)
 
-        # TODO wtf syntax
-        setattr(self, '_'+side, sorted(getattr(self, '_'+side), key=lambda order: (order.price * side_sign, order.ts, order.txid)))
+    def add_order(self, side, order):
+        self._orders[order.txid] = order
+        key = self._key(side, order)
+        # Only the live part of the side is in order, the dead prefix is not
+        i = bisect_right(self._keys[side], key, self._head[side])
+        self._keys[side].insert(i, key)
+        self._sides[side].insert(i, order)
 
         # Add price
         if order.price:
             self.add_price(order.side, order.price)
 
     def purge_order(self, side, txid):
-        # TODO LOW PERF
-        setattr(self, '_'+side, [o for o in getattr(self, '_'+side) if o.txid != txid])
+        order = self._orders.pop(txid, None)
+        if order is None:
+            return None
+        order.removed = True
+        self._n_removed[side] += 1
+        self._prune(side)
+        return order
+
+    def _prune(self, side):
+        orders = self._sides[side]
+        keys = self._keys[side]
+        head = self._head[side]
+        while head < len(orders) and orders[head].removed:
+            head += 1
+            self._n_removed[side] -= 1
+        if head > 0 and head * 2 >= len(orders):
+            del orders[:head]
+            del keys[:head]
+            head = 0
+        self._head[side] = head
+
+        if self._n_removed[side] * 2 > len(orders) - head:
+            live = [i for i in range(head, len(orders)) if not orders[i].removed]
+            self._sides[side] = [orders[i] for i in live]
+            self._keys[side] = [keys[i] for i in live]
+            self._head[side] = 0
+            self._n_removed[side] = 0
+
+    def amend_order(self, txid, volume):
+        # Changes the order where it sits so it keeps its place in the queue
+        order = self._orders.get(txid)
+        if order is not None:
+            order.volume = volume
+        return order
+
+    def get_order(self, txid):
+        return self._orders.get(txid)
+
+    def live(self, side):
+        return _LiveOrders(self._sides[side], self._head[side])
 
     @property
     def sell_book(self):
-        return self._SELL
+        return list(self.live("SELL"))
 
     @property
     def buy_book(self):
-        return self._BUY
+        return list(self.live("BUY"))
 
 
 class MatcherMemoryRepository(OrderRepository):
-    from collections import namedtuple
-    MatcherOrder = namedtuple("MatcherOrder", "symbol side price volume ts txid")
+    MatcherOrder = MatcherOrder
 
     orderbooks = {}
     txid_map = {}
@@ -125,7 +232,9 @@ class MatcherMemoryRepository(OrderRepository):
     def get(self, txid):
         return self.txid_map.get(txid)
     def clear(self):
-        self.orderbooks = {}
+        # Books and txid_map are shared by all instances, so clear in place
+        self.orderbooks.clear()
+        self.txid_map.clear()
     def _commit(self):
         pass
 
@@ -159,6 +268,14 @@ class MatcherMemoryRepository(OrderRepository):
         self.orderbooks[order.symbol].purge_order(order.side, txid)
         return order
 
+    def amend(self, txid, volume):
+        order = self.txid_map.get(txid)
+        if not order:
+            return None
+        order.volume = volume
+        self.orderbooks[order.symbol].amend_order(txid, volume)
+        return order
+
     def update_reference_price(self, symbol, reference_price):
         self.orderbooks[symbol].reference_price = reference_price
 
@@ -168,11 +285,20 @@ class OrderMemoryRepository(OrderRepository):
 
     txid_map = {}
     store = GenericVersionedMemoryDictWrapper()
+    _local = threading.local()
+
+    def _staged_txid_deletes(self):
+        # Like the store's staging, txids deleted by this thread's UoW are only
+        # dropped from txid_map once it commits
+        if not hasattr(self._local, "txid_deletes"):
+            self._local.txid_deletes = {}
+        return self._local.txid_deletes
 
     def add(self, order: Order):
         obj_id = "%s>%s" % (order.symbol, order.txid)
         self.store._add(obj_id, order)
         self.txid_map[order.txid] = obj_id # Primary transaction index
+        self._staged_txid_deletes().pop(order.txid, None)
         log.info("[bold white]ORDR[/] [b]%s[/] %s" % (order.symbol, order))
 
     def get_buy_book_for_symbol(self, symbol: str):
@@ -205,11 +331,38 @@ class OrderMemoryRepository(OrderRepository):
             obj = self.store._get(obj_id)
             return obj
 
+    def delete(self, txid: str):
+        obj_id = self.txid_map.get(txid)
+        if obj_id:
+            self.store._delete(obj_id)
+            self._staged_txid_deletes()[txid] = obj_id
+
+    def list_txids_for_symbol(self, symbol: str):
+        return list(self.store._store._xget(symbol).keys())
+
+    def peek_many(self, symbol: str, txids):
+        # Committed orders as they stand, without checking them out
+        book = self.store._store._xget(symbol)
+        return [book[txid] for txid in txids if txid in book]
+
     def _commit(self):
-        self.store._commit()
+        txid_deletes = self._staged_txid_deletes()
+        with self.store._store._lock:
+            self.store._commit()
+            for txid, obj_id in txid_deletes.items():
+                # Unless another UoW has since added an order under the txid
+                if self.txid_map.get(txid) == obj_id:
+                    del self.txid_map[txid]
+        txid_deletes.clear()
+
+    def _rollback(self):
+        self.store.clear()
+        self._staged_txid_deletes().clear()
 
     def clear(self):
+        self.store.clear()
         self.store._clear()
+        self._staged_txid_deletes().clear()
 
 class OrderMemoryUoW(AbstractUoW):
     def __init__(self, *args, **kwargs):
@@ -221,7 +374,8 @@ class OrderMemoryUoW(AbstractUoW):
         self.committed = True
 
     def rollback(self):
-        pass
+        # Anything checked out and not committed is discarded
+        self.orders._rollback()
 
 class MatcherMemoryUoW(AbstractUoW):
     def __init__(self, *args, **kwargs):
@@ -16,7 +16,8 @@ class MemoryStockUoW(AbstractUoW):
         self.stocks._commit()
 
     def rollback(self):
-        pass
+        # Anything checked out and not committed is discarded
+        self.stocks._rollback()
 
 class StockSqliteRepository(GenericSqliteRepository):
 
@@ -15,5 +15,6 @@ class MemoryClientUoW(AbstractUoW):
         self.users._commit()
 
     def rollback(self):
-        pass
+        # Anything checked out and not committed is discarded
+        self.users._rollback()
 
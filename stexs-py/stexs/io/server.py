@@ -0,0 +1,291 @@
+import asyncio
+import os
+
+from stexs.io.wire import (
+    FrameReader,
+    WireException,
+    JSON_CODEC,
+    encode_message,
+    decode_message,
+    negotiate_codec,
+)
+from stexs.services.logger import log
+
+MALFORMED_MESSAGE_REPLY = {
+    "response_type": "exception",
+    "response_code": 1,
+    "msg": "malformed message",
+}
+
+class AsyncExchangeServer:
+    # Serves many client connections from one event loop.
+    #
+    # Each connection gets its own task to read and parse messages, but none of
+    # them touch the Exchange directly. Parsed messages are queued for a single
+    # sequencer task which is the only caller of `Exchange.recv`, so messages are
+    # applied strictly in arrival order no matter how many clients are connected.
+    #
+    # Clients may pipeline: every message read from a connection is queued for
+    # the sequencer straight away, and a writer task per connection sends the
+    # replies back in the order the messages arrived as each one completes.
+    #
+    # A connection that subscribes to market data has the feed streamed to it
+    # by its writer task between replies. The connection is still read, so it
+    # can go on to unsubscribe, and its subscriptions go when it disconnects.
+    #
+    # Co-located clients can skip TCP by connecting to the Unix domain socket at
+    # `path`, or by attaching to a shared memory ring gateway (`add_ring_gateway`).
+    # Every transport feeds the same sequencer.
+    #
+    # Every `tick_interval` seconds the sequencer also gets a tick, on which it
+    # lets the exchange expire orders even when no messages are arriving.
+
+    def __init__(self, exchange, host=None, port=None, path=None, read_size=65536, max_pending=10000, max_pipeline=1000, tick_interval=1.0):
+        self.exchange = exchange
+        self.host = host
+        self.port = port
+        self.path = path
+        self.read_size = read_size
+        self.max_pipeline = max_pipeline
+        self.tick_interval = tick_interval
+
+        self.max_pending = max_pending
+        self._pending = None # Made in the loop that serves it, see _queue
+        self._servers = []
+        self._sequencer = None
+        self._ticker = None
+        self._streams = set()
+        self._gateways = []
+
+        self.n_connections = 0
+        self.n_sequenced = 0
+
+    @property
+    def sockets(self):
+        return [sock for server in self._servers for sock in server.sockets]
+
+    async def start(self):
+        self._pending = asyncio.Queue(maxsize=self.max_pending)
+        self._sequencer = asyncio.create_task(self._sequence())
+        if self.tick_interval and hasattr(self.exchange, "tick"):
+            self._ticker = asyncio.create_task(self._tick())
+        if self.path is None or self.port is not None:
+            self._servers.append(await asyncio.start_server(self._handle_connection, self.host, self.port))
+        if self.path is not None:
+            self._servers.append(await asyncio.start_unix_server(self._handle_connection, self.path))
+        log.debug("Listening: %s" % str([sock.getsockname() for sock in self.sockets]))
+
+    async def serve_forever(self):
+        if not self._sequencer:
+            await self.start()
+        await asyncio.gather(*[server.serve_forever() for server in self._servers])
+
+    def add_ring_gateway(self, gateway):
+        # Serve a shared memory ring gateway from this server's loop
+        gateway.start(self)
+        self._gateways.append(gateway)
+        return gateway
+
+    async def close(self):
+        for gateway in self._gateways:
+            await gateway.close()
+        self._gateways = []
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+        if self._ticker:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+        if self._sequencer:
+            self._sequencer.cancel()
+            try:
+                await self._sequencer
+            except asyncio.CancelledError:
+                pass
+
+    def _queue(self):
+        # Queues bind to the loop current when they are made before py3.10, so
+        # the queue is only made once the server is running in its loop
+        if self._pending is None:
+            self._pending = asyncio.Queue(maxsize=self.max_pending)
+        return self._pending
+
+    async def enqueue(self, msg):
+        # Queue a message for the sequencer, returning a future for its reply
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue().put((msg, fut))
+        return fut
+
+    async def submit(self, msg):
+        # Queue a message for the sequencer and wait for its reply
+        return await (await self.enqueue(msg))
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            await self._queue().put((None, None))
+
+    async def _sequence(self):
+        while True:
+            msg, fut = await self._queue().get()
+            if msg is None:
+                # Tick from _tick
+                try:
+                    self.exchange.tick()
+                except Exception as e:
+                    log.exception(e)
+                for wake in self._streams:
+                    wake.set()
+                continue
+            try:
+                reply = self.exchange.recv(msg)
+            except Exception as e:
+                log.exception(e)
+                reply = {
+                    "response_type": "exception",
+                    "response_code": 70,
+                    "msg": str(e),
+                }
+            self.n_sequenced += 1
+            if not fut.cancelled():
+                fut.set_result(reply)
+
+            # Anything sequenced may have published to the market data feed
+            for wake in self._streams:
+                wake.set()
+
+    async def _handle_connection(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        log.debug("Connection from %s" % str(addr))
+        self.n_connections += 1
+
+        # (reply future, ready reply, codec to switch to after writing it)
+        replies = asyncio.Queue(maxsize=self.max_pipeline)
+        writer_task = asyncio.create_task(self._write_replies(writer, replies))
+
+        frames = FrameReader()
+        codec = JSON_CODEC
+        try:
+            while not writer_task.done():
+                data = await reader.read(self.read_size)
+                if not data:
+                    break
+
+                for payload in frames.feed(data):
+                    try:
+                        msg = decode_message(payload)
+                    except (ValueError, WireException) as e:
+                        log.debug(e)
+                        await replies.put((None, MALFORMED_MESSAGE_REPLY, None))
+                        continue
+
+                    if isinstance(msg, dict) and msg.get("message_type") == "hello":
+                        # Encoding is per connection so never reaches the exchange
+                        codec, reply = negotiate_codec(msg, codec)
+                        await replies.put((None, reply, codec))
+                        continue
+
+                    fut = await self.enqueue(msg)
+                    await replies.put((fut, None, None))
+        except (ConnectionError, OSError, WireException) as e:
+            log.debug(e)
+        finally:
+            await replies.put(None)
+            await writer_task
+            self.n_connections -= 1
+            writer.close()
+
+    async def _write_replies(self, writer, replies):
+        codec = JSON_CODEC
+        broken = False
+        subs = {} # Subscriptions streamed to this connection by id
+        wake = asyncio.Event()
+        next_item = None
+        try:
+            while True:
+                if subs and not broken:
+                    # Stream the feed until the next reply is ready to go
+                    if next_item is None:
+                        next_item = asyncio.ensure_future(replies.get())
+                    woken = asyncio.ensure_future(wake.wait())
+                    await asyncio.wait([next_item, woken], return_when=asyncio.FIRST_COMPLETED)
+                    woken.cancel()
+                    if not next_item.done():
+                        wake.clear()
+                        try:
+                            await self._stream_market_data(writer, subs, codec)
+                        except (ConnectionError, OSError) as e:
+                            log.debug(e)
+                            broken = True
+                            self._close_streams(subs, wake)
+                        continue
+                    item = next_item.result()
+                    next_item = None
+                else:
+                    item = await replies.get()
+
+                if item is None:
+                    break
+                if broken:
+                    # Keep consuming so the reader never blocks on a dead connection
+                    continue
+
+                fut, reply, next_codec = item
+                if fut:
+                    reply = await fut
+                try:
+                    writer.write(encode_message(reply, codec))
+                    if next_codec:
+                        codec = next_codec
+
+                    if isinstance(reply, dict) and reply.get("response_code") == 0:
+                        if reply.get("response_type") == "market_data_subscribe":
+                            sub = self.exchange.feed.get_subscription(reply["subscription_id"])
+                            if sub:
+                                subs[sub.sid] = sub
+                                self._streams.add(wake)
+                                # Send the snapshots straight away
+                                wake.set()
+                        elif reply.get("response_type") == "market_data_unsubscribe":
+                            subs.pop(reply["subscription_id"], None)
+                            if not subs:
+                                self._streams.discard(wake)
+
+                    if replies.empty():
+                        # Only wait on the socket once caught up with the reader
+                        await writer.drain()
+                except (ConnectionError, OSError) as e:
+                    log.debug(e)
+                    broken = True
+                    self._close_streams(subs, wake)
+
+            if not broken:
+                try:
+                    await writer.drain()
+                except (ConnectionError, OSError) as e:
+                    log.debug(e)
+        finally:
+            if next_item is not None:
+                next_item.cancel()
+            self._close_streams(subs, wake)
+
+    async def _stream_market_data(self, writer, subs, codec=JSON_CODEC):
+        for sid, sub in list(subs.items()):
+            for msg in sub.drain():
+                writer.write(encode_message(msg, codec))
+            if sub.closed:
+                # Unsubscribed from another connection
+                del subs[sid]
+        await writer.drain()
+
+    def _close_streams(self, subs, wake):
+        self._streams.discard(wake)
+        for sid in subs:
+            self.exchange.feed.unsubscribe(sid)
+        subs.clear()
@@ -0,0 +1,13 @@
+from .ring import (
+    SPSCRing,
+)
+from .gateway import (
+    RingGateway,
+)
+from .client import (
+    ShmExchangeClient,
+)
+from .shm_exception import (
+    ShmException,
+    RingFullException,
+)
@@ -0,0 +1,103 @@
+import time
+
+from stexs.io.wire import BINARY_CODEC, decode_message
+
+from .ring import SPSCRing
+from .shm_exception import ShmException, RingFullException
+
+class ShmExchangeClient:
+    # Blocking client for a RingGateway, with the same request API as the
+    # socket ExchangeClient. There is nothing to wait on in shared memory so
+    # both sides poll: the client spins on the reply ring for `spin` polls then
+    # sleeps `idle_sleep` between polls until `timeout`.
+
+    def __init__(self, name, codec=BINARY_CODEC, timeout=None, spin=1000, idle_sleep=0.00005):
+        self.name = name
+        self.codec = codec
+        self.timeout = timeout
+        self.spin = spin
+        self.idle_sleep = idle_sleep
+
+        self.requests = None
+        self.replies = None
+        self.n_outstanding = 0
+
+    @property
+    def connected(self):
+        return self.requests is not None
+
+    def connect(self):
+        if self.requests is not None:
+            return self
+        self.requests = SPSCRing.attach("%s-req" % self.name)
+        self.replies = SPSCRing.attach("%s-rep" % self.name)
+        # Anything left behind by a previous client is not ours
+        self.replies.read_many()
+        self.n_outstanding = 0
+        return self
+
+    def close(self):
+        for ring in [self.requests, self.replies]:
+            if ring is not None:
+                ring.close()
+        self.requests = self.replies = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_rings(self):
+        if self.requests is None:
+            raise ShmException("Not connected")
+        return self.requests, self.replies
+
+    def _poll(self, attempt):
+        # Run `attempt` until it succeeds, returning False on timeout
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        polls = 0
+        while not attempt():
+            polls += 1
+            if polls > self.spin:
+                if deadline is not None and time.perf_counter() > deadline:
+                    return False
+                time.sleep(self.idle_sleep)
+        return True
+
+    def send(self, msg):
+        self.send_many([msg])
+
+    def send_many(self, msgs):
+        requests, _ = self._get_rings()
+        for msg in msgs:
+            record = self.codec.encode(msg)
+            if not self._poll(lambda: requests.write(record)):
+                raise RingFullException("Request ring full")
+            self.n_outstanding += 1
+
+    def recv(self):
+        _, replies = self._get_rings()
+        records = []
+        def attempt():
+            records.extend(replies.read_many(1))
+            return len(records) > 0
+        if not self._poll(attempt):
+            raise TimeoutError("No reply from exchange")
+        if self.n_outstanding > 0:
+            self.n_outstanding -= 1
+        return decode_message(records[0])
+
+    def request(self, msg):
+        self.send(msg)
+        return self.recv()
+
+    def pipeline(self, msgs):
+        # A pipeline longer than the ring would block on replies nobody is reading
+        requests, _ = self._get_rings()
+        replies = []
+        for i in range(0, len(msgs), requests.capacity):
+            batch = msgs[i:i + requests.capacity]
+            self.send_many(batch)
+            replies.extend(self.recv() for _ in batch)
+        return replies
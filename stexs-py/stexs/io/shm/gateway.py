@@ -0,0 +1,95 @@
+import asyncio
+
+from stexs.io.server import MALFORMED_MESSAGE_REPLY
+from stexs.io.wire import WireException, BINARY_CODEC, decode_message
+from stexs.services.logger import log
+
+from .ring import SPSCRing
+
+UNSUPPORTED_MESSAGE_REPLY = {
+    "response_type": "exception",
+    "response_code": 1,
+    "msg": "unsupported on this transport",
+}
+
+REPLY_TOO_LARGE_REPLY = {
+    "response_type": "exception",
+    "response_code": 1,
+    "msg": "reply too large for ring",
+}
+
+class RingGateway:
+    # Serves one co-located client over a pair of shared memory rings, the
+    # client writes requests to `<name>-req` and reads replies from `<name>-rep`.
+    #
+    # Requests go to the same sequencer as socket clients. Replies are written in
+    # request order in the gateway codec, which defaults to binary so orders and
+    # acks travel as fixed size records, anything else falls back to JSON and
+    # must still fit a slot. The feed is not carried, so subscribing is refused.
+    #
+    # The gateway polls from the server's event loop, spinning on the ring for a
+    # while after each request before backing off to sleeping between polls.
+
+    def __init__(self, name, capacity=1024, slot_size=1024, codec=BINARY_CODEC, spin=100, idle_sleep=0.0001):
+        self.name = name
+        self.codec = codec
+        self.spin = spin
+        self.idle_sleep = idle_sleep
+
+        self.requests = SPSCRing.create("%s-req" % name, capacity=capacity, slot_size=slot_size)
+        self.replies = SPSCRing.create("%s-rep" % name, capacity=capacity, slot_size=slot_size)
+        self._task = None
+
+        self.n_requests = 0
+
+    def start(self, server):
+        self._task = asyncio.create_task(self._serve(server))
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.requests.unlink()
+        self.replies.unlink()
+
+    async def _serve(self, server):
+        idle = 0
+        while True:
+            records = self.requests.read_many()
+            if len(records) == 0:
+                idle += 1
+                await asyncio.sleep(0 if idle < self.spin else self.idle_sleep)
+                continue
+            idle = 0
+
+            # Queue the whole batch before waiting on any of it
+            pending = []
+            for record in records:
+                try:
+                    msg = decode_message(record)
+                except (ValueError, WireException) as e:
+                    log.debug(e)
+                    pending.append(MALFORMED_MESSAGE_REPLY)
+                    continue
+                if isinstance(msg, dict) and msg.get("message_type") in ["hello", "market_data_subscribe"]:
+                    pending.append(UNSUPPORTED_MESSAGE_REPLY)
+                    continue
+                pending.append(await server.enqueue(msg))
+            self.n_requests += len(records)
+
+            for reply in pending:
+                if isinstance(reply, asyncio.Future):
+                    reply = await reply
+                await self._write_reply(reply)
+
+    async def _write_reply(self, reply):
+        record = self.codec.encode(reply)
+        if len(record) > self.replies.max_record_size:
+            record = self.codec.encode(REPLY_TOO_LARGE_REPLY)
+        while not self.replies.write(record):
+            # Client is not keeping up with its replies
+            await asyncio.sleep(self.idle_sleep)
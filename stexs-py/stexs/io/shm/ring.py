@@ -0,0 +1,124 @@
+from multiprocessing import resource_tracker, shared_memory
+import struct
+
+from .shm_exception import ShmException
+
+# Single producer, single consumer ring of fixed size slots in shared memory.
+#
+#   0    head      next slot the producer will write, only the producer writes it
+#   64   tail      next slot the consumer will read, only the consumer writes it
+#   128  capacity, slot size
+#   192  slots     capacity * slot size, each a 4 byte length and a record
+#
+# Head and tail sit on their own cache lines so the two sides do not contend.
+# A record is written into its slot before head is moved past it, and read out
+# of its slot before tail is moved past it, so neither side needs a lock. Each
+# side keeps its last view of the other's counter and only re-reads it from
+# shared memory when the ring looks full (or empty).
+COUNTER = struct.Struct("=Q")
+GEOMETRY = struct.Struct("=QQ")
+SLOT_HEADER = struct.Struct("=I")
+
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+GEOMETRY_OFFSET = 128
+SLOTS_OFFSET = 192
+
+# Segments created by this process, see `SPSCRing.attach`
+_created = set()
+
+class SPSCRing:
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self._buf = shm.buf
+
+        self.capacity, self.slot_size = GEOMETRY.unpack_from(self._buf, GEOMETRY_OFFSET)
+        self.max_record_size = self.slot_size - SLOT_HEADER.size
+        self._mask = self.capacity - 1
+
+        self._head = COUNTER.unpack_from(self._buf, HEAD_OFFSET)[0]
+        self._tail = COUNTER.unpack_from(self._buf, TAIL_OFFSET)[0]
+
+    @classmethod
+    def create(cls, name, capacity=1024, slot_size=256):
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ShmException("Ring capacity must be a power of two")
+        if slot_size <= SLOT_HEADER.size:
+            raise ShmException("Ring slots too small")
+        shm = shared_memory.SharedMemory(name=name, create=True, size=SLOTS_OFFSET + (capacity * slot_size))
+        COUNTER.pack_into(shm.buf, HEAD_OFFSET, 0)
+        COUNTER.pack_into(shm.buf, TAIL_OFFSET, 0)
+        GEOMETRY.pack_into(shm.buf, GEOMETRY_OFFSET, capacity, slot_size)
+        _created.add(shm._name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError as e:
+            raise ShmException("No ring named %s" % name) from e
+        # The resource tracker would unlink the segment when this process exits,
+        # only the side that created it should do that
+        if shm._name not in _created:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    def __len__(self):
+        return COUNTER.unpack_from(self._buf, HEAD_OFFSET)[0] - COUNTER.unpack_from(self._buf, TAIL_OFFSET)[0]
+
+    def write(self, record: bytes):
+        # Producer side, returns False if the ring is full
+        size = len(record)
+        if size > self.max_record_size:
+            raise ShmException("Record of %d bytes does not fit a %d byte slot" % (size, self.max_record_size))
+
+        head = self._head
+        if head - self._tail >= self.capacity:
+            self._tail = COUNTER.unpack_from(self._buf, TAIL_OFFSET)[0]
+            if head - self._tail >= self.capacity:
+                return False
+
+        offset = SLOTS_OFFSET + ((head & self._mask) * self.slot_size)
+        SLOT_HEADER.pack_into(self._buf, offset, size)
+        self._buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + size] = record
+        self._head = head + 1
+        COUNTER.pack_into(self._buf, HEAD_OFFSET, self._head)
+        return True
+
+    def read(self):
+        # Consumer side, returns None if the ring is empty
+        records = self.read_many(1)
+        return records[0] if records else None
+
+    def read_many(self, n=None):
+        # Consumer side, takes up to n records and frees their slots in one go
+        tail = self._tail
+        if n is None or tail + n > self._head:
+            self._head = COUNTER.unpack_from(self._buf, HEAD_OFFSET)[0]
+            if tail >= self._head:
+                return []
+
+        end = self._head if n is None else min(self._head, tail + n)
+        records = []
+        for i in range(tail, end):
+            offset = SLOTS_OFFSET + ((i & self._mask) * self.slot_size)
+            (size,) = SLOT_HEADER.unpack_from(self._buf, offset)
+            records.append(bytes(self._buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + size]))
+        self._tail = end
+        COUNTER.pack_into(self._buf, TAIL_OFFSET, self._tail)
+        return records
+
+    def close(self):
+        if self._buf is not None:
+            self._buf = None
+            self.shm.close()
+
+    def unlink(self):
+        self.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm._name)
@@ -0,0 +1,5 @@
+class ShmException(Exception):
+    pass
+
+class RingFullException(ShmException):
+    pass
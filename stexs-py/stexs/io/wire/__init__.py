@@ -0,0 +1,18 @@
+from .framing import (
+    FrameReader,
+    encode_frame,
+    encode_message,
+    decode_message,
+)
+from .codec import (
+    JsonCodec,
+    BinaryCodec,
+    JSON_CODEC,
+    BINARY_CODEC,
+    negotiate_codec,
+)
+from .wire_exception import (
+    WireException,
+    FramingException,
+    CodecException,
+)
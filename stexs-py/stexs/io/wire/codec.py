@@ -0,0 +1,292 @@
+import json
+import math
+import struct
+
+from .wire_exception import CodecException
+
+# Frame payloads are either JSON or a fixed layout binary record. JSON always
+# starts with a printable character so binary records start with a tag byte
+# below 0x20, which lets any payload be decoded without knowing the encoding
+# the sender picked. Each connection starts out on JSON and may switch its
+# replies to binary by negotiating with a hello message.
+#
+# Only the hot message types have records, everything else stays JSON. Prices
+# travel as doubles (NaN for a market order) rather than strings, so decoded
+# binary messages carry float prices.
+
+TAG_NEW_ORDER = 0x01
+TAG_ORDER_ACK = 0x02
+TAG_TRADE = 0x03
+TAG_BOOK_DELTA = 0x04
+
+SIDES = ["BUY", "SELL"]
+SIDE_CODES = {side: i for i, side in enumerate(SIDES)}
+
+NEW_ORDER = struct.Struct("!B16s8s16sB8sdqqq")
+NEW_ORDER_FIELDS = frozenset(["message_type", "txid", "broker_id", "account_id", "side", "symbol", "price", "volume", "sender_ts", "corr_id"])
+
+ORDER_ACK = struct.Struct("!B16s16sqB8sdq?3sddq")
+ORDER_ACK_FIELDS = frozenset(["order", "response_type", "response_code", "msg", "corr_id"])
+ORDER_FIELDS = frozenset(["txid", "csid", "ts", "side", "symbol", "price", "volume", "closed", "tif", "expire_ts", "stop_price"])
+
+TRADE = struct.Struct("!B8sq8sqdq16sB")
+TRADE_SELL = struct.Struct("!16s")
+TRADE_FIELDS = frozenset(["response_type", "response_code", "msg", "symbol", "seq", "tid", "ts", "price", "volume", "buy_txid", "sell_txids"])
+
+BOOK_DELTA = struct.Struct("!B8sqH")
+BOOK_DELTA_LEVEL = struct.Struct("!Bdq")
+BOOK_DELTA_FIELDS = frozenset(["response_type", "response_code", "msg", "symbol", "seq", "deltas"])
+
+NO_SENDER_TS = -1
+NO_CORR_ID = -1
+
+class _Unencodable(Exception):
+    pass
+
+def _pack_str(value, size):
+    if not isinstance(value, str):
+        raise _Unencodable()
+    packed = value.encode("ascii")
+    if len(packed) > size:
+        raise _Unencodable()
+    return packed
+
+def _unpack_str(value):
+    return value.rstrip(b"\x00").decode("ascii")
+
+def _pack_price(price):
+    if price is None or price == '':
+        return math.nan
+    return float(price)
+
+def _pack_corr_id(msg):
+    # Only integer correlation ids fit in a record
+    if "corr_id" not in msg:
+        return NO_CORR_ID
+    corr_id = msg["corr_id"]
+    if type(corr_id) is not int or corr_id < 0:
+        raise _Unencodable()
+    return corr_id
+
+def _unpack_corr_id(msg, corr_id):
+    if corr_id != NO_CORR_ID:
+        msg["corr_id"] = corr_id
+    return msg
+
+def _unpack_price(price):
+    return None if math.isnan(price) else price
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, msg):
+        return json.dumps(msg).encode("ascii")
+
+    def decode(self, payload: bytes):
+        if len(payload) > 0 and payload[0] < 0x20:
+            return BINARY_CODEC.decode(payload)
+        return json.loads(payload.decode("ascii"))
+
+
+class BinaryCodec(JsonCodec):
+    name = "binary"
+
+    def encode(self, msg):
+        if isinstance(msg, dict):
+            try:
+                if msg.get("message_type") == "new_order":
+                    return self._encode_new_order(msg)
+                response_type = msg.get("response_type")
+                if response_type == "new_order":
+                    return self._encode_order_ack(msg)
+                elif response_type == "trade":
+                    return self._encode_trade(msg)
+                elif response_type == "book_delta":
+                    return self._encode_book_delta(msg)
+            except (_Unencodable, KeyError, TypeError, ValueError, struct.error):
+                pass
+        # Anything without a record, or that does not fit one, goes as JSON
+        return super().encode(msg)
+
+    def decode(self, payload: bytes):
+        if len(payload) == 0 or payload[0] >= 0x20:
+            return json.loads(payload.decode("ascii"))
+        try:
+            tag = payload[0]
+            if tag == TAG_NEW_ORDER:
+                return self._decode_new_order(payload)
+            elif tag == TAG_ORDER_ACK:
+                return self._decode_order_ack(payload)
+            elif tag == TAG_TRADE:
+                return self._decode_trade(payload)
+            elif tag == TAG_BOOK_DELTA:
+                return self._decode_book_delta(payload)
+        except (struct.error, UnicodeDecodeError, IndexError) as e:
+            raise CodecException("Malformed binary record") from e
+        raise CodecException("Unknown binary record")
+
+    def _encode_new_order(self, msg):
+        if not NEW_ORDER_FIELDS.issuperset(msg):
+            raise _Unencodable()
+        return NEW_ORDER.pack(
+            TAG_NEW_ORDER,
+            _pack_str(msg["txid"], 16),
+            _pack_str(msg["broker_id"], 8),
+            _pack_str(msg["account_id"], 16),
+            SIDE_CODES[msg["side"]],
+            _pack_str(msg["symbol"], 8),
+            _pack_price(msg["price"]),
+            msg["volume"],
+            msg.get("sender_ts", NO_SENDER_TS),
+            _pack_corr_id(msg),
+        )
+
+    def _decode_new_order(self, payload):
+        _, txid, broker_id, account_id, side, symbol, price, volume, sender_ts, corr_id = NEW_ORDER.unpack(payload)
+        msg = {
+            "message_type": "new_order",
+            "txid": _unpack_str(txid),
+            "broker_id": _unpack_str(broker_id),
+            "account_id": _unpack_str(account_id),
+            "side": SIDES[side],
+            "symbol": _unpack_str(symbol),
+            "price": _unpack_price(price),
+            "volume": volume,
+        }
+        if sender_ts != NO_SENDER_TS:
+            msg["sender_ts"] = sender_ts
+        return _unpack_corr_id(msg, corr_id)
+
+    def _encode_order_ack(self, msg):
+        order = msg["order"]
+        if msg["response_code"] != 0 or msg["msg"] != "ok" or not ORDER_ACK_FIELDS.issuperset(msg) or set(order) != ORDER_FIELDS:
+            raise _Unencodable()
+        return ORDER_ACK.pack(
+            TAG_ORDER_ACK,
+            _pack_str(order["txid"], 16),
+            _pack_str(order["csid"], 16),
+            order["ts"],
+            SIDE_CODES[order["side"]],
+            _pack_str(order["symbol"], 8),
+            _pack_price(order["price"]),
+            order["volume"],
+            order["closed"],
+            _pack_str(order["tif"], 3),
+            _pack_price(order["expire_ts"]),
+            _pack_price(order["stop_price"]),
+            _pack_corr_id(msg),
+        )
+
+    def _decode_order_ack(self, payload):
+        _, txid, csid, ts, side, symbol, price, volume, closed, tif, expire_ts, stop_price, corr_id = ORDER_ACK.unpack(payload)
+        return _unpack_corr_id({
+            "order": {
+                "txid": _unpack_str(txid),
+                "csid": _unpack_str(csid),
+                "ts": ts,
+                "side": SIDES[side],
+                "symbol": _unpack_str(symbol),
+                "price": _unpack_price(price),
+                "volume": volume,
+                "closed": closed,
+                "tif": _unpack_str(tif),
+                "expire_ts": _unpack_price(expire_ts),
+                "stop_price": _unpack_price(stop_price),
+            },
+            "response_type": "new_order",
+            "response_code": 0,
+            "msg": "ok",
+        }, corr_id)
+
+    def _encode_trade(self, msg):
+        if not TRADE_FIELDS.issuperset(msg) or len(msg["sell_txids"]) > 255:
+            raise _Unencodable()
+        return TRADE.pack(
+            TAG_TRADE,
+            _pack_str(msg["symbol"], 8),
+            msg["seq"],
+            _pack_str(msg["tid"], 8),
+            msg["ts"],
+            _pack_price(msg["price"]),
+            msg["volume"],
+            _pack_str(msg["buy_txid"], 16),
+            len(msg["sell_txids"]),
+        ) + b"".join(TRADE_SELL.pack(_pack_str(txid, 16)) for txid in msg["sell_txids"])
+
+    def _decode_trade(self, payload):
+        _, symbol, seq, tid, ts, price, volume, buy_txid, n_sells = TRADE.unpack_from(payload)
+        if len(payload) != TRADE.size + (n_sells * TRADE_SELL.size):
+            raise CodecException("Malformed binary record")
+        return {
+            "response_type": "trade",
+            "response_code": 0,
+            "msg": "ok",
+            "symbol": _unpack_str(symbol),
+            "seq": seq,
+            "tid": _unpack_str(tid),
+            "ts": ts,
+            "price": _unpack_price(price),
+            "volume": volume,
+            "buy_txid": _unpack_str(buy_txid),
+            "sell_txids": [_unpack_str(sell[0]) for sell in TRADE_SELL.iter_unpack(payload[TRADE.size:])],
+        }
+
+    def _encode_book_delta(self, msg):
+        if not BOOK_DELTA_FIELDS.issuperset(msg):
+            raise _Unencodable()
+        return BOOK_DELTA.pack(
+            TAG_BOOK_DELTA,
+            _pack_str(msg["symbol"], 8),
+            msg["seq"],
+            len(msg["deltas"]),
+        ) + b"".join(BOOK_DELTA_LEVEL.pack(SIDE_CODES[delta["side"]], float(delta["price"]), delta["volume"]) for delta in msg["deltas"])
+
+    def _decode_book_delta(self, payload):
+        _, symbol, seq, n_deltas = BOOK_DELTA.unpack_from(payload)
+        if len(payload) != BOOK_DELTA.size + (n_deltas * BOOK_DELTA_LEVEL.size):
+            raise CodecException("Malformed binary record")
+        return {
+            "response_type": "book_delta",
+            "response_code": 0,
+            "msg": "ok",
+            "symbol": _unpack_str(symbol),
+            "seq": seq,
+            "deltas": [
+                {"side": SIDES[side], "price": price, "volume": volume}
+                for side, price, volume in BOOK_DELTA_LEVEL.iter_unpack(payload[BOOK_DELTA.size:])
+            ],
+        }
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+CODECS = {
+    JSON_CODEC.name: JSON_CODEC,
+    BINARY_CODEC.name: BINARY_CODEC,
+}
+
+def negotiate_codec(msg, current=JSON_CODEC):
+    # Handle a hello message, returning the codec to use for the connection's
+    # replies from now on and the reply to send (in the current encoding)
+    encoding = msg.get("encoding", current.name)
+    if encoding not in CODECS:
+        codec = current
+        reply = {
+            "response_type": "exception",
+            "response_code": 1,
+            "msg": "unknown encoding",
+            "encodings": sorted(CODECS),
+        }
+    else:
+        codec = CODECS[encoding]
+        reply = {
+            "response_type": "hello",
+            "response_code": 0,
+            "msg": "ok",
+            "encoding": encoding,
+            "encodings": sorted(CODECS),
+        }
+    if "corr_id" in msg:
+        reply["corr_id"] = msg["corr_id"]
+    return codec, reply
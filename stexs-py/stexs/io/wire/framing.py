@@ -0,0 +1,70 @@
+from collections import deque
+import struct
+from typing import List
+
+from .codec import JSON_CODEC
+from .wire_exception import FramingException
+
+# Every message on the exchange socket is sent as a frame: a 4 byte big endian
+# payload length followed by the payload itself. Frames make no assumption about
+# how TCP splits or coalesces the stream, so one read may yield many messages
+# and one message may take many reads.
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+def encode_frame(payload: bytes):
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FramingException("Frame too large")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def encode_message(msg, codec=JSON_CODEC):
+    return encode_frame(codec.encode(msg))
+
+def decode_message(payload: bytes):
+    # Either encoding can be decoded regardless of what was negotiated
+    return JSON_CODEC.decode(payload)
+
+
+class FrameReader:
+    # Buffers bytes from the socket and cuts complete frames out of them
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._ready = deque()
+
+    @property
+    def buffered(self):
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self._buffer.extend(data)
+
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= FRAME_HEADER.size:
+            (size,) = FRAME_HEADER.unpack_from(self._buffer, offset)
+            if size > self.max_frame_size:
+                # Cannot resync a stream after a bad header so give up on it
+                self._buffer.clear()
+                raise FramingException("Frame too large")
+
+            end = offset + FRAME_HEADER.size + size
+            if end > len(self._buffer):
+                break
+            frames.append(bytes(self._buffer[offset + FRAME_HEADER.size:end]))
+            offset = end
+
+        if offset:
+            del self._buffer[:offset]
+        return frames
+
+    def read_frame(self, sock, read_size=65536):
+        # Blocking helper for clients that want one frame at a time from a socket,
+        # frames that arrive alongside it are held for the following calls
+        while len(self._ready) == 0:
+            data = sock.recv(read_size)
+            if not data:
+                return None
+            self._ready.extend(self.feed(data))
+        return self._ready.popleft()
@@ -0,0 +1,8 @@
+class WireException(Exception):
+    pass
+
+class FramingException(WireException):
+    pass
+
+class CodecException(WireException):
+    pass
@@ -0,0 +1,115 @@
+from stexs.services.logger import log
+import threading
+import time
+
+THROTTLED_RESPONSE_CODE = 429
+
+class TokenBucket:
+    # Holds up to `burst` tokens, refilled at `rate` tokens a second
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + ((now - self.updated) * self.rate))
+            self.updated = now
+        return self.tokens
+
+    def wait_time(self, cost=1):
+        # Seconds until `cost` tokens will be available, as of the last refill
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return None
+        return (cost - self.tokens) / self.rate
+
+
+class AdmissionControl:
+    # Token bucket rate limits on the messages each broker, and each account at
+    # a broker, may send into the exchange.
+    #
+    # A message must find a token in both its account and broker bucket to be
+    # admitted and only then are the tokens taken, so a throttled account does
+    # not also use up its broker's allowance. Limits are (rate, burst) pairs,
+    # the defaults apply to any broker or account without a limit of its own
+    # and None leaves them unlimited.
+
+    def __init__(self, broker_limit=None, account_limit=None, clock=time.monotonic):
+        self.broker_limit = broker_limit
+        self.account_limit = account_limit
+        self.clock = clock
+
+        self._broker_limits = {}
+        self._account_limits = {}
+        self._broker_buckets = {}
+        self._account_buckets = {}
+
+        self.n_admitted = 0
+        self.n_throttled = 0
+        self.throttled_brokers = {}
+        self.throttled_accounts = {}
+        self._lock = threading.Lock()
+
+    def set_broker_limit(self, broker_id, rate, burst):
+        self._broker_limits[broker_id] = (rate, burst)
+        self._broker_buckets.pop(broker_id, None)
+
+    def set_account_limit(self, broker_id, account_id, rate, burst):
+        self._account_limits[(broker_id, account_id)] = (rate, burst)
+        self._account_buckets.pop((broker_id, account_id), None)
+
+    def _get_bucket(self, buckets, limits, default, key, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            limit = limits.get(key, default)
+            if limit is None:
+                return None
+            bucket = TokenBucket(*limit, now=now)
+            buckets[key] = bucket
+        bucket.refill(now)
+        return bucket
+
+    def admit(self, broker_id, account_id):
+        # Returns None to admit the message, or the throttled reply to send back
+        with self._lock:
+            return self._admit(broker_id, account_id)
+
+    def _admit(self, broker_id, account_id):
+        now = self.clock()
+        account = self._get_bucket(self._account_buckets, self._account_limits, self.account_limit, (broker_id, account_id), now)
+        broker = self._get_bucket(self._broker_buckets, self._broker_limits, self.broker_limit, broker_id, now)
+
+        for scope, bucket in [("account", account), ("broker", broker)]:
+            if bucket is not None and bucket.tokens < 1:
+                self.n_throttled += 1
+                if scope == "account":
+                    key = "%s/%s" % (broker_id, account_id)
+                    self.throttled_accounts[key] = self.throttled_accounts.get(key, 0) + 1
+                else:
+                    self.throttled_brokers[broker_id] = self.throttled_brokers.get(broker_id, 0) + 1
+                log.debug("[bold red]THROTTLE[/] %s %s/%s" % (scope, broker_id, account_id))
+                return {
+                    "response_type": "exception",
+                    "response_code": THROTTLED_RESPONSE_CODE,
+                    "msg": "rate limited",
+                    "scope": scope,
+                    "retry_after": bucket.wait_time(),
+                }
+
+        for bucket in [account, broker]:
+            if bucket is not None:
+                bucket.tokens -= 1
+        self.n_admitted += 1
+        return None
+
+    def metrics(self):
+        return {
+            "admitted": self.n_admitted,
+            "throttled": self.n_throttled,
+            "throttled_brokers": dict(self.throttled_brokers),
+            "throttled_accounts": dict(self.throttled_accounts),
+        }
@@ -1,25 +1,53 @@
 from stexs.domain.broker import (
+    CASH,
     Client,
+    Ledger,
     OrderScreeningException,
 )
+from stexs.domain.order import Order
 from stexs.services.logger import log
 import stexs.io.persistence as iop
 from typing import List, Dict
+import threading
 
 class Broker:
 
-    def __init__(self, code, name, *args, **kwargs):
+    def __init__(self, code, name, *args, ledger=None, **kwargs):
         # TODO Little hack for now
         self.code = code
         self.name = name
         self.user_uow = iop.user.MemoryClientUoW
 
+        # Reservations made by screened orders, the client store only ever
+        # holds settled balances and holdings. Any Ledger-like backend will do,
+        # eg. an ArrayLedger for many accounts.
+        #
+        # Once an account is in the ledger the ledger holds its balances and
+        # the client store is not written on settlement, get_user builds the
+        # Client from the ledger when asked
+        self.ledger = ledger if ledger is not None else Ledger()
+        self._reservations = {} # txid -> (csid, asset, amount)
+        self._reservations_lock = threading.Lock()
+
     def get_user(self, csid: str, uow=None):
         if not uow:
             uow = self.user_uow()
 
         with uow:
-            return uow.users.get(csid)
+            user = uow.users.get(csid)
+        if user and self.ledger.has_account(csid):
+            return self._client_view(user)
+        return user
+
+    def _client_view(self, user: Client):
+        # Client with its settled balance and holdings as the ledger has them
+        account = self.ledger.get_account(user.csid)
+        return Client(
+            csid=user.csid,
+            name=user.name,
+            balance=account[CASH].settled if CASH in account else 0,
+            holdings={asset: entry.settled for asset, entry in account.items() if asset != CASH},
+        )
 
     def add_users(self, clients: List[Client], uow=None):
         if not uow:
@@ -30,7 +58,97 @@ class Broker:
                 uow.users.add(client)
             uow.commit()
 
+        for client in clients:
+            self.ledger.open_account(client.csid, self._ledger_balances(client))
+
+    @staticmethod
+    def _ledger_balances(user: Client):
+        balances = dict(user.holdings)
+        balances[CASH] = user.balance
+        return balances
+
+    def _open_ledger_account(self, csid, uow=None):
+        # Accounts are read into the ledger the first time they are seen, after
+        # that screening never needs to check out the client
+        if self.ledger.has_account(csid):
+            return True
+        user = self.get_user(csid, uow=uow)
+        if not user:
+            return False
+        self.ledger.open_account(csid, self._ledger_balances(user))
+        return True
+
+    def has_user(self, csid: str, uow=None):
+        return self._open_ledger_account(csid, uow=uow)
+
+    def get_account_ledger(self, csid: str, uow=None):
+        if not self._open_ledger_account(csid, uow=uow):
+            return None
+        return self.ledger.get_account(csid)
+
+    def _order_reservation(self, order, reference_price=None):
+        if order.side == "BUY":
+            # Market orders have no price so reserve at the reference price
+            order_price = order.price
+            if not order_price:
+                order_price = reference_price
+            if not order_price:
+                raise OrderScreeningException("No reference price")
+            return CASH, order_price * order.volume
+        return order.symbol, order.volume
+
+    def reserve_order(self, order, reference_price=None, force=False, uow=None):
+        # Check the account can cover the order and reserve what it needs in one
+        # step, a txid only ever holds one reservation
+        if not self._open_ledger_account(order.csid, uow=uow):
+            raise OrderScreeningException("Unknown user")
+        asset, amount = self._order_reservation(order, reference_price=reference_price)
+        with self._reservations_lock:
+            if order.txid in self._reservations:
+                return True
+            self.ledger.reserve(order.csid, asset, amount, force=force)
+            self._reservations[order.txid] = (order.csid, asset, amount)
+        return True
+
+    def release_order(self, txid):
+        # Hand back whatever an order still has reserved, returns the amount
+        with self._reservations_lock:
+            reservation = self._reservations.pop(txid, None)
+        if not reservation:
+            return 0
+        csid, asset, amount = reservation
+        self.ledger.release(csid, asset, amount)
+        return amount
+
+    def reduce_order(self, txid, volume, new_volume):
+        # Hand back the part of an order's reservation it no longer needs when
+        # its volume is amended down, returns the amount released
+        with self._reservations_lock:
+            reservation = self._reservations.get(txid)
+            if not reservation:
+                return 0
+            csid, asset, amount = reservation
+            keep = amount * new_volume / volume if asset == CASH else new_volume
+            self._reservations[txid] = (csid, asset, keep)
+        self.ledger.release(csid, asset, amount - keep)
+        return amount - keep
+
+    def _take_reservation(self, txid, amount=None):
+        # Take up to `amount` of an order's reservation to settle against, any
+        # left over follows the remainder of a split order
+        with self._reservations_lock:
+            reservation = self._reservations.pop(txid, None)
+            if not reservation:
+                return 0
+            csid, asset, reserved = reservation
+            if amount is None or amount >= reserved:
+                return reserved
+            self._reservations[Order.split_txid(txid)] = (csid, asset, reserved - amount)
+            return amount
+
     def validate_preorder(self, user, order, reference_price=None):
+        # Screens against a checked out client without reserving anything, the
+        # exchange uses reserve_order
         # Replace the order.price with reference_price if the user is submitting a market order
         try:
             order_price = order.price
@@ -41,38 +159,57 @@ class Broker:
             raise e
         return True
 
-    def update_users(self, buy_orders, sell_orders, executed=False, uow=None, reference_price=None):
+    def update_users(self, buy_orders, sell_orders, executed=False, uow=None, reference_price=None, trades=None):
         if not uow:
             uow = self.user_uow()
 
-        with uow:
-            if not executed:
-                for order in buy_orders:
-                    # order.price may be None before execution
-                    # Use the reference_price
-                    order_price = order.price
-                    if not order_price:
-                        order_price = reference_price
-
-                    self.adjust_balance(order.csid, order_price * order.volume * -1, uow=uow)
-                for order in sell_orders:
-                    self.adjust_holding(order.csid, order.symbol, order.volume * -1, uow=uow)
-            else:
-                for order in buy_orders:
-                    self.adjust_holding(order.csid, order.symbol, order.volume, uow=uow)
-                for order in sell_orders:
-                    # CRIT TODO Check this works with splits
-                    self.adjust_balance(order.csid, order.price * order.volume, uow=uow)
-            uow.commit()
+        # Orders from other brokers are not ours to settle
+        buy_orders = [order for order in buy_orders if self._open_ledger_account(order.csid, uow=uow)]
+        sell_orders = [order for order in sell_orders if self._open_ledger_account(order.csid, uow=uow)]
+
+        if not executed:
+            # New orders only need their reservation, which screening will
+            # normally have made already
+            for order in buy_orders + sell_orders:
+                self.reserve_order(order, reference_price=reference_price, force=True, uow=uow)
+            return
+
+        # Settle at the price the trade executed at where it is known
+        prices = {}
+        for trade in trades or []:
+            prices[trade.buy_txid] = trade.avg_price
+            for txid in trade.sell_txids:
+                prices[txid] = trade.avg_price
+
+        # Ledger moves for the whole batch go in one settle_many
+        settlements = []
+        for order in buy_orders:
+            order_price = prices.get(order.txid, order.price or reference_price)
+            cost = order_price * order.volume
+            # Buys always fill in full so the whole reservation goes
+            settlements.append((order.csid, CASH, self._take_reservation(order.txid), -cost))
+            settlements.append((order.csid, order.symbol, 0, order.volume))
+        for order in sell_orders:
+            order_price = prices.get(order.txid, order.price)
+            proceeds = order_price * order.volume
+            settlements.append((order.csid, order.symbol, self._take_reservation(order.txid, order.volume), -order.volume))
+            settlements.append((order.csid, CASH, 0, proceeds))
+        self.ledger.settle_many(settlements)
 
     def adjust_balance(self, csid, adjust_balance, uow=None):
+        # Goes to the ledger once it has the account, the client store until then
+        if self.ledger.has_account(csid):
+            self.ledger.deposit(csid, CASH, adjust_balance)
+            log.info("[bold magenta]USER[/] [b]CASH[/] %s=%.3f" % (csid, self.ledger.get(csid, CASH).settled))
+            return
+
         if not uow:
             uow = self.user_uow()
 
         with uow:
             user = uow.users.get(csid)
             user.adjust_balance(adjust_balance)
-
+            uow.commit()
         log.info("[bold magenta]USER[/] [b]CASH[/] %s=%.3f" % (csid, user.balance))
 
     def adjust_holding(self, csid, symbol, adjust_qty, uow=None):
@@ -84,9 +221,14 @@ class Broker:
         #if not symbol in stock_list:
         #    raise Exception("Unknown symbol")
 
+        if self.ledger.has_account(csid):
+            self.ledger.deposit(csid, symbol, adjust_qty)
+            log.info("[bold magenta]USER[/] [b]HOLD[/] %s:%s=%.3f" % (csid, symbol, self.ledger.get(csid, symbol).settled))
+            return
+
         with uow:
             user = uow.users.get(csid)
             user.adjust_holding(symbol, adjust_qty)
-
+            uow.commit()
         log.info("[bold magenta]USER[/] [b]HOLD[/] %s:%s=%.3f" % (csid, symbol, user.holdings[symbol]))
 
@@ -1,16 +1,31 @@
 from stexs.domain import model
-from stexs.domain.order import Order
+from stexs.domain.bars import BarSeries
+from stexs.domain.order import Order, AmendOrderVolumeException, TIME_IN_FORCE
 from stexs.domain.broker import OrderScreeningException
 from stexs.services.logger import log
 from stexs.services import orderbook, matcher
+from stexs.services.settlement import SettlementWorker
+from stexs.services.marketdata import MarketDataFeed
+from stexs.services.admission import AdmissionControl
+from stexs.services.open_orders import OpenOrderIndex
+from stexs.services.timing_wheel import TimingWheel
+from stexs.services.stops import StopBook
+from stexs.services.locks import LockTable
 import stexs.io.persistence as iop
+from stexs.io.journal import KIND_MESSAGE, KIND_TICK, KIND_TRADE
 from typing import List, Dict
+import threading
 import time
 from dataclasses import asdict as dataclasses_asdict
 
 #TODO This should probably get injected somewhere but this works for now
 STOCK_UOW = iop.stock.MemoryStockUoW
 
+# Most trades one instrument_trade_history reply will carry
+MAX_TRADE_HISTORY_PAGE = 1000
+# Most orders a side of an instrument_snapshot book will carry
+MAX_SNAPSHOT_DEPTH = 1000
+
 def _default_stock_uow():
     return STOCK_UOW()
 
@@ -30,7 +45,15 @@ def list_stocks(uow=None):
 
 class Exchange:
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, async_settlement=False, settlement_batch_size=100, snapshot_interval=100, admission: AdmissionControl=None, clock=time.time, journal=None, **kwargs):
+        # Each message is handled as of the time it arrived, read once from
+        # `clock` so a replay can hand back the times of the original run
+        self.clock = clock
+        self._message_time = threading.local()
+
+        # Optionally journal every message, tick and trade for replay
+        self.journal = journal
+
         self.txid_set = set([]) # set = field(default_factory=set)
         self.stalls = {} # Dict[str, model.MarketStall] = field(default_factory = dict)
         self.brokers = {}
@@ -38,11 +61,42 @@ class Exchange:
         # TODO Little hack for now
         self.stock_uow = _default_stock_uow
 
+        # Pushes book deltas and trade prints to subscribed readers
+        self.feed = MarketDataFeed(snapshot_interval=snapshot_interval)
+
+        # Resting txids by broker and account for mass cancels
+        self.open_orders = OpenOrderIndex()
+
+        # Stops waiting on the last price, by symbol
+        self.stop_books = {}
+
+        # GTT txids by when they expire
+        self.expiries = TimingWheel(tick=1.0, now=self.clock())
+
+        # Messages may be handled on several threads at once. Book, stall and
+        # stop book state is held per symbol and client state per account, and
+        # a symbol's lock is always taken before any account's so orders for
+        # different symbols go ahead in parallel without deadlocking
+        self.symbol_locks = LockTable()
+        self.account_locks = LockTable(stripes=1024)
+        self._txid_lock = threading.Lock()
+
+        # Optionally settle executed trades on a worker rather than between matches
+        self.settlement = None
+        if async_settlement:
+            self.settlement = SettlementWorker(self.settle_users, batch_size=settlement_batch_size)
+            self.settlement.start()
+
+        # Optionally rate limit what each broker and account may send
+        self.admission = admission
+
     def add_stocks(self, stocks: List[model.Stock]):
         for stock in stocks:
             add_stock(stock, uow=self.stock_uow())
             self.stalls[stock.symbol] = model.MarketStall(stock=stock)
             matcher.add_book(stock.symbol, reference_price=1)
+            self.stop_books[stock.symbol] = StopBook()
+            self.feed.add_book(stock.symbol)
 
     def list_stocks(self):
         return list_stocks(uow=self.stock_uow())
@@ -50,10 +104,40 @@ class Exchange:
     def add_broker(self, broker):
         self.brokers[broker.code] = broker
 
-    def update_users(self, buys, sells, executed=False, reference_price=None):
+    def update_users(self, buys, sells, executed=False, reference_price=None, trades=None):
         # Emit buys and sells to brokers
-        for broker in self.brokers:
-            self.brokers[broker].update_users(buys, sells, executed=executed, reference_price=reference_price)
+        with self.account_locks.hold(*[order.csid for order in buys + sells]):
+            for broker in self.brokers:
+                self.brokers[broker].update_users(buys, sells, executed=executed, reference_price=reference_price, trades=trades)
+
+    def settle_users(self, buys, sells, trades=None):
+        self.update_users(buys, sells, executed=True, trades=trades)
+
+    def flush_settlement(self, timeout=None):
+        # Wait for all trades executed so far to reach the client stores, False
+        # if any of them failed to settle
+        if not self.settlement:
+            return True
+        return self.settlement.flush(timeout=timeout)
+
+    def retry_settlement(self):
+        # Queue trades that failed to settle to be settled again
+        if not self.settlement:
+            return 0
+        return self.settlement.retry_failed()
+
+    def settlement_lag(self):
+        if not self.settlement:
+            return {
+                "pending": 0,
+                "lag_seconds": 0.0,
+                "failed": 0,
+            }
+        return self.settlement.lag()
+
+    def close(self):
+        if self.settlement:
+            self.settlement.stop()
 
     def handle_order(self, msg):
         response = {}
@@ -64,8 +148,10 @@ class Exchange:
                 "response_code": 404,
                 "msg": "malformed broker",
             }
-        user = self.brokers[msg["broker_id"]].get_user(msg["account_id"])
-        if not user:
+        broker = self.brokers[msg["broker_id"]]
+        with self.account_locks.hold(msg["account_id"]):
+            known_user = broker.has_user(msg["account_id"])
+        if not known_user:
             return {
                 "response_type": "exception",
                 "response_code": 404,
@@ -80,6 +166,42 @@ class Exchange:
             # Allow market orders with price of None
             price = None
 
+        # GTD is taken as another name for GTT
+        tif = msg.get("time_in_force") or "GTC"
+        if tif == "GTD":
+            tif = "GTT"
+        expire_ts = msg.get("expire_ts") if tif == "GTT" else None
+        if tif not in TIME_IN_FORCE:
+            return {
+                "response_type": "exception",
+                "response_code": 1,
+                "msg": "malformed time in force",
+            }
+        if tif == "GTT" and (not isinstance(expire_ts, (int, float)) or expire_ts <= self.now()):
+            return {
+                "response_type": "exception",
+                "response_code": 1,
+                "msg": "malformed expire_ts",
+            }
+
+        # Stop orders wait off the book until the last price reaches stop_price,
+        # then go in as a market order or, with a price, as a limit order
+        stop_price = msg.get("stop_price")
+        if stop_price is not None and (not isinstance(stop_price, (int, float)) or stop_price <= 0):
+            return {
+                "response_type": "exception",
+                "response_code": 1,
+                "msg": "malformed stop_price",
+            }
+
+        # Holdings are whole shares, so a fractional volume could never settle
+        if not isinstance(msg["volume"], int):
+            return {
+                "response_type": "exception",
+                "response_code": 1,
+                "msg": "malformed volume",
+            }
+
         #TODO CRIT Order vol > 0
         order = Order(
             txid=msg["txid"], # TODO need a customer side and exchange side tx
@@ -88,7 +210,10 @@ class Exchange:
             symbol=msg["symbol"],
             price=price if price != float("inf") and price != float("-inf") else None,
             volume=msg["volume"],
-            ts=int(time.time()),
+            ts=int(self.now()),
+            tif=tif,
+            expire_ts=expire_ts,
+            stop_price=float(stop_price) if stop_price is not None else None,
         )
         with self.stock_uow() as uow:
             try:
@@ -100,11 +225,19 @@ class Exchange:
                     "msg": "unknown symbol",
                 }
 
-        # Check this order can be completed before processing it
-        # Good transaction isolation is going to be needed to ensure balance
-        # and holdings stay positive in the event of concurrent order handlers
+        # Everything from here on is the symbol's books, stall and stop book
+        with self.symbol_locks.hold(symbol):
+            return self._accept_order(broker, msg["broker_id"], order)
+
+    def _accept_order(self, broker, broker_id, order):
+        symbol = order.symbol
+
+        # Check this order can be completed before processing it, reserving the
+        # cash or stock it needs so concurrent orders cannot spend it again.
+        # Stop market orders are reserved at their stop price
         try:
-            self.brokers[msg["broker_id"]].validate_preorder(user, order, reference_price=self.stalls[order.symbol].last_price)
+            reference_price = order.stop_price if order.is_stop else self.stalls[order.symbol].last_price
+            broker.reserve_order(order, reference_price=reference_price)
         except OrderScreeningException as e:
             log.debug(e)
             return {
@@ -120,10 +253,82 @@ class Exchange:
                 "msg": str(e),
             }
 
+        if order.is_stop:
+            self.stop_books[symbol].add(order)
+            self.open_orders.add(broker_id, order)
+            if order.tif == "GTT":
+                self.expiries.schedule(order.txid, order.expire_ts)
+            log.info("[bold yellow]STOP[/] [b]%s[/] %s %s@%.3f" % (symbol, order.txid, order.side, order.stop_price))
+
+            # Only trades move the last price, so a stop is checked against
+            # it on arrival once the stall has traded
+            pending = []
+            if self.stalls[symbol].n_trades > 0:
+                pending = self._trigger_stops(symbol)
+        else:
+            pending = [order]
+
+        # Enter the order, and any stops its trades trigger, in this one step
+        outcomes = {}
+        while pending:
+            entering = pending.pop(0)
+            n_trades = self.stalls[symbol].n_trades
+            outcomes[entering.txid] = self._enter_order(broker_id if entering is order else None, entering)
+            if self.stalls[symbol].n_trades > n_trades:
+                prices = [trade.avg_price for trade in self.stalls[symbol].order_history[n_trades:]]
+                pending.extend(self._trigger_stops(symbol, high=max(prices), low=min(prices)))
+
+        reply = {
+            "order": dataclasses_asdict(order),
+            "response_type": "new_order",
+            "response_code": 0,
+            "msg": "ok",
+        }
+        if order.is_stop:
+            reply["triggered"] = order.txid in outcomes
+
+        killed, cancelled_volume = outcomes.get(order.txid, (False, None))
+        if killed:
+            reply["msg"] = "killed"
+        if cancelled_volume is not None:
+            reply["cancelled_volume"] = cancelled_volume
+
+        self.feed.publish(symbol)
+        return reply
+
+    def _trigger_stops(self, symbol, high=None, low=None):
+        # Stops the traded prices have reached, by default the last price,
+        # stamped with the time they trigger so they queue behind what is
+        # already resting
+        if high is None:
+            high = low = self.stalls[symbol].last_price
+        triggered = self.stop_books[symbol].trigger(high, low=low)
+        ts = int(self.now())
+        for stop in triggered:
+            stop.ts = ts
+            log.info("[bold yellow]TRIG[/] [b]%s[/] %s %s@%.3f" % (symbol, stop.txid, stop.side, stop.stop_price))
+        return triggered
+
+    def _enter_order(self, broker_id, order):
+        # Put an accepted order on the books and trade until nothing matches.
+        # Returns whether it was killed and, for IOC and FOK, the volume dropped
+        if broker_id is None:
+            broker_id = self.open_orders.get(order.txid)[0]
+        symbol = order.symbol
+
+        # FOK must fill in full on arrival or is killed without touching the book
+        if order.tif == "FOK" and matcher.simulate_fill(order) < order.volume:
+            self.brokers[broker_id].release_order(order.txid)
+            self.open_orders.remove(order.txid)
+            return True, order.volume
+
         # Process order
         buys, sells = orderbook.add_order(order) # Add order to canonical order repo
         matcher.add_order(order) # Add order to lightweight matching engine
-        self.update_users(buys, sells, reference_price=self.stalls[order.symbol].last_price)
+        self.feed.add_order(order)
+        self.open_orders.add(broker_id, order)
+        if order.tif == "GTT" and order.txid not in self.expiries:
+            self.expiries.schedule(order.txid, order.expire_ts)
 
         summary = orderbook.summarise_books_for_symbol(symbol)
         log.info("[bold green]BOOK[/] [b]%s[/] %s" % (symbol, str(summary)))
@@ -136,22 +341,212 @@ class Exchange:
                 break
 
             for trade in proposed_trades:
-                buys, sells = orderbook.execute_trade(trade) # commit the Trade and close the orders
+                buys, sells = orderbook.execute_trade(trade, ts=int(self.now())) # commit the Trade and close the orders
                 # update client holdings and balances
-                self.update_users(buys, sells, executed=True, reference_price=self.stalls[order.symbol].last_price)
+                if self.settlement:
+                    self.settlement.emit(buys, sells, trade=trade)
+                else:
+                    self.update_users(buys, sells, executed=True, reference_price=self.stalls[symbol].last_price, trades=[trade])
                 self.stalls[symbol].log_trade(trade)
+                self.feed.add_trade(trade)
+                self._fill_open_orders(trade)
+                if self.journal:
+                    self.journal.append(KIND_TRADE, self.now(), dataclasses_asdict(trade))
                 log.info(trade)
 
             summary = orderbook.summarise_books_for_symbol(symbol)
             log.info("[bold green]BOOK[/] [b]%s[/] %s" % (symbol, str(summary)))
 
+        # IOC (and FOK, should the dry run be beaten) drop whatever did not
+        # trade before the book is published, so they never rest
+        cancelled_volume = None
+        if order.immediate:
+            cancelled_volume = 0
+            remainder = orderbook.get_open_order(order.txid)
+            if remainder:
+                self._remove_open_orders([remainder.txid], publish=False)
+                cancelled_volume = remainder.volume
+        return False, cancelled_volume
+
+    def _fill_open_orders(self, trade):
+        # The remainder of a split sell keeps the expiry of the filled part
+        remainder_expiry = None
+        if trade.excess > 0:
+            remainder_expiry = self.expiries.cancel(trade.sell_txids[-1])
+        for txid in [trade.buy_txid] + trade.sell_txids:
+            self.expiries.cancel(txid)
+        if remainder_expiry is not None:
+            self.expiries.schedule(Order.split_txid(trade.sell_txids[-1]), remainder_expiry)
+        self.open_orders.fill(trade)
+
+    def _remove_open_orders(self, txids, publish=True):
+        # Pull open orders from the canonical store, the matcher book, the stop
+        # books, the reservations, the expiry wheel and the feed in one pass, publishing
+        # one book update a symbol. Returns the orders removed
+        cancelled = orderbook.cancel_orders(txids)
+        matcher.delete_orders(txids)
+
+        brokers = {}
+        for txid in txids:
+            entry = self.open_orders.remove(txid)
+            if entry:
+                brokers[txid] = entry[0]
+                # Stops yet to trigger are only in the stop book
+                stop = self.stop_books[entry[2]].remove(txid)
+                if stop:
+                    cancelled.append(stop)
+            self.expiries.cancel(txid)
+
+        symbols = set()
+        for order in cancelled:
+            if order.txid in brokers:
+                self.brokers[brokers[order.txid]].release_order(order.txid)
+            self.feed.remove_order(order.txid)
+            symbols.add(order.symbol)
+        if publish:
+            for symbol in sorted(symbols):
+                self.feed.publish(symbol)
+        return cancelled
+
+    def expire_orders(self, now=None):
+        # Cancel the GTT orders whose time is up, returns the orders expired
+        if now is None:
+            now = self.now()
+        txids = self.expiries.advance(now)
+        if len(txids) == 0:
+            return []
+        entries = [self.open_orders.get(txid) for txid in txids]
+        with self.symbol_locks.hold(*[entry[2] for entry in entries if entry]):
+            expired = self._remove_open_orders(txids)
+        log.info("[bold red]EXPR[/] %d orders" % len(expired))
+        return expired
+
+
+    def _get_pending_stop(self, txid):
+        entry = self.open_orders.get(txid)
+        if not entry:
+            return None
+        return self.stop_books[entry[2]].get(txid)
+
+    def _get_own_open_order(self, msg, stops=True):
+        # The open order a cancel or amend refers to, or the reply refusing it
+        if msg.get("broker_id") not in self.brokers:
+            return None, {
+                "response_type": "exception",
+                "response_code": 404,
+                "msg": "malformed broker",
+            }
+        order = orderbook.get_open_order(msg.get("order_txid"))
+        if not order and stops:
+            order = self._get_pending_stop(msg.get("order_txid"))
+        # Accounts may only touch their own orders
+        if not order or str(order.csid) != str(msg.get("account_id")):
+            return None, {
+                "response_type": "exception",
+                "response_code": 404,
+                "msg": "unknown order",
+            }
+        return order, None
+
+    def _order_symbol(self, txid):
+        # The symbol of an open order or pending stop, which never changes so
+        # can be read before its symbol lock is taken
+        order = orderbook.get_open_order(txid) or self._get_pending_stop(txid)
+        return [order.symbol] if order else []
+
+    def handle_cancel(self, msg):
+        with self.symbol_locks.hold(*self._order_symbol(msg.get("order_txid"))):
+            return self._handle_cancel(msg)
+
+    def _handle_cancel(self, msg):
+        order, reply = self._get_own_open_order(msg)
+        if reply:
+            return reply
+
+        # Remove by txid from the canonical store and the matcher book, or the
+        # stop book if it has yet to trigger
+        self._remove_open_orders([order.txid])
+        log.info("[bold red]CNCL[/] [b]%s[/] %s" % (order.symbol, order.txid))
+
         return {
             "order": dataclasses_asdict(order),
-            "response_type": "new_order",
+            "response_type": "cancel_order",
             "response_code": 0,
             "msg": "ok",
         }
 
+    def handle_amend(self, msg):
+        with self.symbol_locks.hold(*self._order_symbol(msg.get("order_txid"))):
+            return self._handle_amend(msg)
+
+    def _handle_amend(self, msg):
+        # Stops yet to trigger are cancelled and sent again rather than amended
+        order, reply = self._get_own_open_order(msg, stops=False)
+        if reply:
+            return reply
+
+        if not isinstance(msg.get("volume"), int):
+            return {
+                "response_type": "exception",
+                "response_code": 1,
+                "msg": "malformed volume",
+            }
+
+        volume = order.volume
+        try:
+            order = orderbook.amend_order(order.txid, msg["volume"])
+        except AmendOrderVolumeException as e:
+            return {
+                "response_type": "exception",
+                "response_code": 1,
+                "msg": str(e),
+            }
+
+        # Volume down only, so the order keeps its place in the matcher queue
+        matcher.amend_order(order.txid, order.volume)
+        self.brokers[msg["broker_id"]].reduce_order(order.txid, volume, order.volume)
+        self.feed.remove_order(order.txid, volume=volume - order.volume)
+        self.feed.publish(order.symbol)
+        log.info("[bold yellow]AMND[/] [b]%s[/] %s %d>%d" % (order.symbol, order.txid, volume, order.volume))
+
+        return {
+            "order": dataclasses_asdict(order),
+            "response_type": "amend_order",
+            "response_code": 0,
+            "msg": "ok",
+        }
+
+    def handle_mass_cancel(self, msg):
+        # Cancel everything a broker, an account or an account in one symbol
+        # has resting, in one pass over the stores and one book update a symbol
+        broker_id = msg.get("broker_id")
+        if broker_id not in self.brokers:
+            return {
+                "response_type": "exception",
+                "response_code": 404,
+                "msg": "malformed broker",
+            }
+        account_id = msg.get("account_id")
+        symbol = msg.get("symbol")
+        if symbol is not None and account_id is None:
+            return {
+                "response_type": "exception",
+                "response_code": 1,
+                "msg": "symbol scope needs an account",
+            }
+
+        with self.symbol_locks.hold(*([symbol] if symbol else self.stalls)):
+            txids = self.open_orders.select(broker_id, account_id=account_id, symbol=symbol)
+            cancelled = self._remove_open_orders(txids)
+        log.info("[bold red]CNCL[/] [b]%s[/] %d orders" % (broker_id, len(cancelled)))
+
+        return {
+            "response_type": "mass_cancel",
+            "response_code": 0,
+            "msg": "ok",
+            "n_cancelled": len(cancelled),
+            "txids": [order.txid for order in cancelled],
+        }
 
     def clear_trade(self):
         pass
@@ -164,6 +559,9 @@ class Exchange:
             "max_price": str(stall.max_price) if stall.max_price else None,
             "num_trades": stall.n_trades,
             "vol_trades": stall.v_trades,
+            "notional": stall.notional,
+            "vwap": str(stall.vwap) if stall.vwap else None, # TODO CRIT str
+            "rolling": stall.rolling_summary(now=self.now()),
             "name": stall.stock.name,
             "symbol": stall.stock.symbol,
             "last_trade_price": None,
@@ -177,23 +575,165 @@ class Exchange:
             reply["last_trade_ts"] = last_trade.ts
         return reply
 
-    def get_trade_history(self, stall):
-        return [dataclasses_asdict(order) for order in stall.order_history]
+    def get_trade_history(self, stall, n=None, since_seq=None, since_ts=None, until_ts=None):
+        start, end = stall.trade_window(since_seq=since_seq, since_ts=since_ts, until_ts=until_ts, limit=n)
+        return [dataclasses_asdict(order) for order in stall.order_history[start:end]]
+
+    def format_trade_history(self, stall, msg):
+        # A page of trade history cut from the stall's trade index, so only the
+        # trades in the window are serialised. last_seq is the seq of the last
+        # trade returned (or the since_seq asked for) to poll on from
+        for key in ["since_seq", "since_ts", "until_ts", "limit"]:
+            value = msg.get(key)
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0):
+                return {
+                    "response_type": "exception",
+                    "response_code": 1,
+                    "msg": "malformed %s" % key,
+                }
+        limit = MAX_TRADE_HISTORY_PAGE
+        if msg.get("limit") is not None:
+            limit = min(int(msg["limit"]), MAX_TRADE_HISTORY_PAGE)
+
+        with self.symbol_locks.hold(stall.stock.symbol):
+            start, end = stall.trade_window(since_seq=msg.get("since_seq"), since_ts=msg.get("since_ts"), until_ts=msg.get("until_ts"), limit=limit)
+            trades = stall.order_history[start:end]
+        return {
+            "response_type": "instrument_trade_history",
+            "response_code": 0,
+            "msg": "ok",
+            "symbol": stall.stock.symbol,
+            "first_seq": start + 1,
+            "last_seq": end,
+            "trade_history": [dataclasses_asdict(order) for order in trades],
+        }
+
+    def get_bars(self, stall, interval, n=None):
+        # Recent bars straight from the stall's ring, without the trade list
+        with self.symbol_locks.hold(stall.stock.symbol):
+            return [BarSeries.serialise(bar) for bar in stall.bars[interval].latest(n)]
+
+    def format_orderbook_summary(self, symbol, summary):
+        return {
+            "symbol": symbol,
+            "depth_buys": summary["dbuys"],
+            "depth_sells": summary["dsells"],
+            "top_num_buys": summary["nbuys"],
+            "top_num_sells": summary["nsells"],
+            "top_vol_buys": summary["vbuys"],
+            "top_vol_sells": summary["vsells"],
+            "current_buy": str(summary["buy"]), #TODO CRIT str
+            "current_sell": str(summary["sell"]),
+        }
+
+    def format_instrument_snapshot(self, symbol, depth=10, history=10):
+        # Everything the instrument_* queries return, from one read of the stall
+        # and one walk of each book
+        with self.symbol_locks.hold(symbol):
+            stall = self.stalls[symbol]
+            books = orderbook.snapshot_books_for_symbol(symbol, n=depth, reference_price=stall.last_price)
+            return {
+                "symbol": symbol,
+                "summary": self.format_instrument_summary(stall),
+                "trade_history": self.get_trade_history(stall, n=history),
+                "orderbook_summary": self.format_orderbook_summary(symbol, books["summary"]),
+                "buy_book": books["buy_book"],
+                "sell_book": books["sell_book"],
+            }
+
+    def subscribe_market_data(self, msg):
+        symbols = msg.get("symbols")
+        if not symbols:
+            symbols = [msg.get("symbol")]
+
+        with self.stock_uow() as uow:
+            for symbol in symbols:
+                if not uow.stocks.get(symbol):
+                    return {
+                        "response_type": "exception",
+                        "response_code": 404,
+                        "msg": "unknown symbol",
+                    }
+
+        # The snapshots and the registration happen under the symbols' locks so
+        # no update can be published between the two and go missing
+        with self.symbol_locks.hold(*symbols):
+            sub = self.feed.subscribe(symbols)
+        return {
+            "response_type": "market_data_subscribe",
+            "response_code": 0,
+            "msg": "ok",
+            "symbols": sorted(sub.symbols),
+            "subscription_id": sub.sid,
+        }
+
+    def now(self):
+        # Arrival time of the message being handled on this thread
+        now = getattr(self._message_time, "now", None)
+        if now is None:
+            return self.clock()
+        return now
+
+    def _arrive(self, kind, msg=None):
+        now = self.clock()
+        self._message_time.now = now
+        if self.journal:
+            self.journal.append(kind, now, msg)
+        return now
+
+    def tick(self):
+        # Periodic housekeeping between messages, journalled like a message
+        self._arrive(KIND_TICK)
+        try:
+            return self.expire_orders()
+        finally:
+            self._message_time.now = None
 
     def recv(self, msg):
+        self._arrive(KIND_MESSAGE, msg)
+        try:
+            reply = self.dispatch(msg)
+        finally:
+            self._message_time.now = None
+
+        # Echo the correlation id so pipelining clients can pair up replies
+        if "corr_id" in msg:
+            if not isinstance(reply, dict):
+                reply = {
+                    "response_type": msg["message_type"],
+                    "response_code": 0,
+                    "msg": "ok",
+                    "stocks": reply,
+                }
+            reply["corr_id"] = msg["corr_id"]
+        return reply
+
+    def dispatch(self, msg):
+        # Expire anything due before acting on the message
+        self.expire_orders()
+
+        if self.admission and "broker_id" in msg:
+            # Throttle before anything is done on behalf of the message, a
+            # throttled txid has not been used and can be sent again
+            reply = self.admission.admit(msg["broker_id"], msg.get("account_id"))
+            if reply:
+                return reply
+
         if "txid" in msg:
-            if msg["txid"] in self.txid_set:
+            with self._txid_lock:
+                duplicate = msg["txid"] in self.txid_set
+                if not duplicate:
+                    # Idempotent txid
+                    self.txid_set.add(msg["txid"])
+            if duplicate:
                 return {
                     "response_type": "exception",
                     "response_code": 1,
                     "msg": "duplicate transaction",
                 }
-            else:
-                # Idempotent txid
-                self.txid_set.add(msg["txid"])
 
         if "sender_ts" in msg:
-            if msg["sender_ts"] < (int(time.time()) - 60):
+            if msg["sender_ts"] < (int(self.now()) - 60):
                 return {
                     "response_type": "exception",
                     "response_code": 1,
@@ -203,9 +743,27 @@ class Exchange:
         if msg["message_type"] == "new_order":
             reply = self.handle_order(msg)
 
+        elif msg["message_type"] == "cancel_order":
+            reply = self.handle_cancel(msg)
+
+        elif msg["message_type"] == "amend_order":
+            reply = self.handle_amend(msg)
+
+        elif msg["message_type"] == "mass_cancel":
+            reply = self.handle_mass_cancel(msg)
+
         elif msg["message_type"] == "list_stocks":
             reply = sorted(list(self.list_stocks())) # list to serialize
 
+        elif msg["message_type"] == "exchange_metrics":
+            reply = {
+                "response_type": "exchange_metrics",
+                "response_code": 0,
+                "msg": "ok",
+                "settlement": self.settlement_lag(),
+                "admission": self.admission.metrics() if self.admission else None,
+            }
+
         elif msg["message_type"] == "instrument_summary":
             with self.stock_uow() as uow:
                 ok = True
@@ -220,7 +778,8 @@ class Exchange:
                     ok = False
 
                 if ok:
-                    reply = self.format_instrument_summary(self.stalls[symbol])
+                    with self.symbol_locks.hold(symbol):
+                        reply = self.format_instrument_summary(self.stalls[symbol])
                     if reply:
                         reply.update({
                             "response_type": "instrument_summary",
@@ -243,12 +802,48 @@ class Exchange:
                     ok = False
 
                 if ok:
+                    reply = self.format_trade_history(self.stalls[symbol], msg)
+
+        elif msg["message_type"] == "instrument_bars":
+            with self.stock_uow() as uow:
+                ok = True
+                try:
+                    symbol = uow.stocks.get(msg["symbol"]).symbol
+                except AttributeError:
+                    reply = {
+                        "response_type": "exception",
+                        "response_code": 404,
+                        "msg": "unknown symbol",
+                    }
+                    ok = False
+
+                interval = msg.get("interval", 60)
+                if ok and interval not in self.stalls[symbol].bars:
+                    reply = {
+                        "response_type": "exception",
+                        "response_code": 1,
+                        "msg": "unknown interval",
+                    }
+                    ok = False
+
+                n = msg.get("n")
+                if ok and n is not None and (not isinstance(n, int) or isinstance(n, bool) or n <= 0):
+                    reply = {
+                        "response_type": "exception",
+                        "response_code": 1,
+                        "msg": "malformed n",
+                    }
+                    ok = False
+
+                if ok:
+                    series = self.stalls[symbol].bars[interval]
                     reply = {
-                        "response_type": "instrument_trade_history",
+                        "response_type": "instrument_bars",
                         "response_code": 0,
                         "msg": "ok",
                         "symbol": symbol,
-                        "trade_history": self.get_trade_history(self.stalls[symbol]),
+                        "interval": interval,
+                        "bars": self.get_bars(self.stalls[symbol], interval, n=series.size if n is None else min(n, series.size)),
                     }
 
         elif msg["message_type"] == "instrument_orderbook_summary":
@@ -265,21 +860,14 @@ class Exchange:
                     ok = False
 
                 if ok:
-                    summary = orderbook.summarise_books_for_symbol(symbol, reference_price=self.stalls[symbol].last_price)
-                    reply = {
+                    with self.symbol_locks.hold(symbol):
+                        summary = orderbook.summarise_books_for_symbol(symbol, reference_price=self.stalls[symbol].last_price)
+                    reply = self.format_orderbook_summary(symbol, summary)
+                    reply.update({
                         "response_type": "instrument_orderbook_summary",
                         "response_code": 0,
                         "msg": "ok",
-                        "symbol": symbol,
-                        "depth_buys": summary["dbuys"],
-                        "depth_sells": summary["dsells"],
-                        "top_num_buys": summary["nbuys"],
-                        "top_num_sells": summary["nsells"],
-                        "top_vol_buys": summary["vbuys"],
-                        "top_vol_sells": summary["vsells"],
-                        "current_buy": str(summary["buy"]), #TODO CRIT str
-                        "current_sell": str(summary["sell"]),
-                    }
+                    })
 
         elif msg["message_type"] == "instrument_orderbook":
             with self.stock_uow() as uow:
@@ -295,7 +883,8 @@ class Exchange:
                     ok = False
 
                 if ok:
-                    order_books = orderbook.get_serialised_order_books_for_symbol(symbol, n=10)
+                    with self.symbol_locks.hold(symbol):
+                        order_books = orderbook.get_serialised_order_books_for_symbol(symbol, n=10)
                     reply = {
                         "response_type": "instrument_orderbook",
                         "response_code": 0,
@@ -305,6 +894,56 @@ class Exchange:
                         "sell_book": order_books["sell_book"],
                     }
 
+        elif msg["message_type"] == "market_data_subscribe":
+            reply = self.subscribe_market_data(msg)
+
+        elif msg["message_type"] == "market_data_unsubscribe":
+            sub = self.feed.unsubscribe(msg.get("subscription_id"))
+            if sub:
+                reply = {
+                    "response_type": "market_data_unsubscribe",
+                    "response_code": 0,
+                    "msg": "ok",
+                    "subscription_id": sub.sid,
+                }
+            else:
+                reply = {
+                    "response_type": "exception",
+                    "response_code": 404,
+                    "msg": "unknown subscription",
+                }
+
+        elif msg["message_type"] == "instrument_snapshot":
+            with self.stock_uow() as uow:
+                ok = True
+                try:
+                    symbol = uow.stocks.get(msg["symbol"]).symbol
+                except AttributeError:
+                    reply = {
+                        "response_type": "exception",
+                        "response_code": 404,
+                        "msg": "unknown symbol",
+                    }
+                    ok = False
+
+                depth, history = msg.get("depth", 10), msg.get("history", 10)
+                for key, value in [("depth", depth), ("history", history)]:
+                    if ok and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                        reply = {
+                            "response_type": "exception",
+                            "response_code": 1,
+                            "msg": "malformed %s" % key,
+                        }
+                        ok = False
+
+                if ok:
+                    reply = self.format_instrument_snapshot(symbol, depth=min(depth, MAX_SNAPSHOT_DEPTH), history=min(history, MAX_TRADE_HISTORY_PAGE))
+                    reply.update({
+                        "response_type": "instrument_snapshot",
+                        "response_code": 0,
+                        "msg": "ok",
+                    })
+
         else:
             reply = {
                 "response_type": "exception",
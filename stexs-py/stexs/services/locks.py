@@ -0,0 +1,37 @@
+from contextlib import ExitStack, contextmanager
+import threading
+
+class LockTable:
+    # A lock per key for state that is only ever worked on a key at a time.
+    #
+    # `hold` takes the locks for any number of keys in one fixed order, so two
+    # threads holding overlapping sets of keys can never deadlock. With
+    # `stripes` keys share that many locks by hash rather than getting a lock
+    # each, which keeps the table one size however many keys pass through it.
+    # Locks are re-entrant so a holder may ask again for a key it has.
+
+    def __init__(self, stripes=None):
+        self.stripes = stripes
+        self._locks = {}
+        self._guard = threading.Lock()
+        if stripes:
+            self._locks = {i: threading.RLock() for i in range(stripes)}
+
+    def _slot(self, key):
+        if self.stripes:
+            return hash(str(key)) % self.stripes
+        return str(key)
+
+    def _lock(self, slot):
+        lock = self._locks.get(slot)
+        if lock is None:
+            with self._guard:
+                lock = self._locks.setdefault(slot, threading.RLock())
+        return lock
+
+    @contextmanager
+    def hold(self, *keys):
+        with ExitStack() as stack:
+            for slot in sorted(set(self._slot(key) for key in keys)):
+                stack.enter_context(self._lock(slot))
+            yield
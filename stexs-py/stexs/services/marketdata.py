@@ -0,0 +1,250 @@
+from stexs.domain.order import Order
+from stexs.services.logger import log
+from typing import List
+import itertools
+import queue
+import threading
+
+def _is_priced(price):
+    # Market orders have no price level so they never appear in the L2 book
+    return price is not None and price != float("inf") and price != float("-inf")
+
+
+class L2Book:
+    # Aggregate resting volume per price level for one symbol
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.levels = {
+            "BUY": {},
+            "SELL": {},
+        }
+
+    def apply(self, side, price, adjust_volume):
+        level = self.levels[side]
+        volume = level.get(price, 0) + adjust_volume
+        if volume > 0:
+            level[price] = volume
+        else:
+            level.pop(price, None)
+            volume = 0
+        return volume
+
+    def volume(self, side, price):
+        return self.levels[side].get(price, 0)
+
+    def get_levels(self, side, n=None):
+        prices = sorted(self.levels[side], reverse=(side == "BUY"))[:n]
+        return [[str(price), self.levels[side][price]] for price in prices] # TODO CRIT str
+
+
+class Subscription:
+    # Bounded mailbox of feed messages for one reader
+
+    def __init__(self, sid, symbols, maxsize=10000):
+        self.sid = sid
+        self.symbols = set(symbols)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def put(self, msg):
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            return False
+        return True
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def drain(self):
+        msgs = []
+        while True:
+            try:
+                msgs.append(self.queue.get_nowait())
+            except queue.Empty:
+                return msgs
+
+
+class MarketDataFeed:
+    # Maintains an L2 view of each book from order and trade events and pushes
+    # the changes to subscribers as per-symbol sequenced messages.
+    #
+    # Changes are accumulated while an order is processed and published as one
+    # book_delta carrying the new aggregate volume of each level that moved, so
+    # the work done is proportional to the changes rather than the book size.
+    # Every `snapshot_interval` messages a full book_snapshot is sent so readers
+    # can resync, readers that fall behind are sent a fresh snapshot instead.
+
+    def __init__(self, snapshot_interval=100, max_queue=10000):
+        self.snapshot_interval = snapshot_interval
+        self.max_queue = max_queue
+
+        self.books = {}
+        self.seqs = {}
+        self._resting = {} # txid -> (symbol, side, price, volume)
+        self._pending_levels = {} # symbol -> {(side, price): volume before changes}
+        self._pending_trades = {} # symbol -> [trade print]
+        self._since_snapshot = {}
+
+        self._subscriptions = {}
+        self._sids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add_book(self, symbol):
+        if symbol not in self.books:
+            self.books[symbol] = L2Book(symbol)
+            self.seqs[symbol] = 0
+            self._pending_levels[symbol] = {}
+            self._pending_trades[symbol] = []
+            self._since_snapshot[symbol] = 0
+
+    def _adjust_level(self, symbol, side, price, adjust_volume):
+        pending = self._pending_levels[symbol]
+        if (side, price) not in pending:
+            pending[(side, price)] = self.books[symbol].volume(side, price)
+        self.books[symbol].apply(side, price, adjust_volume)
+
+    def add_order(self, order: Order):
+        if not _is_priced(order.price):
+            return
+        self._resting[order.txid] = (order.symbol, order.side, order.price, order.volume)
+        self._adjust_level(order.symbol, order.side, order.price, order.volume)
+
+    def remove_order(self, txid, volume=None):
+        # Remove some or all of a resting order, returns the volume removed
+        resting = self._resting.get(txid)
+        if not resting:
+            return 0
+        symbol, side, price, resting_volume = resting
+        if volume is None or volume >= resting_volume:
+            volume = resting_volume
+            del self._resting[txid]
+        else:
+            self._resting[txid] = (symbol, side, price, resting_volume - volume)
+        self._adjust_level(symbol, side, price, -volume)
+        return volume
+
+    def add_trade(self, trade):
+        # Buys are always filled in full and so are all but the last sell, which
+        # leaves its excess resting under the split txid
+        self.remove_order(trade.buy_txid)
+        for sell_txid in trade.sell_txids:
+            resting = self._resting.get(sell_txid)
+            self.remove_order(sell_txid)
+            if resting and sell_txid == trade.sell_txids[-1] and trade.excess > 0:
+                symbol, side, price, _ = resting
+                remainder_txid = Order.split_txid(sell_txid)
+                self._resting[remainder_txid] = (symbol, side, price, trade.excess)
+                self._adjust_level(symbol, side, price, trade.excess)
+
+        self._pending_trades[trade.symbol].append({
+            "tid": trade.tid,
+            "ts": trade.ts,
+            "price": str(trade.avg_price), # TODO CRIT str
+            "volume": trade.volume,
+            "buy_txid": trade.buy_txid,
+            "sell_txids": list(trade.sell_txids),
+        })
+
+    def _next_seq(self, symbol):
+        self.seqs[symbol] += 1
+        self._since_snapshot[symbol] += 1
+        return self.seqs[symbol]
+
+    def snapshot(self, symbol, n=None):
+        book = self.books[symbol]
+        return {
+            "response_type": "book_snapshot",
+            "response_code": 0,
+            "msg": "ok",
+            "symbol": symbol,
+            "seq": self.seqs[symbol],
+            "buy_levels": book.get_levels("BUY", n=n),
+            "sell_levels": book.get_levels("SELL", n=n),
+        }
+
+    def publish(self, symbol):
+        msgs = []
+
+        for trade in self._pending_trades[symbol]:
+            msg = {
+                "response_type": "trade",
+                "response_code": 0,
+                "msg": "ok",
+                "symbol": symbol,
+                "seq": self._next_seq(symbol),
+            }
+            msg.update(trade)
+            msgs.append(msg)
+        self._pending_trades[symbol] = []
+
+        deltas = []
+        book = self.books[symbol]
+        for (side, price), before in self._pending_levels[symbol].items():
+            volume = book.volume(side, price)
+            if volume != before:
+                deltas.append({
+                    "side": side,
+                    "price": str(price), # TODO CRIT str
+                    "volume": volume,
+                })
+        self._pending_levels[symbol] = {}
+        if len(deltas) > 0:
+            msgs.append({
+                "response_type": "book_delta",
+                "response_code": 0,
+                "msg": "ok",
+                "symbol": symbol,
+                "seq": self._next_seq(symbol),
+                "deltas": deltas,
+            })
+
+        if len(msgs) == 0:
+            return msgs
+
+        if self._since_snapshot[symbol] >= self.snapshot_interval:
+            self._since_snapshot[symbol] = 0
+            msgs.append(self.snapshot(symbol))
+
+        self._send(symbol, msgs)
+        return msgs
+
+    def _send(self, symbol, msgs):
+        with self._lock:
+            subscriptions = [sub for sub in self._subscriptions.values() if symbol in sub.symbols]
+
+        if len(subscriptions) == 0:
+            return
+
+        snapshot = None
+        for sub in subscriptions:
+            for msg in msgs:
+                if not sub.put(msg):
+                    # Reader fell behind, throw away its backlog and resync it
+                    log.warning("[bold yellow]FEED[/] Subscription %d overflowed, resyncing" % sub.sid)
+                    if not snapshot:
+                        snapshot = self.snapshot(symbol)
+                    sub.drain()
+                    sub.put(snapshot)
+                    break
+
+    def subscribe(self, symbols: List[str]):
+        sub = Subscription(next(self._sids), symbols, maxsize=self.max_queue)
+        for symbol in sorted(sub.symbols):
+            sub.put(self.snapshot(symbol))
+        with self._lock:
+            self._subscriptions[sub.sid] = sub
+        log.info("[bold yellow]FEED[/] Subscription %d to %s" % (sub.sid, ','.join(sorted(sub.symbols))))
+        return sub
+
+    def get_subscription(self, sid):
+        with self._lock:
+            return self._subscriptions.get(sid)
+
+    def unsubscribe(self, sid):
+        with self._lock:
+            sub = self._subscriptions.pop(sid, None)
+        if sub:
+            sub.closed = True
+        return sub
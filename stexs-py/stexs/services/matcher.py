@@ -1,4 +1,6 @@
 import stexs.io.persistence as iop
+from stexs.io.persistence.order import MatcherOrder
+import copy
 from stexs.domain.model import Trade
 from stexs.domain.order import Order
 from typing import List
@@ -36,66 +38,125 @@ def delete_order(order, uow=None):
         uow.orders.delete(order)
         uow.commit()
 
+def delete_orders(txids, uow=None):
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        for txid in txids:
+            uow.orders.delete(txid)
+        uow.commit()
+
+def amend_order(txid, volume, uow=None):
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        order = uow.orders.amend(txid, volume)
+        uow.commit()
+        return order
+
 def propose_trade(buy: Order, sells: List[Order], excess=0, execution_price=None):
     return Trade.propose_trade(buy, sells, excess, execution_price)
 
+def find_match(buy_book, sell_book):
+    # The next trade the books allow as (buy, sells, excess), or None. Books are
+    # sorted best first, excess is how much of the last sell is left over
+    for buy in buy_book:
+        buy_sells = []
+        curr_volume = 0
+
+        for sell in sell_book:
+            if buy.price < sell.price:
+                # Sells are sorted, so if we cannot afford this sell, there won't
+                # be any more sells at the right price range
+                return None
+
+            # If the buy match or exceeds the sell price, we can trade
+            curr_volume += sell.volume
+            buy_sells.append(sell)
+
+            if curr_volume >= buy.volume:
+                # Either volume is just right or there is some excess to split into new Order
+                return buy, buy_sells, curr_volume - buy.volume
+    return None
+
+def _book_key(order):
+    side_sign = -1 if order.side == "BUY" else 1
+    return (order.price * side_sign, order.ts, order.txid)
+
+def simulate_fill(order, uow=None):
+    # Volume of `order` that would trade if it joined its book now, found by
+    # running the matching rules over a copy of the book. Costs a pass over the
+    # book, so only worth doing for orders that must know up front (FOK)
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        book = uow.orders.get_book(order.symbol)
+        buys = [copy.copy(o) for o in book.buy_book]
+        sells = [copy.copy(o) for o in book.sell_book]
+
+    price = order.price
+    if not price:
+        # Market order price hack
+        price = float("inf") if order.side == "BUY" else float("-inf")
+    incoming = MatcherOrder(order.symbol, order.side, price, order.volume, order.ts, order.txid)
+    if order.side == "BUY":
+        buys = sorted(buys + [incoming], key=_book_key)
+    else:
+        sells = sorted(sells + [incoming], key=_book_key)
+
+    filled = 0
+    while True:
+        match = find_match(buys, sells)
+        if not match:
+            return filled
+        buy, buy_sells, excess = match
+        if buy is incoming:
+            return buy.volume
+
+        last_sell = buy_sells[-1]
+        if any(o is incoming for o in buy_sells):
+            filled += incoming.volume - (excess if incoming is last_sell else 0)
+            if incoming is not last_sell or excess == 0:
+                return filled
+
+        # Filled orders leave the book, any excess rests on in the same place
+        executed = set(id(o) for o in [buy] + buy_sells)
+        if excess > 0:
+            last_sell.volume = excess
+            executed.discard(id(last_sell))
+        buys = [o for o in buys if id(o) not in executed]
+        sells = [o for o in sells if id(o) not in executed]
+
 def match_orderbook(symbol, uow=None):
     if not uow:
         uow = _default_uow()
     with uow:
         book = uow.orders.get_book(symbol)
 
-        done = False
-
         proposed_trades = []
 
-        for buy in book.buy_book:
-            buy_sells = []
-            curr_volume = 0
-
-            buy_price = buy.price
-            buy_volume = buy.volume
-
-            for sell in book.sell_book:
-                sell_price = sell.price
-                sell_volume = sell.volume
-
-                if buy_price < sell_price:
-                    # Sells are sorted, so if we cannot afford this sell, there won't
-                    # be any more sells at the right price range
-                    done = True
-                    break
-
-                # If the buy match or exceeds the sell price, we can trade
-                curr_volume += sell_volume
-                buy_sells.append(sell)
-
-                # Determine price
-                execution_price = Trade.get_execution_price(buy.ts, sell.ts, buy_price, sell_price, book.reference_price, book.highest_bid, book.lowest_ask)
-
-                excess = curr_volume - buy_volume
-                if curr_volume >= buy_volume:
-                    # Either volume is just right or there is some excess to split into new Order
-                    proposed_trades.append(
-                            propose_trade(buy, buy_sells, excess=excess, execution_price=execution_price)
-                    )
+        match = find_match(book.live("BUY"), book.live("SELL"))
+        if match:
+            buy, buy_sells, excess = match
+            sell = buy_sells[-1]
 
-                    # Split sell
-                    if excess > 0:
-                        sell, remainder_sell = Order.split_sell(uow.orders.get(sell.txid), excess)
-                        uow.orders.add(remainder_sell)
+            # Determine price
+            execution_price = Trade.get_execution_price(buy.ts, sell.ts, buy.price, sell.price, book.reference_price, book.highest_bid, book.lowest_ask)
+            proposed_trades.append(
+                    propose_trade(buy, buy_sells, excess=excess, execution_price=execution_price)
+            )
 
-                    # Delete the orders from the matcher book
-                    for executed_order in [buy.txid] + [sell.txid for sell in buy_sells]:
-                        delete_order(executed_order, uow=uow)
+            # Split sell
+            if excess > 0:
+                sell, remainder_sell = Order.split_sell(uow.orders.get(sell.txid), excess)
+                uow.orders.add(remainder_sell)
 
-                    # Update reference price
-                    update_reference_price(symbol, execution_price, uow=uow)
+            # Delete the orders from the matcher book
+            for executed_order in [buy.txid] + [sell.txid for sell in buy_sells]:
+                delete_order(executed_order, uow=uow)
 
-                    done = True # Force update before running match again
-                    break # Don't keep trying to add sells to this buy!
+            # Update reference price
+            update_reference_price(symbol, execution_price, uow=uow)
 
-            if done:
-                break
         uow.commit()
         return proposed_trades
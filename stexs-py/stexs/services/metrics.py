@@ -0,0 +1,73 @@
+import math
+
+class LatencyHistogram:
+    # HDR style histogram of non-negative integer values (eg. microseconds).
+    #
+    # Values are counted in log-linear buckets: below 2**precision_bits every
+    # value has its own bucket, above that each power of two range is split into
+    # 2**(precision_bits-1) buckets, so any recorded value is reported within a
+    # relative error of 2**-(precision_bits-1) whatever its magnitude. Only
+    # buckets that have been hit are stored and histograms from different
+    # workers merge by adding counts.
+
+    def __init__(self, precision_bits=11):
+        self.precision_bits = precision_bits
+        self.counts = {} # bucket lower bound -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        shift = max(value.bit_length() - self.precision_bits, 0)
+        return (value >> shift) << shift
+
+    def record(self, value, count=1):
+        value = int(value)
+        if value < 0:
+            raise ValueError("Cannot record negative value %d" % value)
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if other.precision_bits != self.precision_bits:
+            raise ValueError("Cannot merge histograms of different precision")
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = max(math.ceil(self.count * p / 100), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                # Exact extremes are known so never report past them
+                return min(max(bucket, self.min), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        summary = {
+            "count": self.count,
+            "min": self.min,
+            "mean": self.mean,
+            "max": self.max,
+        }
+        for p in percentiles:
+            summary["p%s" % ('%g' % p)] = self.percentile(p)
+        return summary
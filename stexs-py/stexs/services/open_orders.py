@@ -0,0 +1,68 @@
+from stexs.domain.order import Order
+from typing import Dict, Set, Tuple
+import threading
+
+class OpenOrderIndex:
+    # Open txids by broker and by account so everything a broker or account
+    # has resting can be found without walking the books.
+    #
+    # The Exchange keeps this in step with the books: orders are added when
+    # they are accepted, dropped when they fill or are cancelled, and the
+    # resting remainder of a split sell takes over from the filled part. Safe
+    # to share between threads.
+
+    def __init__(self):
+        self._orders: Dict[str, Tuple[str, str, str]] = {} # txid -> (broker_id, account_id, symbol)
+        self._by_broker: Dict[str, Set[str]] = {}
+        self._by_account: Dict[Tuple[str, str], Set[str]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, txid):
+        return txid in self._orders
+
+    def get(self, txid):
+        # (broker_id, account_id, symbol) for an open txid, or None
+        return self._orders.get(txid)
+
+    def _add(self, txid, broker_id, account_id, symbol):
+        account_id = str(account_id)
+        self._orders[txid] = (broker_id, account_id, symbol)
+        self._by_broker.setdefault(broker_id, set()).add(txid)
+        self._by_account.setdefault((broker_id, account_id), set()).add(txid)
+
+    def add(self, broker_id, order: Order):
+        with self._lock:
+            self._add(order.txid, broker_id, order.csid, order.symbol)
+
+    def remove(self, txid):
+        with self._lock:
+            entry = self._orders.pop(txid, None)
+            if not entry:
+                return None
+            broker_id, account_id, symbol = entry
+            self._by_broker[broker_id].discard(txid)
+            self._by_account[(broker_id, account_id)].discard(txid)
+            return entry
+
+    def fill(self, trade):
+        # Buys fill in full as do all but the last sell, which rests on under
+        # its split txid if there was excess
+        with self._lock:
+            self.remove(trade.buy_txid)
+            for sell_txid in trade.sell_txids:
+                entry = self.remove(sell_txid)
+                if entry and sell_txid == trade.sell_txids[-1] and trade.excess > 0:
+                    self._add(Order.split_txid(sell_txid), *entry)
+
+    def select(self, broker_id, account_id=None, symbol=None):
+        with self._lock:
+            if account_id is None:
+                txids = self._by_broker.get(broker_id, ())
+            else:
+                txids = self._by_account.get((broker_id, str(account_id)), ())
+            if symbol is None:
+                return list(txids)
+            return [txid for txid in txids if self._orders[txid][2] == symbol]
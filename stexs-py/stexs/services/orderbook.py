@@ -43,12 +43,78 @@ def close_txids(txids: List[str], uow=None):
         uow.commit()
 
 
+def _get_open_order(txid, uow):
+    # A partly filled sell rests on as its split remainder, follow it there
+    order = uow.orders.get(txid)
+    while order and order.closed:
+        order = uow.orders.get(Order.split_txid(order.txid))
+    return order
+
+def get_open_order(txid, uow=None):
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        return _get_open_order(txid, uow)
+
+def cancel_order(txid: str, uow=None):
+    # Removes the open order for txid, returning it or None if nothing is open
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        order = _get_open_order(txid, uow)
+        if not order:
+            return None
+        uow.orders.delete(order.txid)
+        uow.commit()
+        return order
+
+def cancel_orders(txids: List[str], uow=None):
+    # Removes many open orders in one UoW, returning the orders removed
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        cancelled = []
+        for txid in txids:
+            order = uow.orders.get(txid)
+            if not order or order.closed:
+                continue
+            uow.orders.delete(order.txid)
+            cancelled.append(order)
+        uow.commit()
+        return cancelled
+
+def list_txids_for_symbol(symbol: str, uow=None):
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        return uow.orders.list_txids_for_symbol(symbol)
+
+def peek_orders(symbol: str, txids: List[str], uow=None):
+    # Orders as committed, for reading only, skipping any since removed
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        return uow.orders.peek_many(symbol, txids)
+
+def amend_order(txid: str, volume: int, uow=None):
+    # Reduces the open order for txid where it rests, returning the amended order
+    if not uow:
+        uow = _default_uow()
+    with uow:
+        order = _get_open_order(txid, uow)
+        if not order:
+            return None
+        order.amend_volume(volume)
+        uow.commit()
+        return order
+
+
 def split_sell(filled_sell: Order, excess_volume: int):
     filled_sell, remainder_sell = Order.split_sell(filled_sell, excess_volume)
     return filled_sell, remainder_sell
 
 
-def execute_trade(trade: model.Trade, uow=None):
+def execute_trade(trade: model.Trade, ts=None, uow=None):
     if not uow:
         uow = _default_uow()
 
@@ -72,7 +138,7 @@ def execute_trade(trade: model.Trade, uow=None):
         uow.commit()
 
     # TODO Persist the Trade itself
-    trade.clear_trade()
+    trade.clear_trade(ts=ts)
 
     with uow:
         confirmed_buys = [uow.orders.get(trade.buy_txid)]
@@ -133,6 +199,26 @@ def get_serialised_order_books_for_symbol(symbol, n=None, uow=None):
             "sell_book": [dataclasses_asdict(order) for order in uow.orders.get_sell_book_for_symbol(symbol)[:n]],
         }
 
+def _summarise_sorted_books(buy_book, sell_book, reference_price=None):
+    # TODO This won't work for market orders
+    try:
+        buy = buy_book[0].price
+    except:
+        buy = None
+
+    try:
+        sell = sell_book[0].price
+    except:
+        sell = None
+
+    if buy == float("inf"):
+        buy = reference_price
+
+    if sell == float("-inf"):
+        sell = reference_price
+
+    return summarise_books(buy_book, sell_book, buy=buy, sell=sell)
+
 def summarise_books_for_symbol(symbol, reference_price=None, uow=None):
     if not uow:
         uow = _default_uow()
@@ -140,23 +226,18 @@ def summarise_books_for_symbol(symbol, reference_price=None, uow=None):
     with uow:
         buy_book = uow.orders.get_buy_book_for_symbol(symbol)
         sell_book = uow.orders.get_sell_book_for_symbol(symbol)
+        return _summarise_sorted_books(buy_book, sell_book, reference_price=reference_price)
 
-        # TODO This won't work for market orders
-        try:
-            buy = buy_book[0].price
-        except:
-            buy = None
-
-        try:
-            sell = sell_book[0].price
-        except:
-            sell = None
-
-        if buy == float("inf"):
-            buy = reference_price
-
-        if sell == float("-inf"):
-            sell = reference_price
-
-        return summarise_books(buy_book, sell_book, buy=buy, sell=sell)
+def snapshot_books_for_symbol(symbol, n=None, reference_price=None, uow=None):
+    # Summary and top n of both books from a single read of each book
+    if not uow:
+        uow = _default_uow()
 
+    with uow:
+        buy_book = uow.orders.get_buy_book_for_symbol(symbol)
+        sell_book = uow.orders.get_sell_book_for_symbol(symbol)
+        return {
+            "summary": _summarise_sorted_books(buy_book, sell_book, reference_price=reference_price),
+            "buy_book": [dataclasses_asdict(order) for order in buy_book[:n]],
+            "sell_book": [dataclasses_asdict(order) for order in sell_book[:n]],
+        }
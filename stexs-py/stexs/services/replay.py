@@ -0,0 +1,101 @@
+from collections import deque
+import itertools
+import time
+
+from stexs.io.journal import KIND_MESSAGE, KIND_TICK, KIND_TRADE
+from stexs.io.wire import JSON_CODEC
+
+class ReplayClock:
+    # Stands in for time.time, reading back the times a journal was captured at
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _trade_bytes(trade):
+    # Trade ids are random so are left out of the comparison
+    trade = dict(trade)
+    trade.pop("tid", None)
+    return JSON_CODEC.encode(trade)
+
+
+class _ReplayTape:
+    # Takes the place of the journal on the replaying exchange to collect the
+    # trades it makes, by symbol, until they are checked off
+
+    def __init__(self):
+        self.trades = {}
+
+    def append(self, kind, ts, payload=None):
+        if kind == KIND_TRADE:
+            self.trades.setdefault(payload["symbol"], deque()).append(_trade_bytes(payload))
+
+
+def replay_journal(records, make_exchange):
+    # Feed journal records into a fresh exchange as fast as it takes them.
+    #
+    # `make_exchange(clock)` builds the exchange to replay into, it is called
+    # with the clock already set to the first record so anything read from it
+    # during setup matches the capture. Every trade the journal recorded must
+    # come out of the replay byte for byte, in the same order for its symbol.
+    # Returns a report of what was replayed, how fast and any mismatch
+    records = iter(records)
+    first = next(records, None)
+    clock = ReplayClock(first.ts if first else 0.0)
+    tape = _ReplayTape()
+    exchange = make_exchange(clock)
+    exchange.journal = tape
+
+    n_messages = n_ticks = n_trades = 0
+    mismatch = None
+    exchange_seconds = 0.0
+    start = time.perf_counter()
+    for record in itertools.chain([first] if first else [], records):
+        if record.kind in (KIND_MESSAGE, KIND_TICK):
+            clock.now = record.ts
+            t = time.perf_counter()
+            if record.kind == KIND_MESSAGE:
+                exchange.recv(record.payload)
+                n_messages += 1
+            else:
+                exchange.tick()
+                n_ticks += 1
+            exchange_seconds += time.perf_counter() - t
+
+        elif record.kind == KIND_TRADE:
+            n_trades += 1
+            made = tape.trades.get(record.payload["symbol"])
+            expected = _trade_bytes(record.payload)
+            actual = made.popleft() if made else None
+            if actual != expected and mismatch is None:
+                mismatch = {
+                    "seq": record.seq,
+                    "expected": expected.decode("ascii"),
+                    "actual": actual.decode("ascii") if actual else None,
+                }
+    elapsed = time.perf_counter() - start
+
+    # Anything made and never recorded is a mismatch too
+    extra = sum(len(made) for made in tape.trades.values())
+    if extra and mismatch is None:
+        mismatch = {
+            "seq": None,
+            "expected": None,
+            "actual": next(made[0] for made in tape.trades.values() if made).decode("ascii"),
+        }
+
+    return {
+        "messages": n_messages,
+        "ticks": n_ticks,
+        "trades": n_trades,
+        "extra_trades": extra,
+        "identical": mismatch is None,
+        "mismatch": mismatch,
+        "seconds": elapsed,
+        "exchange_seconds": exchange_seconds,
+        "messages_per_second": n_messages / elapsed if elapsed > 0 else 0.0,
+        "exchange": exchange,
+    }
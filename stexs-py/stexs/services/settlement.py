@@ -0,0 +1,168 @@
+from stexs.domain.model import Trade
+from stexs.domain.order import Order
+from stexs.services.logger import log
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional
+import threading
+import time
+
+@dataclass
+class SettlementEvent:
+    seq: int
+    ts: float
+    buys: List[Order] = field(default_factory = list)
+    sells: List[Order] = field(default_factory = list)
+    trade: Optional[Trade] = None
+    error: Optional[Exception] = None # Why the event last failed to settle
+
+
+class SettlementWorker:
+    # Applies executed trades to client stores off the matching path.
+    # The Exchange emits a SettlementEvent per executed trade and this worker
+    # drains them in batches, handing all buys, sells and trades in a batch to
+    # `settle` so the brokers can apply them in a single UoW.
+    #
+    # `lock` is held around settling each batch, `settle` is left to lock the
+    # accounts it touches.
+    #
+    # A batch that fails is kept, not dropped, and settled_seq stops short of
+    # it so flush() and lag() show the client stores are behind. The worker
+    # does not retry by itself as `settle` may have applied part of a batch
+    # before failing, retry_failed() queues the failed events up again once
+    # whatever went wrong has been seen to
+
+    def __init__(self, settle, batch_size=100, lock=None):
+        self.settle = settle
+        self.batch_size = batch_size
+        self.lock = lock if lock is not None else threading.RLock()
+
+        self._events = deque()
+        self._retries = deque() # Failed events queued to settle again
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self.emitted_seq = 0
+        self.processed_seq = 0 # Every event up to here has been tried
+        self.settled_seq = 0 # Every event up to here has settled
+        self.failed = [] # SettlementEvents that failed, in seq order
+        self.settled_ts = None
+        self.n_batches = 0
+        self.n_failed = 0
+
+    def start(self):
+        if self._thread:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="stex-settlement", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        # Drain anything outstanding before letting the worker go
+        self.flush(timeout=timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def emit(self, buys, sells, trade=None):
+        with self._cond:
+            self.emitted_seq += 1
+            self._events.append(SettlementEvent(seq=self.emitted_seq, ts=time.time(), buys=buys, sells=sells, trade=trade))
+            self._cond.notify_all()
+        return self.emitted_seq
+
+    def flush(self, timeout=None):
+        # Barrier: block until every event emitted before the call has been
+        # tried, returns True only if they all settled
+        with self._cond:
+            target = self.emitted_seq
+            tried = self._cond.wait_for(
+                lambda: self.processed_seq >= target and len(self._retries) == 0,
+                timeout=timeout,
+            )
+            return tried and self.settled_seq >= target
+
+    def retry_failed(self):
+        # Queue failed events to be settled again ahead of anything newer,
+        # returns how many were queued. Only the worker takes events off the
+        # front of a queue so they can be added to while a batch settles
+        with self._cond:
+            retry = self.failed
+            self.failed = []
+            self._retries.extend(retry)
+            self._cond.notify_all()
+            return len(retry)
+
+    def _update_settled_seq(self):
+        # Held back to just before the oldest event that failed or is queued
+        # for a retry
+        oldest = [event.seq for event in self.failed[:1]] + [event.seq for event in self._retries]
+        self.settled_seq = min(oldest) - 1 if oldest else self.processed_seq
+
+    def lag(self):
+        with self._cond:
+            oldest_ts = min([queue[0].ts for queue in (self._retries, self._events) if len(queue) > 0], default=None)
+            return {
+                "pending": len(self._retries) + len(self._events),
+                "emitted_seq": self.emitted_seq,
+                "settled_seq": self.settled_seq,
+                "lag_seconds": (time.time() - oldest_ts) if oldest_ts else 0.0,
+                "batches": self.n_batches,
+                "failed": len(self.failed),
+                "failed_seqs": [event.seq for event in self.failed],
+                "failures": self.n_failed,
+            }
+
+    def _next_batch(self):
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._retries) > 0 or len(self._events) > 0 or not self._running)
+            queue = self._retries if len(self._retries) > 0 else self._events
+            batch = []
+            # Leave events on the queue until they are settled so lag() sees them
+            for event in queue:
+                batch.append(event)
+                if len(batch) >= self.batch_size:
+                    break
+            return queue, batch
+
+    def _run(self):
+        while True:
+            queue, batch = self._next_batch()
+            if len(batch) == 0:
+                # Only wakes with an empty queue when stopping
+                return
+
+            buys = []
+            sells = []
+            trades = []
+            for event in batch:
+                buys.extend(event.buys)
+                sells.extend(event.sells)
+                if event.trade is not None:
+                    trades.append(event.trade)
+
+            error = None
+            try:
+                with self.lock:
+                    self.settle(buys, sells, trades=trades)
+            except Exception as e:
+                error = e
+                log.exception(e)
+
+            with self._cond:
+                for _ in batch:
+                    queue.popleft()
+                if error is not None:
+                    for event in batch:
+                        event.error = error
+                    self.failed = sorted(self.failed + batch, key=lambda event: event.seq)
+                    self.n_failed += len(batch)
+                self.processed_seq = max(self.processed_seq, batch[-1].seq)
+                self._update_settled_seq()
+                self.settled_ts = time.time()
+                self.n_batches += 1
+                self._cond.notify_all()
@@ -0,0 +1,77 @@
+from stexs.domain.order import Order
+from bisect import bisect_left, insort
+import itertools
+
+class StopBook:
+    # Pending stop and stop-limit orders for one symbol, indexed by trigger price.
+    #
+    # Buy stops trigger once the last price rises to their stop price and sell
+    # stops once it falls to theirs. Each side is kept sorted so the stops next
+    # to trigger sit at the end, so releasing the k stops a price move crosses
+    # is one bisect and a slice: O(log n + k) however many stops are waiting.
+    # Stops crossed by the same move are released best stop price first, then
+    # in the order they arrived.
+    #
+    # Cancelling a stop bisects to its key and takes it out of its side, so
+    # sides only ever hold stops that are still waiting.
+
+    def __init__(self):
+        self._seq = itertools.count()
+        self._keys = {
+            "BUY": [], # (-stop_price, -seq, txid)
+            "SELL": [], # (stop_price, -seq, txid)
+        }
+        self._orders = {}
+        self._key_of = {} # txid -> its key in a side
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, txid):
+        return txid in self._orders
+
+    def get(self, txid):
+        return self._orders.get(txid)
+
+    def txids(self):
+        return list(self._orders)
+
+    def add(self, order: Order):
+        self.remove(order.txid) # Replaced rather than keyed twice
+        seq = next(self._seq)
+        if order.side == "BUY":
+            key = (-order.stop_price, -seq, order.txid)
+        else:
+            key = (order.stop_price, -seq, order.txid)
+        insort(self._keys[order.side], key)
+        self._orders[order.txid] = order
+        self._key_of[order.txid] = key
+
+    def remove(self, txid):
+        order = self._orders.pop(txid, None)
+        if order:
+            key = self._key_of.pop(txid)
+            keys = self._keys[order.side]
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+        return order
+
+    def _release(self, side, bound):
+        keys = self._keys[side]
+        i = bisect_left(keys, (bound, float("-inf")))
+        released = []
+        for key in reversed(keys[i:]):
+            released.append(self._orders.pop(key[2]))
+            del self._key_of[key[2]]
+        del keys[i:]
+        return released
+
+    def trigger(self, high, low=None):
+        # Release the stops reached by trading up to `high` and down to `low`,
+        # which is the last price when only one is given
+        if low is None:
+            low = high
+        if high is None:
+            return []
+        return self._release("BUY", -high) + self._release("SELL", low)
@@ -0,0 +1,99 @@
+import math
+import threading
+
+class TimingWheel:
+    # Hierarchical timing wheel of keys to expire at given times.
+    #
+    # Level 0 has a slot per tick, each level above has a slot per revolution of
+    # the level below. A key is kept in the lowest level that can tell its tick
+    # apart and moves down a level each time its slot comes round, so advancing
+    # a tick only touches the keys due in it (plus the occasional cascade) and
+    # never depends on how many keys are waiting further out.
+    #
+    # Cancelling just forgets the key, anything left behind in a slot is
+    # skipped when the slot comes round. Safe to share between threads.
+
+    def __init__(self, tick=1.0, slots=64, levels=4, now=0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._current = math.floor(now / tick)
+        self._deadlines = {} # key -> expire_ts
+        self._due = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _place(self, key, expire_ts):
+        due_tick = math.ceil(expire_ts / self.tick)
+        if due_tick <= self._current:
+            self._due.append((key, expire_ts))
+            return
+
+        for level in range(self.levels):
+            span = self.slots ** level
+            if (due_tick // span) - (self._current // span) < self.slots:
+                self._wheels[level][(due_tick // span) % self.slots].append((key, expire_ts))
+                return
+
+        # Beyond the top level, park in its last slot to come round and place
+        # again from there
+        span = self.slots ** (self.levels - 1)
+        self._wheels[-1][((self._current // span) - 1) % self.slots].append((key, expire_ts))
+
+    def schedule(self, key, expire_ts):
+        with self._lock:
+            self._deadlines[key] = expire_ts
+            self._place(key, expire_ts)
+
+    def cancel(self, key):
+        # Returns when the key was due to expire, or None
+        with self._lock:
+            return self._deadlines.pop(key, None)
+
+    def advance(self, now):
+        # Move the wheel on to `now`, returning the keys that have expired
+        with self._lock:
+            return self._advance(now)
+
+    def _advance(self, now):
+        target = math.floor(now / self.tick)
+        entries = self._due
+        self._due = []
+
+        while self._current < target:
+            if len(self._deadlines) == 0:
+                # Nothing waiting so there is nothing to tick through
+                self._current = target
+                break
+            self._current += 1
+
+            # Cascade from the top down so keys can fall more than one level
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if self._current % span == 0:
+                    slot = self._wheels[level][(self._current // span) % self.slots]
+                    self._wheels[level][(self._current // span) % self.slots] = []
+                    for key, expire_ts in slot:
+                        if self._deadlines.get(key) == expire_ts:
+                            self._place(key, expire_ts)
+
+            slot = self._current % self.slots
+            entries.extend(self._wheels[0][slot])
+            self._wheels[0][slot] = []
+            entries.extend(self._due)
+            self._due = []
+
+        expired = []
+        for key, expire_ts in entries:
+            # Skip keys cancelled or rescheduled since they were placed
+            if self._deadlines.get(key) == expire_ts:
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
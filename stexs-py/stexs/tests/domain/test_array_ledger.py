@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from stexs.domain.broker import (
+    ArrayLedger,
+    CASH,
+    InsufficientBalanceException,
+    InsufficientHoldingException,
+    Ledger,
+    LedgerEntry,
+)
+
+@pytest.fixture(params=[Ledger, ArrayLedger])
+def ledger(request):
+    ledger = request.param()
+    ledger.open_account("1", {CASH: 100, "STI.": 100})
+    ledger.open_account("2", {CASH: 50})
+    return ledger
+
+def test_reserve_and_settle(ledger):
+    ledger.reserve("1", CASH, 60)
+    with pytest.raises(InsufficientBalanceException, match="Insufficient balance"):
+        ledger.reserve("1", CASH, 41)
+    ledger.settle("1", CASH, 60, -45)
+    assert ledger.get("1", CASH) == LedgerEntry(settled=55, reserved=0)
+
+    ledger.reserve("1", "STI.", 100)
+    with pytest.raises(InsufficientHoldingException, match="Insufficient holding"):
+        ledger.reserve("1", "STI.", 1)
+    with pytest.raises(InsufficientHoldingException, match="No holding"):
+        ledger.reserve("2", "STI.", 1)
+
+def test_settle_many_accumulates(ledger):
+    ledger.reserve("1", "STI.", 30)
+    ledger.settle_many([
+        ("1", "STI.", 10, -10),
+        ("1", "STI.", 20, -20),
+        ("2", "STI.", 0, 30),
+        ("2", CASH, 0, 45),
+        (1, CASH, 0, -45),
+    ])
+    assert ledger.get_account("1") == {CASH: LedgerEntry(55, 0), "STI.": LedgerEntry(70, 0)}
+    assert ledger.get_account("2") == {CASH: LedgerEntry(95, 0), "STI.": LedgerEntry(30, 0)}
+
+def test_valuations(ledger):
+    ledger.deposit("2", "ELAN", 10)
+    assert ledger.valuations({"STI.": 0.5, "ELAN": 2}) == {"1": 150, "2": 70}
+
+def test_array_ledger_grows():
+    ledger = ArrayLedger(n_accounts=2, n_symbols=1)
+    for i in range(10):
+        ledger.open_account(str(i), {CASH: i, "S%d" % i: i})
+    for i in range(10):
+        assert ledger.get(str(i), CASH).settled == i
+        assert ledger.get(str(i), "S%d" % i).settled == i
+        assert ledger.get(str(i), "S%d" % ((i + 1) % 10)) == LedgerEntry()
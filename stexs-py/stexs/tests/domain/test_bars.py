@@ -0,0 +1,39 @@
+from stexs.domain.bars import BarSeries
+
+def test_bars_roll_over_by_interval():
+    series = BarSeries(60, size=4)
+    series.add(120, 1.0, 10)
+    series.add(150, 1.5, 5)
+    series.add(179, 0.5, 1)
+    series.add(180, 0.8, 2)
+    # Nothing traded in [240, 300) so there is no bar for it
+    series.add(305, 0.9, 3)
+
+    assert len(series) == 3
+    assert series.latest() == [
+        [120, 1.0, 1.5, 0.5, 0.5, 16, 3],
+        [180, 0.8, 0.8, 0.8, 0.8, 2, 1],
+        [300, 0.9, 0.9, 0.9, 0.9, 3, 1],
+    ]
+    assert series.latest(1) == [[300, 0.9, 0.9, 0.9, 0.9, 3, 1]]
+    assert series.latest(0) == []
+
+    # A late trade joins the current bar
+    series.add(200, 1.1, 1)
+    assert series.latest(1) == [[300, 0.9, 1.1, 0.9, 1.1, 4, 2]]
+
+def test_bars_ring_keeps_most_recent():
+    series = BarSeries(1, size=3)
+    for ts in range(10):
+        series.add(ts, float(ts), 1)
+    assert len(series) == 3
+    assert [bar[0] for bar in series.latest()] == [7, 8, 9]
+    assert BarSeries.serialise(series.latest(1)[0]) == {
+        "ts": 9,
+        "open": "9.0",
+        "high": "9.0",
+        "low": "9.0",
+        "close": "9.0",
+        "volume": 1,
+        "num_trades": 1,
+    }
@@ -0,0 +1,35 @@
+import pytest
+import statistics
+
+from stexs.domain.rolling import RollingWindow
+
+def test_rolling_trades_window():
+    window = RollingWindow(n=3)
+    prices = [10.0, 12.0, 11.0, 15.0, 9.0]
+    for i, price in enumerate(prices):
+        window.add(i, price, i + 1)
+
+    assert len(window) == 3
+    assert window.volume == 3 + 4 + 5
+    assert window.notional == pytest.approx(11.0 * 3 + 15.0 * 4 + 9.0 * 5)
+    assert window.vwap == pytest.approx(window.notional / 12)
+    assert window.price_stddev == pytest.approx(statistics.pstdev([11.0, 15.0, 9.0]))
+    assert window.name == "trades_3"
+
+def test_rolling_seconds_window():
+    window = RollingWindow(seconds=60)
+    assert window.vwap is None and window.price_stddev is None
+
+    window.add(0, 1.0, 10)
+    window.add(30, 2.0, 10)
+    window.add(70, 3.0, 10)
+    # The trade at 0 aged out when the one at 70 came in
+    assert window.volume == 20
+    assert window.price_stddev == pytest.approx(0.5)
+
+    window.expire(125)
+    assert len(window) == 1
+    window.expire(130)
+    assert len(window) == 0
+    assert window.volume == 0
+    assert window.summary()["vwap"] is None
@@ -0,0 +1,120 @@
+import asyncio
+import socket
+import threading
+import pytest
+
+from stexs.io.client import ExchangeClient, AsyncExchangeClient, ConnectionClosedException
+from stexs.io.server import AsyncExchangeServer
+from stexs.io.wire import BINARY_CODEC
+from stexs.services.marketdata import MarketDataFeed
+
+class EchoExchange:
+    def __init__(self):
+        self.seen = []
+        self.feed = MarketDataFeed()
+        self.feed.add_book("STI.")
+
+    def recv(self, msg):
+        if msg.get("message_type") == "market_data_subscribe":
+            sub = self.feed.subscribe(msg["symbols"])
+            return {"response_type": "market_data_subscribe", "response_code": 0, "subscription_id": sub.sid}
+        self.seen.append(msg["txid"])
+        return {"response_type": "echo", "response_code": 0, "txid": msg["txid"]}
+
+class ServerThread:
+    # Runs an AsyncExchangeServer on its own loop so blocking clients can use it
+    def __init__(self, exchange):
+        self.loop = asyncio.new_event_loop()
+        self.server = AsyncExchangeServer(exchange, host="127.0.0.1", port=0)
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result(timeout=5)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+
+def test_requests_share_one_connection():
+    stex = EchoExchange()
+    with ServerThread(stex) as server:
+        with ExchangeClient("127.0.0.1", server.port, timeout=5) as client:
+            replies = [client.request({"txid": i}) for i in range(10)]
+            assert server.server.n_connections == 1
+    assert [reply["txid"] for reply in replies] == list(range(10))
+    assert stex.seen == list(range(10))
+
+def test_pipeline_replies_in_order():
+    stex = EchoExchange()
+    with ServerThread(stex) as server:
+        with ExchangeClient("127.0.0.1", server.port, timeout=5) as client:
+            replies = client.pipeline([{"txid": i} for i in range(100)])
+            assert client.n_outstanding == 0
+    assert [reply["txid"] for reply in replies] == list(range(100))
+
+def test_client_negotiates_codec_on_connect():
+    with ServerThread(EchoExchange()) as server:
+        with ExchangeClient("127.0.0.1", server.port, codec=BINARY_CODEC, timeout=5) as client:
+            assert client.codec is BINARY_CODEC
+            assert client.request({"txid": 1})["txid"] == 1
+
+def test_recv_raises_when_exchange_hangs_up():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+
+    def hang_up():
+        conn, _ = listener.accept()
+        conn.close()
+    thread = threading.Thread(target=hang_up)
+    thread.start()
+
+    client = ExchangeClient("127.0.0.1", port, timeout=5).connect()
+    thread.join()
+    with pytest.raises(ConnectionClosedException):
+        client.request({"txid": 1})
+    assert not client.connected
+    listener.close()
+
+def test_async_concurrent_requests_are_matched_to_replies():
+    async def scenario():
+        stex = EchoExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        async with AsyncExchangeClient("127.0.0.1", port) as client:
+            # Many tasks sharing one connection
+            replies = await asyncio.wait_for(asyncio.gather(*[client.request({"txid": i}) for i in range(50)]), timeout=5)
+            pipelined = await asyncio.wait_for(client.pipeline([{"txid": i} for i in range(50, 60)]), timeout=5)
+        await server.close()
+        return replies, pipelined
+
+    replies, pipelined = asyncio.run(scenario())
+    assert [reply["txid"] for reply in replies] == list(range(50))
+    assert [reply["txid"] for reply in pipelined] == list(range(50, 60))
+
+def test_async_stream_receives_feed_after_subscribe():
+    async def scenario():
+        stex = EchoExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        async with AsyncExchangeClient("127.0.0.1", port) as client:
+            reply = await asyncio.wait_for(client.subscribe(["STI."]), timeout=5)
+            stream = client.stream()
+            snapshot = await asyncio.wait_for(stream.__anext__(), timeout=5)
+        await server.close()
+        return reply, snapshot
+
+    reply, snapshot = asyncio.run(scenario())
+    assert reply["response_code"] == 0
+    assert snapshot["response_type"] == "book_snapshot"
+    assert snapshot["symbol"] == "STI."
@@ -0,0 +1,113 @@
+import math
+import pytest
+
+from stexs.io.wire import (
+    JSON_CODEC,
+    BINARY_CODEC,
+    CodecException,
+    negotiate_codec,
+)
+from stexs.io.wire.codec import TAG_NEW_ORDER, TAG_ORDER_ACK, TAG_TRADE, TAG_BOOK_DELTA
+
+@pytest.fixture
+def new_order():
+    return {
+        "message_type": "new_order",
+        "txid": "a1b2-1",
+        "broker_id": "MAGENTA",
+        "account_id": "1",
+        "side": "SELL",
+        "symbol": "STI.",
+        "price": "1.25",
+        "volume": 7,
+        "sender_ts": 1660000000,
+    }
+
+def test_new_order_round_trip(new_order):
+    payload = BINARY_CODEC.encode(new_order)
+    assert payload[0] == TAG_NEW_ORDER
+    decoded = BINARY_CODEC.decode(payload)
+    assert decoded == dict(new_order, price=1.25)
+
+def test_new_order_market_and_no_sender_ts(new_order):
+    new_order["price"] = None
+    del new_order["sender_ts"]
+    decoded = BINARY_CODEC.decode(BINARY_CODEC.encode(new_order))
+    assert decoded["price"] is None
+    assert "sender_ts" not in decoded
+
+def test_new_order_falls_back_to_json(new_order):
+    for bad in [{"txid": 1}, {"txid": "x" * 17}, {"corr_id": "8"}, {"volume": "7"}, {"type": "order"}]:
+        msg = dict(new_order, **bad)
+        payload = BINARY_CODEC.encode(msg)
+        assert payload[0:1] == b"{"
+        assert BINARY_CODEC.decode(payload) == msg
+
+def test_new_order_corr_id(new_order):
+    new_order["corr_id"] = 88
+    payload = BINARY_CODEC.encode(new_order)
+    assert payload[0] == TAG_NEW_ORDER
+    assert BINARY_CODEC.decode(payload)["corr_id"] == 88
+
+def test_order_ack_round_trip():
+    ack = {
+        "order": {"txid": "1", "csid": "1", "ts": 5, "side": "BUY", "symbol": "STI.", "price": None, "volume": 10, "closed": False,
+            "tif": "GTT", "expire_ts": 60.5, "stop_price": 1.25},
+        "response_type": "new_order",
+        "response_code": 0,
+        "msg": "ok",
+    }
+    payload = BINARY_CODEC.encode(ack)
+    assert payload[0] == TAG_ORDER_ACK
+    assert BINARY_CODEC.decode(payload) == ack
+
+    ack["corr_id"] = 3
+    assert BINARY_CODEC.decode(BINARY_CODEC.encode(ack)) == ack
+
+def test_exception_reply_stays_json():
+    reply = {"response_type": "exception", "response_code": 404, "msg": "unknown symbol"}
+    assert BINARY_CODEC.encode(reply) == JSON_CODEC.encode(reply)
+
+def test_trade_round_trip():
+    trade = {
+        "response_type": "trade", "response_code": 0, "msg": "ok",
+        "symbol": "STI.", "seq": 3, "tid": "abcde", "ts": 10, "price": "0.75", "volume": 100,
+        "buy_txid": "1", "sell_txids": ["2", "3"],
+    }
+    payload = BINARY_CODEC.encode(trade)
+    assert payload[0] == TAG_TRADE
+    assert BINARY_CODEC.decode(payload) == dict(trade, price=0.75)
+
+def test_book_delta_round_trip():
+    delta = {
+        "response_type": "book_delta", "response_code": 0, "msg": "ok",
+        "symbol": "STI.", "seq": 4,
+        "deltas": [{"side": "BUY", "price": "1.0", "volume": 0}, {"side": "SELL", "price": "0.75", "volume": 50}],
+    }
+    payload = BINARY_CODEC.encode(delta)
+    assert payload[0] == TAG_BOOK_DELTA
+    decoded = BINARY_CODEC.decode(payload)
+    assert decoded["deltas"] == [{"side": "BUY", "price": 1.0, "volume": 0}, {"side": "SELL", "price": 0.75, "volume": 50}]
+
+def test_json_codec_decodes_binary(new_order):
+    assert JSON_CODEC.decode(BINARY_CODEC.encode(new_order))["txid"] == "a1b2-1"
+
+def test_truncated_record(new_order):
+    payload = BINARY_CODEC.encode(new_order)
+    with pytest.raises(CodecException, match="Malformed binary record"):
+        BINARY_CODEC.decode(payload[:-1])
+
+def test_unknown_record():
+    with pytest.raises(CodecException, match="Unknown binary record"):
+        BINARY_CODEC.decode(b"\x1f")
+
+def test_negotiate():
+    codec, reply = negotiate_codec({"message_type": "hello", "encoding": "binary"})
+    assert codec is BINARY_CODEC
+    assert reply["response_type"] == "hello"
+    assert reply["encoding"] == "binary"
+
+    codec, reply = negotiate_codec({"message_type": "hello", "encoding": "xml"}, current=codec)
+    assert codec is BINARY_CODEC
+    assert reply["response_type"] == "exception"
+    assert reply["msg"] == "unknown encoding"
@@ -0,0 +1,56 @@
+import pytest
+import socket
+
+from stexs.io.wire import (
+    FrameReader,
+    FramingException,
+    encode_frame,
+    encode_message,
+    decode_message,
+)
+
+def test_encode_frame_header():
+    assert encode_frame(b"hoot") == b"\x00\x00\x00\x04hoot"
+
+def test_many_frames_one_read():
+    reader = FrameReader()
+    data = encode_frame(b"1") + encode_frame(b"22") + encode_frame(b"")
+    assert reader.feed(data) == [b"1", b"22", b""]
+    assert reader.buffered == 0
+
+def test_frame_spans_reads():
+    reader = FrameReader()
+    data = encode_frame(b"hello world")
+    assert reader.feed(data[:2]) == []
+    assert reader.feed(data[2:7]) == []
+    assert reader.feed(data[7:]) == [b"hello world"]
+    assert reader.buffered == 0
+
+def test_partial_frame_kept_after_complete_one():
+    reader = FrameReader()
+    data = encode_frame(b"first") + encode_frame(b"second")
+    assert reader.feed(data[:-3]) == [b"first"]
+    assert reader.buffered == len(encode_frame(b"second")) - 3
+    assert reader.feed(data[-3:]) == [b"second"]
+
+def test_oversize_frame_rejected():
+    reader = FrameReader(max_frame_size=8)
+    with pytest.raises(FramingException, match="Frame too large"):
+        reader.feed(encode_frame(b"x" * 9))
+    assert reader.buffered == 0
+
+def test_message_round_trip():
+    msg = {"message_type": "new_order", "price": "1.01", "volume": 100}
+    reader = FrameReader()
+    assert [decode_message(payload) for payload in reader.feed(encode_message(msg))] == [msg]
+
+def test_read_frame_from_socket():
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(encode_message({"txid": 1}) + encode_message({"txid": 2}))
+        left.shutdown(socket.SHUT_WR)
+
+        reader = FrameReader()
+        assert decode_message(reader.read_frame(right)) == {"txid": 1}
+        assert decode_message(reader.read_frame(right)) == {"txid": 2}
+        assert reader.read_frame(right) is None
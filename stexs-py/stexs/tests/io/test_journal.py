@@ -0,0 +1,37 @@
+from stexs.io.journal import JournalWriter, read_journal, KIND_MESSAGE, KIND_TICK
+
+def test_journal_round_trip(tmp_path):
+    path = tmp_path / "journal"
+    with JournalWriter(path) as journal:
+        assert journal.append(KIND_MESSAGE, 1.5, {"message_type": "list_stocks"}) == 1
+        assert journal.append(KIND_TICK, 2.5) == 2
+
+    records = list(read_journal(path))
+    assert [(r.kind, r.seq, r.ts, r.payload) for r in records] == [
+        (KIND_MESSAGE, 1, 1.5, {"message_type": "list_stocks"}),
+        (KIND_TICK, 2, 2.5, None),
+    ]
+
+def test_journal_stops_at_partial_record(tmp_path):
+    path = tmp_path / "journal"
+    with JournalWriter(path) as journal:
+        journal.append(KIND_MESSAGE, 1.0, {"message_type": "list_stocks"})
+        journal.append(KIND_MESSAGE, 2.0, {"message_type": "list_stocks"})
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    assert [r.seq for r in read_journal(path)] == [1]
+
+def test_journal_flushes_on_size_and_time(tmp_path):
+    path = tmp_path / "journal"
+    now = [0.0]
+    with JournalWriter(path, flush_bytes=100, flush_interval=10, clock=lambda: now[0]) as journal:
+        journal.append(KIND_TICK, 1.0)
+        assert list(read_journal(path)) == []
+        journal.append(KIND_MESSAGE, 2.0, {"message_type": "x" * 100})
+        assert [r.seq for r in read_journal(path)] == [1, 2]
+
+        journal.append(KIND_TICK, 3.0)
+        assert len(list(read_journal(path))) == 2
+        now[0] = 10.0
+        journal.append(KIND_TICK, 4.0)
+        assert [r.seq for r in read_journal(path)] == [1, 2, 3, 4]
@@ -0,0 +1,268 @@
+import asyncio
+import pytest
+
+from stexs.io.server import AsyncExchangeServer
+from stexs.io.wire import FrameReader, encode_message, decode_message, encode_frame
+from stexs.services.marketdata import MarketDataFeed
+
+class RecordingExchange:
+    def __init__(self):
+        self.seen = []
+        self.active = 0
+
+    def recv(self, msg):
+        # Would trip if two messages were ever applied at once
+        self.active += 1
+        assert self.active == 1
+        self.seen.append(msg["txid"])
+        self.active -= 1
+        return {"response_type": "echo", "response_code": 0, "txid": msg["txid"]}
+
+async def _request(port, msgs):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    frames = FrameReader()
+    replies = []
+    for msg in msgs:
+        writer.write(encode_message(msg))
+        await writer.drain()
+        replies.extend(await _read_frames(reader, frames, 1))
+    writer.close()
+    return replies
+
+async def _read_frames(reader, frames, n):
+    payloads = []
+    while len(payloads) < n:
+        payloads.extend(frames.feed(await reader.read(1024)))
+    return [decode_message(payload) for payload in payloads]
+
+def _run(coro):
+    return asyncio.run(coro)
+
+def test_serves_concurrent_connections_past_idle_client():
+    async def scenario():
+        stex = RecordingExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        # An idle connection must not starve anyone else
+        idle_reader, idle_writer = await asyncio.open_connection("127.0.0.1", port)
+
+        clients = [
+            _request(port, [{"txid": "%d-%d" % (client, i)} for i in range(5)])
+            for client in range(10)
+        ]
+        replies = await asyncio.wait_for(asyncio.gather(*clients), timeout=5)
+
+        idle_writer.close()
+        await server.close()
+        return stex, server, replies
+
+    stex, server, replies = _run(scenario())
+
+    for client, client_replies in enumerate(replies):
+        assert [reply["txid"] for reply in client_replies] == ["%d-%d" % (client, i) for i in range(5)]
+    assert len(stex.seen) == 50
+    assert server.n_sequenced == 50
+
+def test_sequencer_preserves_submission_order():
+    async def scenario():
+        stex = RecordingExchange()
+        server = AsyncExchangeServer(stex)
+        server._sequencer = asyncio.create_task(server._sequence())
+        replies = await asyncio.gather(*[server.submit({"txid": i}) for i in range(100)])
+        await server.close()
+        return stex, replies
+
+    stex, replies = _run(scenario())
+    assert stex.seen == list(range(100))
+    assert [reply["txid"] for reply in replies] == list(range(100))
+
+def test_sequencer_survives_exchange_exception():
+    class ExplodingExchange:
+        def recv(self, msg):
+            raise Exception("bang")
+
+    async def scenario():
+        server = AsyncExchangeServer(ExplodingExchange())
+        server._sequencer = asyncio.create_task(server._sequence())
+        first = await server.submit({})
+        second = await server.submit({})
+        await server.close()
+        return first, second
+
+    first, second = _run(scenario())
+    assert first["response_type"] == "exception"
+    assert first["response_code"] == 70
+    assert second["msg"] == "bang"
+
+def test_coalesced_and_split_frames():
+    async def scenario():
+        stex = RecordingExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        frames = FrameReader()
+
+        # Three messages in one write, then one message dribbled over several
+        writer.write(b"".join(encode_message({"txid": i}) for i in range(3)))
+        await writer.drain()
+        payload = encode_message({"txid": 3, "padding": "x" * 5000})
+        for i in range(0, len(payload), 1000):
+            writer.write(payload[i:i+1000])
+            await writer.drain()
+            await asyncio.sleep(0.01)
+
+        replies = await asyncio.wait_for(_read_frames(reader, frames, 4), timeout=5)
+        writer.close()
+        await server.close()
+        return replies
+
+    replies = _run(scenario())
+    assert [reply["txid"] for reply in replies] == [0, 1, 2, 3]
+
+def test_malformed_message_reply():
+    async def scenario():
+        server = AsyncExchangeServer(RecordingExchange(), host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(encode_frame(b"{not json") + encode_message({"txid": 1}))
+        await writer.drain()
+        replies = await asyncio.wait_for(_read_frames(reader, FrameReader(), 2), timeout=5)
+        writer.close()
+        await server.close()
+        return replies
+
+    bad, good = _run(scenario())
+    assert bad["response_type"] == "exception"
+    assert bad["msg"] == "malformed message"
+    assert good["txid"] == 1
+
+def test_hello_negotiates_binary_replies():
+    async def scenario():
+        stex = RecordingExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        frames = FrameReader()
+        writer.write(encode_message({"message_type": "hello", "encoding": "binary"}))
+        await writer.drain()
+        hello = await asyncio.wait_for(_read_frames(reader, frames, 1), timeout=5)
+
+        writer.write(encode_message({"txid": 1}))
+        await writer.drain()
+        payloads = []
+        while len(payloads) < 1:
+            payloads.extend(frames.feed(await reader.read(1024)))
+
+        writer.close()
+        await server.close()
+        return stex, hello[0], payloads[0]
+
+    stex, hello, payload = _run(scenario())
+    # Negotiation is handled by the connection, not the exchange
+    assert stex.seen == [1]
+    assert hello["encoding"] == "binary"
+    assert decode_message(payload)["txid"] == 1
+
+def test_pipelined_requests_answered_in_order():
+    async def scenario():
+        stex = RecordingExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # Write every request before reading any reply
+        writer.write(b"".join(encode_message({"txid": i, "corr_id": i}) for i in range(200)))
+        await writer.drain()
+        replies = await asyncio.wait_for(_read_frames(reader, FrameReader(), 200), timeout=5)
+        writer.close()
+        await server.close()
+        return stex, replies
+
+    stex, replies = _run(scenario())
+    assert stex.seen == list(range(200))
+    assert [reply["txid"] for reply in replies] == list(range(200))
+
+class FeedExchange:
+    def __init__(self):
+        self.feed = MarketDataFeed()
+        self.feed.add_book("STI.")
+
+    def recv(self, msg):
+        if msg.get("message_type") == "market_data_subscribe":
+            sub = self.feed.subscribe(msg["symbols"])
+            return {"response_type": "market_data_subscribe", "response_code": 0, "msg": "ok", "subscription_id": sub.sid}
+        if msg.get("message_type") == "market_data_unsubscribe":
+            sub = self.feed.unsubscribe(msg["subscription_id"])
+            return {"response_type": "market_data_unsubscribe", "response_code": 0, "msg": "ok", "subscription_id": sub.sid}
+        return {"response_type": "echo", "response_code": 0, "txid": msg["txid"]}
+
+async def _wait_for(predicate, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return True
+        await asyncio.sleep(0.01)
+    return predicate()
+
+def test_subscribed_connection_keeps_reading():
+    async def scenario():
+        stex = FeedExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        frames = FrameReader()
+        # A message behind the subscribe in the same write is still answered
+        writer.write(encode_message({"message_type": "market_data_subscribe", "symbols": ["STI."]}) + encode_message({"txid": 1}))
+        await writer.drain()
+        first = await asyncio.wait_for(_read_frames(reader, frames, 3), timeout=5)
+        sid = first[0]["subscription_id"]
+
+        writer.write(encode_message({"message_type": "market_data_unsubscribe", "subscription_id": sid}))
+        await writer.drain()
+        unsubscribed = await asyncio.wait_for(_read_frames(reader, frames, 1), timeout=5)
+        streaming = len(server._streams)
+
+        writer.close()
+        await server.close()
+        return stex, first, unsubscribed[0], streaming
+
+    stex, first, unsubscribed, streaming = _run(scenario())
+    assert first[0]["response_type"] == "market_data_subscribe"
+    assert sorted(reply["response_type"] for reply in first[1:]) == ["book_snapshot", "echo"]
+    assert unsubscribed["response_type"] == "market_data_unsubscribe"
+    assert stex.feed.get_subscription(first[0]["subscription_id"]) is None
+    assert streaming == 0
+
+def test_subscription_closed_on_disconnect():
+    async def scenario():
+        stex = FeedExchange()
+        server = AsyncExchangeServer(stex, host="127.0.0.1", port=0)
+        await server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(encode_message({"message_type": "market_data_subscribe", "symbols": ["STI."]}))
+        await writer.drain()
+        replies = await asyncio.wait_for(_read_frames(reader, FrameReader(), 2), timeout=5)
+
+        # Nothing is published on the symbol so only the read can notice the client go
+        writer.close()
+        closed = await _wait_for(lambda: len(stex.feed._subscriptions) == 0 and server.n_connections == 0)
+        streaming = len(server._streams)
+        await server.close()
+        return replies, closed, streaming
+
+    replies, closed, streaming = _run(scenario())
+    assert replies[0]["response_type"] == "market_data_subscribe"
+    assert closed
+    assert streaming == 0
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import uuid
+import pytest
+
+pytest.importorskip("multiprocessing.shared_memory") # py3.8+
+
+from stexs.io.client import ExchangeClient
+from stexs.io.server import AsyncExchangeServer
+from stexs.io.shm import SPSCRing, RingGateway, ShmExchangeClient, ShmException
+from stexs.tests.io.test_client import EchoExchange, ServerThread
+
+def _ring_name():
+    return "stex-test-%s" % uuid.uuid4().hex[:8]
+
+@pytest.fixture
+def ring():
+    ring = SPSCRing.create(_ring_name(), capacity=4, slot_size=32)
+    yield ring
+    ring.unlink()
+
+def test_ring_round_trip_and_wrap(ring):
+    consumer = SPSCRing.attach(ring.name)
+    for i in range(10):
+        # Each pass reuses the slots of the last
+        assert ring.write(b"record %d" % i)
+        assert len(consumer) == 1
+        assert consumer.read() == b"record %d" % i
+    assert consumer.read() is None
+    consumer.close()
+
+def test_ring_full(ring):
+    consumer = SPSCRing.attach(ring.name)
+    for i in range(4):
+        assert ring.write(bytes([i]))
+    assert not ring.write(b"x")
+
+    assert consumer.read_many(2) == [b"\x00", b"\x01"]
+    assert ring.write(b"x")
+    assert consumer.read_many() == [b"\x02", b"\x03", b"x"]
+    consumer.close()
+
+def test_ring_rejects_bad_geometry_and_records(ring):
+    with pytest.raises(ShmException):
+        ring.write(b"x" * 32)
+    with pytest.raises(ShmException):
+        SPSCRing.create(_ring_name(), capacity=3)
+    with pytest.raises(ShmException):
+        SPSCRing.attach(_ring_name())
+
+class ServerWithGateway(ServerThread):
+    def __init__(self, exchange, name):
+        super().__init__(exchange)
+        self.name = name
+
+    def __enter__(self):
+        super().__enter__()
+        async def add_gateway():
+            return self.server.add_ring_gateway(RingGateway(self.name, capacity=8))
+        self.gateway = asyncio.run_coroutine_threadsafe(add_gateway(), self.loop).result(timeout=5)
+        return self
+
+def test_ring_gateway_requests():
+    stex = EchoExchange()
+    name = _ring_name()
+    with ServerWithGateway(stex, name) as server:
+        with ShmExchangeClient(name, timeout=5) as client:
+            assert client.request({"txid": 1})["txid"] == 1
+            # Longer than the ring so has to go in batches
+            replies = client.pipeline([{"txid": i} for i in range(2, 22)])
+            subscribe = client.request({"message_type": "market_data_subscribe", "symbols": ["STI."]})
+        assert server.gateway.n_requests == 22
+
+    assert [reply["txid"] for reply in replies] == list(range(2, 22))
+    assert stex.seen == list(range(1, 22))
+    assert subscribe["response_code"] == 1
+    # Gateway removes its rings on close
+    with pytest.raises(ShmException):
+        SPSCRing.attach("%s-req" % name)
+
+def test_unix_socket_listener(tmp_path):
+    stex = EchoExchange()
+    path = str(tmp_path / "stex.sock")
+
+    async def scenario():
+        server = AsyncExchangeServer(stex, path=path)
+        await server.start()
+        return server
+
+    with ServerThread(stex) as server:
+        unix_server = asyncio.run_coroutine_threadsafe(scenario(), server.loop).result(timeout=5)
+        with ExchangeClient(path=path, timeout=5) as client:
+            replies = client.pipeline([{"txid": i} for i in range(5)])
+        asyncio.run_coroutine_threadsafe(unix_server.close(), server.loop).result(timeout=5)
+
+    assert [reply["txid"] for reply in replies] == list(range(5))
+    assert not os.path.exists(path)
@@ -0,0 +1,69 @@
+import pytest
+
+from stexs.services.admission import AdmissionControl, TokenBucket, THROTTLED_RESPONSE_CODE
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+def test_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=10, burst=5, now=0)
+    bucket.tokens = 0
+    assert bucket.wait_time() == 0.1
+    assert bucket.refill(0.2) == 2
+    assert bucket.refill(10) == 5
+
+def test_account_burst_then_rate(clock):
+    admission = AdmissionControl(account_limit=(2, 3), clock=clock)
+    assert [admission.admit("MAGENTA", "1") for _ in range(3)] == [None, None, None]
+
+    reply = admission.admit("MAGENTA", "1")
+    assert reply["response_code"] == THROTTLED_RESPONSE_CODE
+    assert reply["scope"] == "account"
+    assert reply["retry_after"] == 0.5
+
+    # Other accounts have their own bucket
+    assert admission.admit("MAGENTA", "2") is None
+
+    clock.now = 0.5
+    assert admission.admit("MAGENTA", "1") is None
+    assert admission.admit("MAGENTA", "1") is not None
+
+    metrics = admission.metrics()
+    assert metrics["admitted"] == 5
+    assert metrics["throttled"] == 2
+    assert metrics["throttled_accounts"] == {"MAGENTA/1": 2}
+
+def test_throttled_account_does_not_spend_broker_tokens(clock):
+    admission = AdmissionControl(broker_limit=(0, 3), account_limit=(0, 1), clock=clock)
+    assert admission.admit("MAGENTA", "1") is None
+    for _ in range(5):
+        assert admission.admit("MAGENTA", "1")["scope"] == "account"
+
+    assert admission.admit("MAGENTA", "2") is None
+    assert admission.admit("MAGENTA", "3") is None
+    reply = admission.admit("MAGENTA", "4")
+    assert reply["scope"] == "broker"
+    assert reply["retry_after"] is None
+    assert admission.metrics()["throttled_brokers"] == {"MAGENTA": 1}
+
+def test_per_key_limits_override_defaults(clock):
+    admission = AdmissionControl(clock=clock)
+    admission.set_account_limit("MAGENTA", "1", 0, 1)
+    admission.set_broker_limit("CYAN", 0, 1)
+
+    # Unlimited by default
+    for _ in range(100):
+        assert admission.admit("MAGENTA", "2") is None
+
+    assert admission.admit("MAGENTA", "1") is None
+    assert admission.admit("MAGENTA", "1") is not None
+    assert admission.admit("CYAN", "1") is None
+    assert admission.admit("CYAN", "2") is not None
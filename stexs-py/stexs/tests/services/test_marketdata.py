@@ -0,0 +1,125 @@
+import pytest
+
+from stexs.domain.model import Trade
+from stexs.domain.order import Order
+from stexs.services.marketdata import MarketDataFeed
+
+@pytest.fixture
+def feed():
+    feed = MarketDataFeed(snapshot_interval=100)
+    feed.add_book("STI.")
+    return feed
+
+def _order(txid, side, price, volume):
+    return Order(txid=txid, csid="1", ts=0, side=side, symbol="STI.", price=price, volume=volume)
+
+def _trade(buy_txid, sell_txids, volume, excess=0, price=1.0):
+    return Trade(tid="t%s" % buy_txid, ts=0, symbol="STI.", buy_txid=buy_txid, sell_txids=sell_txids,
+            avg_price=price, total_price=price*volume, volume=volume, excess=excess)
+
+def test_subscribe_starts_with_snapshot(feed):
+    feed.add_order(_order("1", "BUY", 1.0, 10))
+    feed.publish("STI.")
+
+    sub = feed.subscribe(["STI."])
+    msgs = sub.drain()
+    assert len(msgs) == 1
+    assert msgs[0]["response_type"] == "book_snapshot"
+    assert msgs[0]["seq"] == 1
+    assert msgs[0]["buy_levels"] == [["1.0", 10]]
+    assert msgs[0]["sell_levels"] == []
+
+def test_delta_aggregates_level(feed):
+    sub = feed.subscribe(["STI."])
+    sub.drain()
+
+    feed.add_order(_order("1", "BUY", 1.0, 10))
+    feed.add_order(_order("2", "BUY", 1.0, 5))
+    feed.add_order(_order("3", "SELL", 2.0, 7))
+    feed.publish("STI.")
+
+    msgs = sub.drain()
+    assert len(msgs) == 1
+    assert msgs[0]["response_type"] == "book_delta"
+    assert msgs[0]["seq"] == 1
+    assert msgs[0]["deltas"] == [
+        {"side": "BUY", "price": "1.0", "volume": 15},
+        {"side": "SELL", "price": "2.0", "volume": 7},
+    ]
+
+def test_market_orders_not_levels(feed):
+    feed.add_order(_order("1", "BUY", None, 10))
+    feed.add_order(_order("2", "SELL", float("-inf"), 10))
+    assert feed.publish("STI.") == []
+
+def test_trade_print_and_split(feed):
+    feed.add_order(_order("1", "SELL", 1.0, 10))
+    feed.add_order(_order("2", "SELL", 1.5, 10))
+    feed.publish("STI.")
+
+    sub = feed.subscribe(["STI."])
+    sub.drain()
+
+    # Buy 15 takes all of 1 and 5 of 2 leaving 5 resting as 2/1
+    feed.add_order(_order("3", "BUY", 1.5, 15))
+    feed.add_trade(_trade("3", ["1", "2"], 15, excess=5, price=1.5))
+    feed.publish("STI.")
+
+    trade, delta = sub.drain()
+    assert trade["response_type"] == "trade"
+    assert trade["seq"] == 2
+    assert trade["buy_txid"] == "3"
+    assert trade["sell_txids"] == ["1", "2"]
+    assert trade["volume"] == 15
+
+    assert delta["response_type"] == "book_delta"
+    assert delta["seq"] == 3
+    # The buy never rested overall so its level does not appear
+    assert delta["deltas"] == [
+        {"side": "SELL", "price": "1.0", "volume": 0},
+        {"side": "SELL", "price": "1.5", "volume": 5},
+    ]
+
+    # Remainder can be removed under the split txid
+    assert feed.remove_order("2/1") == 5
+    assert feed.books["STI."].get_levels("SELL") == []
+
+def test_periodic_snapshot():
+    feed = MarketDataFeed(snapshot_interval=2)
+    feed.add_book("STI.")
+    sub = feed.subscribe(["STI."])
+    sub.drain()
+
+    feed.add_order(_order("1", "BUY", 1.0, 10))
+    feed.publish("STI.")
+    feed.add_order(_order("2", "BUY", 1.1, 10))
+    feed.publish("STI.")
+
+    msgs = sub.drain()
+    assert [msg["response_type"] for msg in msgs] == ["book_delta", "book_delta", "book_snapshot"]
+    assert msgs[-1]["seq"] == 2
+    assert msgs[-1]["buy_levels"] == [["1.1", 10], ["1.0", 10]]
+
+def test_overflow_resyncs_with_snapshot():
+    feed = MarketDataFeed(max_queue=2)
+    feed.add_book("STI.")
+    sub = feed.subscribe(["STI."])
+
+    for i in range(5):
+        feed.add_order(_order(str(i), "BUY", 1.0, 1))
+        feed.publish("STI.")
+
+    msgs = sub.drain()
+    assert msgs[0]["response_type"] == "book_snapshot"
+    assert msgs[-1]["seq"] == 5
+
+def test_unsubscribe(feed):
+    sub = feed.subscribe(["STI."])
+    sub.drain()
+    assert feed.unsubscribe(sub.sid) is sub
+    assert sub.closed
+
+    feed.add_order(_order("1", "BUY", 1.0, 10))
+    feed.publish("STI.")
+    assert sub.drain() == []
+    assert feed.unsubscribe(sub.sid) is None
@@ -0,0 +1,52 @@
+import pytest
+
+from stexs.services.metrics import LatencyHistogram
+
+def test_small_values_are_exact():
+    hist = LatencyHistogram(precision_bits=11)
+    for value in range(1, 101):
+        hist.record(value)
+
+    assert hist.count == 100
+    assert hist.min == 1
+    assert hist.max == 100
+    assert hist.percentile(50) == 50
+    assert hist.percentile(99) == 99
+    assert hist.percentile(100) == 100
+    assert hist.mean == 50.5
+
+def test_large_values_within_precision():
+    hist = LatencyHistogram(precision_bits=11)
+    values = [1000 + (i * 7919) for i in range(10000)]
+    for value in values:
+        hist.record(value)
+
+    values.sort()
+    for p in [50, 90, 99, 99.9]:
+        expected = values[int(len(values) * p / 100) - 1]
+        assert abs(hist.percentile(p) - expected) / expected < 2 ** -10
+    # Far fewer buckets than values
+    assert len(hist.counts) < len(values)
+
+def test_merge_matches_single_histogram():
+    combined = LatencyHistogram()
+    parts = [LatencyHistogram() for _ in range(4)]
+    for i in range(4000):
+        combined.record(i * 13)
+        parts[i % 4].record(i * 13)
+
+    merged = LatencyHistogram()
+    for part in parts:
+        merged.merge(part)
+
+    assert merged.counts == combined.counts
+    assert merged.summary() == combined.summary()
+
+def test_empty_and_invalid():
+    hist = LatencyHistogram()
+    assert hist.percentile(50) is None
+    assert hist.summary()["count"] == 0
+    with pytest.raises(ValueError):
+        hist.record(-1)
+    with pytest.raises(ValueError):
+        hist.merge(LatencyHistogram(precision_bits=8))
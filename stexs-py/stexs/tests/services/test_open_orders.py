@@ -0,0 +1,29 @@
+from stexs.domain import model
+from stexs.domain.order import Order
+from stexs.services.open_orders import OpenOrderIndex
+
+def _order(txid, csid, side="SELL", symbol="STI."):
+    return Order(txid=txid, csid=csid, ts=0, side=side, symbol=symbol, price=1.0, volume=10)
+
+def test_select_scopes():
+    index = OpenOrderIndex()
+    index.add("MAGENTA", _order("1", 1))
+    index.add("MAGENTA", _order("2", "1", symbol="ELAN"))
+    index.add("MAGENTA", _order("3", "2"))
+    index.add("CYAN", _order("4", "1"))
+
+    assert sorted(index.select("MAGENTA")) == ["1", "2", "3"]
+    assert sorted(index.select("MAGENTA", account_id="1")) == ["1", "2"]
+    assert index.select("MAGENTA", account_id=1, symbol="ELAN") == ["2"]
+    assert index.select("YELLOW") == []
+
+def test_fill_moves_to_split_remainder():
+    index = OpenOrderIndex()
+    for txid in ["1", "2"]:
+        index.add("MAGENTA", _order(txid, "1"))
+    index.add("MAGENTA", _order("3", "2", side="BUY"))
+
+    trade = model.Trade(tid="t", ts=0, symbol="STI.", buy_txid="3", avg_price=1.0, total_price=15, volume=15, excess=5, sell_txids=["1", "2"])
+    index.fill(trade)
+    assert index.select("MAGENTA") == ["2/1"]
+    assert index.select("MAGENTA", account_id="1") == ["2/1"]
@@ -2,6 +2,7 @@ import pytest
 import stexs.io.persistence as iop
 from stexs.domain import model
 from stexs.domain.order import (
+    AmendOrderVolumeException,
     Order,
 )
 from stexs.services import orderbook
@@ -367,3 +368,38 @@ def test_summarise_some_books_for_symbol():
 
     actual_summary = orderbook.summarise_books_for_symbol("STI.", uow=TEST_ORDER_UOW())
     assert expected_summary == actual_summary
+
+def test_cancel_and_amend_order():
+    wrap_service_add_orders([
+        Order(txid="1", csid="1", side="SELL", symbol="STI.", price=1.0, volume=100, ts=1),
+        Order(txid="2", csid="1", side="SELL", symbol="STI.", price=1.0, volume=100, ts=2),
+    ])
+
+    amended = orderbook.amend_order("1", 50, uow=TEST_ORDER_UOW())
+    assert amended.volume == 50
+    with pytest.raises(AmendOrderVolumeException):
+        orderbook.amend_order("1", 50, uow=TEST_ORDER_UOW())
+
+    cancelled = orderbook.cancel_order("2", uow=TEST_ORDER_UOW())
+    assert cancelled.txid == "2"
+    assert orderbook.cancel_order("2", uow=TEST_ORDER_UOW()) is None
+
+    with TEST_ORDER_UOW() as uow:
+        assert uow.orders.get("2") is None
+        assert [(order.txid, order.volume) for order in uow.orders.get_sell_book_for_symbol("STI.")] == [("1", 50)]
+
+
+def test_delete_order_is_staged_until_commit():
+    wrap_service_add_orders([Order(txid="1", csid="1", side="SELL", symbol="STI.", price=1.0, volume=100, ts=1)])
+
+    with TEST_ORDER_UOW() as uow:
+        uow.orders.delete("1")
+        assert uow.orders.get("1") is None
+        # Rolled back on leaving without a commit
+    with TEST_ORDER_UOW() as uow:
+        assert uow.orders.get("1").txid == "1"
+        uow.orders.delete("1")
+        uow.commit()
+    with TEST_ORDER_UOW() as uow:
+        assert uow.orders.get("1") is None
+        assert "1" not in uow.orders.txid_map
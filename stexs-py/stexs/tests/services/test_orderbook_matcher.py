@@ -297,3 +297,53 @@ def test_full_split():
         trade = _attempt_test_trade(orders, reference_price=1.0, uow=uow)
         _assert_trade(trade, excess=0, buy_id='3', sell_ids=['2/1'], price=1)
 
+
+def test_cancel_and_amend_keep_priority():
+    uow = TEST_UOW()
+    uow.orders.clear()
+    with uow:
+        uow.orders.add_book("STI.", reference_price=1)
+        for i in range(1, 5):
+            uow.orders.add(Order(txid=str(i), csid="1", side="BUY", symbol="STI.", price=1, volume=100, ts=i))
+        book = uow.orders.get_book("STI.")
+        first = book.buy_book[0]
+
+        uow.orders.delete("2")
+        uow.orders.delete("3")
+        uow.orders.amend("1", 10)
+        assert [order.txid for order in book.buy_book] == ["1", "4"]
+        # Amended where it sits rather than re-queued
+        assert book.buy_book[0] is first
+        assert first.volume == 10
+        assert uow.orders.get("1").volume == 10
+
+        uow.orders.add(Order(txid="5", csid="1", side="SELL", symbol="STI.", price=1, volume=10, ts=5))
+        trades = wrap_service_match_one(uow=uow)
+    _assert_trade(trades[0], excess=0, buy_id="1", sell_ids=["5"], price=1)
+
+def test_cancels_and_matches_keep_sides_bounded():
+    uow = TEST_UOW()
+    uow.orders.clear()
+    with uow:
+        uow.orders.add_book("STI.", reference_price=1)
+        book = uow.orders.get_book("STI.")
+        # Added out of price order so each goes in by bisect
+        for i in range(200):
+            uow.orders.add(Order(txid="b%d" % i, csid="1", side="BUY", symbol="STI.", price=1 + (i * 7 % 200) / 100, volume=1, ts=i))
+        expected = sorted(book.buy_book, key=lambda order: (-order.price, order.ts))
+        assert book.buy_book == expected
+
+        # Cancel from the back of the book, then match away the front
+        for order in expected[100:]:
+            uow.orders.delete(order.txid)
+        assert book.buy_book == expected[:100]
+        assert len(book._sides["BUY"]) <= 200
+
+        for i in range(50):
+            uow.orders.add(Order(txid="s%d" % i, csid="1", side="SELL", symbol="STI.", price=1, volume=1, ts=1000 + i))
+            trades = wrap_service_match_one(uow=uow)
+            assert trades[0].buy_txid == expected[i].txid
+        assert book.buy_book == expected[50:100]
+        # Removed orders do not pile up behind the live ones
+        assert len(book._sides["BUY"]) - book._head["BUY"] < 2 * 50
+        assert book.sell_book == []
@@ -0,0 +1,96 @@
+import pytest
+import threading
+
+from stexs.domain.order import Order
+from stexs.services.settlement import SettlementWorker
+
+def _order(txid, side):
+    return Order(txid=txid, csid="1", ts=0, side=side, symbol="STI.", price=1.0, volume=1)
+
+@pytest.fixture
+def settled():
+    return []
+
+@pytest.fixture
+def worker(settled):
+    def settle(buys, sells, trades=None):
+        settled.append((buys, sells))
+    worker = SettlementWorker(settle, batch_size=10)
+    yield worker
+    worker.stop(timeout=1)
+
+def test_flush_settles_everything(worker, settled):
+    worker.start()
+    for i in range(5):
+        worker.emit([_order(str(i), "BUY")], [_order("s%d" % i, "SELL")])
+    assert worker.flush(timeout=1)
+
+    buys = [buy.txid for batch in settled for buy in batch[0]]
+    sells = [sell.txid for batch in settled for sell in batch[1]]
+    assert buys == ['0', '1', '2', '3', '4']
+    assert sells == ['s0', 's1', 's2', 's3', 's4']
+    assert worker.lag()["pending"] == 0
+
+def test_flush_without_events(worker):
+    worker.start()
+    assert worker.flush(timeout=1)
+
+def test_events_batched(settled):
+    worker = SettlementWorker(lambda buys, sells, trades=None: settled.append((buys, sells)), batch_size=2)
+    for i in range(5):
+        worker.emit([_order(str(i), "BUY")], [])
+
+    # Start after emitting so the worker sees the whole backlog at once
+    worker.start()
+    assert worker.flush(timeout=1)
+    worker.stop(timeout=1)
+
+    assert [len(batch[0]) for batch in settled] == [2, 2, 1]
+    assert worker.lag()["batches"] == 3
+
+def test_lag_reports_pending():
+    gate = threading.Event()
+    worker = SettlementWorker(lambda buys, sells, trades=None: gate.wait(timeout=1))
+    worker.start()
+
+    worker.emit([_order("1", "BUY")], [])
+    worker.emit([_order("2", "BUY")], [])
+    assert not worker.flush(timeout=0.05)
+
+    lag = worker.lag()
+    assert lag["pending"] == 2
+    assert lag["emitted_seq"] == 2
+    assert lag["lag_seconds"] > 0
+
+    gate.set()
+    assert worker.flush(timeout=1)
+    assert worker.lag()["pending"] == 0
+    worker.stop(timeout=1)
+
+def test_failed_settlement_kept():
+    fail = threading.Event()
+    fail.set()
+    settled = []
+    def settle(buys, sells, trades=None):
+        if fail.is_set() and buys[0].txid == "2":
+            raise Exception("bang")
+        settled.append(buys[0].txid)
+    worker = SettlementWorker(settle, batch_size=1)
+    worker.start()
+    for txid in ["1", "2", "3"]:
+        worker.emit([_order(txid, "BUY")], [])
+
+    # Events after the failure still settle but settled_seq stops short of it
+    assert not worker.flush(timeout=1)
+    assert settled == ["1", "3"]
+    lag = worker.lag()
+    assert (lag["failed"], lag["failed_seqs"], lag["failures"], lag["settled_seq"]) == (1, [2], 1, 1)
+    assert str(worker.failed[0].error) == "bang"
+
+    fail.clear()
+    assert worker.retry_failed() == 1
+    assert worker.flush(timeout=1)
+    assert settled == ["1", "3", "2"]
+    lag = worker.lag()
+    assert (lag["failed"], lag["failures"], lag["settled_seq"], lag["pending"]) == (0, 1, 3, 0)
+    worker.stop(timeout=1)
@@ -0,0 +1,52 @@
+from stexs.domain.order import Order
+from stexs.services.stops import StopBook
+
+def _stop(txid, side, stop_price, price=None):
+    return Order(txid=txid, csid="1", ts=0, side=side, symbol="TEST", price=price, volume=10, stop_price=stop_price)
+
+def test_trigger_only_crossed_stops():
+    book = StopBook()
+    for txid, stop_price in [("b1", 1.10), ("b2", 1.20), ("b3", 1.05), ("b4", 1.10)]:
+        book.add(_stop(txid, "BUY", stop_price))
+    for txid, stop_price in [("s1", 0.90), ("s2", 0.80), ("s3", 0.95)]:
+        book.add(_stop(txid, "SELL", stop_price))
+    assert len(book) == 7
+
+    assert book.trigger(1.0) == []
+    # Lowest stop first, then in arrival order
+    assert [order.txid for order in book.trigger(1.10)] == ["b3", "b1", "b4"]
+    assert [order.txid for order in book.trigger(0.90)] == ["s3", "s1"]
+    assert len(book) == 2
+    assert "b2" in book and "s2" in book
+
+def test_trigger_range_and_cancel():
+    book = StopBook()
+    book.add(_stop("b1", "BUY", 1.10, price=1.15))
+    book.add(_stop("b2", "BUY", 1.30))
+    book.add(_stop("s1", "SELL", 0.90))
+    book.add(_stop("s2", "SELL", 0.95))
+
+    assert book.remove("s2").txid == "s2"
+    assert book.remove("s2") is None
+    assert book.get("s2") is None
+
+    # Traded up to 1.10 and down to 0.90 within one step
+    assert [order.txid for order in book.trigger(1.10, low=0.90)] == ["b1", "s1"]
+    assert book.trigger(None) == []
+    assert [order.txid for order in book.trigger(2.0)] == ["b2"]
+    assert len(book) == 0
+
+def test_cancel_takes_key_out_of_side():
+    book = StopBook()
+    for i in range(100):
+        book.add(_stop("b%d" % i, "BUY", 1.10))
+        book.add(_stop("s%d" % i, "SELL", 0.90))
+    for i in range(0, 100, 2):
+        book.remove("b%d" % i)
+        book.remove("s%d" % i)
+    assert len(book._keys["BUY"]) == len(book._keys["SELL"]) == 50
+    assert sorted(book.txids()) == sorted(["b%d" % i for i in range(1, 100, 2)] + ["s%d" % i for i in range(1, 100, 2)])
+
+    assert [order.txid for order in book.trigger(1.10)] == ["b%d" % i for i in range(1, 100, 2)]
+    assert book._keys["BUY"] == []
+    assert len(book) == 50
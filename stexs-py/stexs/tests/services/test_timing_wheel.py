@@ -0,0 +1,43 @@
+import random
+
+from stexs.services.timing_wheel import TimingWheel
+
+def test_expire_in_order_across_levels():
+    # Small wheel so most keys have to cascade down a level or two
+    wheel = TimingWheel(tick=1.0, slots=4, levels=3, now=0)
+    rng = random.Random(42)
+    deadlines = {i: rng.uniform(0.5, 200) for i in range(200)}
+    for key, expire_ts in deadlines.items():
+        wheel.schedule(key, expire_ts)
+
+    for now in range(0, 205):
+        expired = wheel.advance(now)
+        assert sorted(expired) == sorted(key for key, expire_ts in deadlines.items() if now - 1 < expire_ts <= now)
+    assert len(wheel) == 0
+
+def test_cancel_and_reschedule():
+    wheel = TimingWheel(tick=1.0, slots=4, levels=2, now=0)
+    wheel.schedule("a", 5)
+    wheel.schedule("b", 5)
+    wheel.schedule("c", 6)
+    assert wheel.cancel("b") == 5
+    wheel.schedule("c", 30)
+
+    assert wheel.advance(10) == ["a"]
+    assert wheel.advance(29) == []
+    assert wheel.advance(30) == ["c"]
+
+def test_due_and_far_deadlines():
+    # 100 ticks is past what two levels of four slots can hold
+    wheel = TimingWheel(tick=1.0, slots=4, levels=2, now=10)
+    wheel.schedule("now", 9)
+    wheel.schedule("far", 110)
+    assert wheel.advance(10) == ["now"]
+    assert wheel.advance(109) == []
+    assert wheel.advance(110) == ["far"]
+
+def test_idle_wheel_jumps_ahead():
+    wheel = TimingWheel(tick=1.0, now=0)
+    assert wheel.advance(1e9) == []
+    wheel.schedule("a", 1e9 + 2)
+    assert wheel.advance(1e9 + 2) == ["a"]
@@ -1,10 +1,17 @@
+import copy
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 
+from stexs.domain.model import Trade
 from stexs.domain.order import Order
 from stexs.domain.broker import (
+    CASH,
     Client,
+    Ledger,
+    LedgerEntry,
     InsufficientBalanceException,
     InsufficientHoldingException,
+    OrderScreeningException,
 )
 from stexs.services.broker import Broker
 import stexs.io.persistence as iop
@@ -71,6 +78,68 @@ def test_domain_screen_sell_bad_holding(client):
     with pytest.raises(InsufficientHoldingException, match="No holding"):
         client.screen_order("SELL", "TSI.", 1, 1)
 
+def test_domain_holdings_behave_as_dict(client):
+    client.adjust_holding("ELAN", 5)
+    client.adjust_holding("ARRM", 0)
+    assert client.holdings == {"STI.": 100, "ELAN": 5, "ARRM": 0}
+    assert dict(client.holdings) == {"STI.": 100, "ELAN": 5, "ARRM": 0}
+    assert client.holdings.get("TSI.") is None
+
+    del client.holdings["ARRM"]
+    assert "ARRM" not in client.holdings
+    assert len(client.holdings) == 2
+
+def test_domain_holdings_whole_quantities():
+    client = Client(csid="1", name="Sam", balance=100, holdings={"STI.": 1.0})
+    assert client.holdings["STI."] == 1 and type(client.holdings["STI."]) is int
+    client.holdings.adjust("STI.", 2.0)
+    assert client.holdings["STI."] == 3
+    with pytest.raises(TypeError):
+        client.holdings.adjust("STI.", 1.5)
+    with pytest.raises(TypeError):
+        client.holdings["ELAN"] = 0.5
+    assert client.holdings == {"STI.": 3}
+
+def test_domain_client_copy(client):
+    # Checkouts from the memory store are deep copies
+    copied = copy.deepcopy(client)
+    copied.adjust_holding("STI.", -100)
+    copied.adjust_balance(-100)
+    assert copied == Client(csid="1", name="Sam", balance=0, holdings={"STI.": 0})
+    assert client == Client(csid="1", name="Sam", balance=100, holdings={"STI.": 100})
+
+def test_domain_client_slots(client):
+    with pytest.raises(AttributeError):
+        client.nickname = "Sammy"
+
+@pytest.fixture
+def ledger():
+    ledger = Ledger()
+    ledger.open_account("1", {CASH: 100, "STI.": 100})
+    return ledger
+
+def test_domain_ledger_reserve_and_release(ledger):
+    ledger.reserve("1", CASH, 60)
+    assert ledger.get("1", CASH).available == 40
+    with pytest.raises(InsufficientBalanceException, match="Insufficient balance"):
+        ledger.reserve("1", CASH, 41)
+
+    ledger.release("1", CASH, 60)
+    assert ledger.get("1", CASH) == LedgerEntry(settled=100, reserved=0)
+
+def test_domain_ledger_reserve_holding(ledger):
+    ledger.reserve("1", "STI.", 100)
+    with pytest.raises(InsufficientHoldingException, match="Insufficient holding"):
+        ledger.reserve("1", "STI.", 1)
+    with pytest.raises(InsufficientHoldingException, match="No holding"):
+        ledger.reserve("1", "TSI.", 1)
+
+def test_domain_ledger_settle(ledger):
+    ledger.reserve("1", CASH, 100)
+    # Executed under the reserved price
+    ledger.settle("1", CASH, 100, -75)
+    assert ledger.get("1", CASH) == LedgerEntry(settled=25, reserved=0)
+
 ###############################################################################
 # Service
 
@@ -195,9 +264,11 @@ def test_service_simple_update_users_buy(broker, broker_uow):
     ]
     broker.update_users(buys, sells, uow=broker_uow())
 
+    # Cash is reserved rather than spent until the order executes
     with broker_uow() as test_uow:
         client = test_uow.users.get("1")
-        assert client.balance == 0
+        assert client.balance == 100
+    assert broker.ledger.get("1", CASH) == LedgerEntry(settled=100, reserved=100)
 
 def test_service_simple_update_users_sell(broker, broker_uow):
     buys = [
@@ -209,7 +280,8 @@ def test_service_simple_update_users_sell(broker, broker_uow):
 
     with broker_uow() as test_uow:
         client = test_uow.users.get("1")
-        assert client.holdings["STI."] == 0
+        assert client.holdings["STI."] == 100
+    assert broker.ledger.get("1", "STI.") == LedgerEntry(settled=100, reserved=100)
 
 def test_service_simple_update_users_buy_executed(broker, broker_uow):
     buys = [
@@ -219,9 +291,12 @@ def test_service_simple_update_users_buy_executed(broker, broker_uow):
     ]
     broker.update_users(buys, sells, executed=True, uow=broker_uow())
 
+    client = broker.get_user("1", uow=broker_uow())
+    assert client.holdings["STI."] == 200
+
+    # Settlement only moves the ledger, the store keeps what it was opened with
     with broker_uow() as test_uow:
-        client = test_uow.users.get("1")
-        assert client.holdings["STI."] == 200
+        assert test_uow.users.get("1").holdings["STI."] == 100
 
 def test_service_simple_update_users_sell_executed(broker, broker_uow):
     buys = [
@@ -231,9 +306,56 @@ def test_service_simple_update_users_sell_executed(broker, broker_uow):
     ]
     broker.update_users(buys, sells, executed=True, uow=broker_uow())
 
-    with broker_uow() as test_uow:
-        client = test_uow.users.get("1")
-        assert client.balance == 200
+    client = broker.get_user("1", uow=broker_uow())
+    assert client.balance == 200
 
 def test_service_simple_update_users_buy_aborted(broker, broker_uow):
     pass
+
+def test_service_reserve_order(broker, broker_uow):
+    buy = Order(txid="1", csid="1", ts=0, side="BUY", symbol="STI.", price=1, volume=60)
+    assert broker.reserve_order(buy, uow=broker_uow())
+    # Reserving the same txid again does not reserve twice
+    assert broker.reserve_order(buy, uow=broker_uow())
+    assert broker.ledger.get("1", CASH).available == 40
+
+    with pytest.raises(InsufficientBalanceException):
+        broker.reserve_order(Order(txid="2", csid="1", ts=0, side="BUY", symbol="STI.", price=1, volume=60), uow=broker_uow())
+    with pytest.raises(OrderScreeningException, match="No reference price"):
+        broker.reserve_order(Order(txid="3", csid="1", ts=0, side="BUY", symbol="STI.", price=None, volume=1), uow=broker_uow())
+    with pytest.raises(OrderScreeningException, match="Unknown user"):
+        broker.reserve_order(Order(txid="4", csid="8", ts=0, side="BUY", symbol="STI.", price=1, volume=1), uow=broker_uow())
+
+    assert broker.release_order("1") == 60
+    assert broker.release_order("1") == 0
+    assert broker.ledger.get("1", CASH).available == 100
+
+def test_service_settle_split_sell(broker, broker_uow):
+    sell = Order(txid="1", csid="1", ts=0, side="SELL", symbol="STI.", price=1, volume=100)
+    broker.reserve_order(sell, uow=broker_uow())
+
+    # Only 40 of the sell filled so the rest stays reserved for the remainder
+    sell.volume = 40
+    trade = Trade(tid="1", symbol="STI.", ts=0, buy_txid="2", avg_price=2, total_price=80, volume=40, sell_txids=["1"])
+    broker.update_users([], [sell], executed=True, uow=broker_uow(), trades=[trade])
+
+    client = broker.get_user("1", uow=broker_uow())
+    assert client.balance == 180
+    assert client.holdings["STI."] == 60
+    assert broker.ledger.get("1", "STI.") == LedgerEntry(settled=60, reserved=60)
+    assert broker.release_order(Order.split_txid("1")) == 60
+
+def test_service_concurrent_reserve_order(broker, broker_uow):
+    broker.has_user("1", uow=broker_uow())
+
+    def reserve(i):
+        try:
+            return broker.reserve_order(Order(txid=str(i), csid="1", ts=0, side="BUY", symbol="STI.", price=1, volume=1))
+        except InsufficientBalanceException:
+            return False
+
+    # The account can cover exactly 100 of the 400 racing orders
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        reserved = list(pool.map(reserve, range(400)))
+    assert sum(reserved) == 100
+    assert broker.ledger.get("1", CASH) == LedgerEntry(settled=100, reserved=100)
@@ -6,6 +6,7 @@ from stexs.domain import model
 from stexs.domain.broker import OrderScreeningException
 from stexs.services import orderbook
 from stexs.services.exchange import Exchange
+from stexs.services.admission import AdmissionControl
 import stexs.io.persistence as iop
 
 #TODO Will need to mock/test the sockety stuff eventually
@@ -19,6 +20,8 @@ def patched_exchange():
     # Clear orders
     with iop.order.OrderMemoryUoW() as uow:
         uow.orders.clear()
+    with iop.order.MatcherMemoryUoW() as uow:
+        uow.orders.clear()
 
     # Reset stocks
     stex.stock_uow = iop.stock.MemoryStockUoW
@@ -33,9 +36,9 @@ def patched_exchange():
     # Mock broker
     # TODO Not ideal as we are masking the behaviour of the real broker so need to be careful
     class BasicBroker:
-        def get_user(self, account_id):
-            return account_id if account_id in [1, 999] else None
-        def validate_preorder(self, user, order, reference_price=None):
+        def has_user(self, account_id):
+            return account_id in [1, 999]
+        def reserve_order(self, order, reference_price=None):
             if order.csid == 999:
                 raise Exception("bang")
             elif order.side == "BUY":
@@ -45,7 +48,7 @@ def patched_exchange():
                 raise OrderScreeningException("Insufficient holdings")
 
             return False
-        def update_users(self, buys, sells, executed, reference_price=None):
+        def update_users(self, buys, sells, executed, reference_price=None, trades=None):
             return True
     stex.brokers["MAGENTA"] = BasicBroker()
 
@@ -92,6 +95,26 @@ def test_list_stocks(patched_exchange):
     assert r == sorted(["TEST", "STI."])
 
 
+def test_corr_id_echoed(patched_exchange):
+    r = patched_exchange.recv({"message_type": "instrument_summary", "symbol": "STI.", "corr_id": 8})
+    assert r["response_type"] == "instrument_summary"
+    assert r["corr_id"] == 8
+
+    # Exceptions carry it too
+    r = patched_exchange.recv({"message_type": "invalid", "corr_id": "abc"})
+    assert r["response_type"] == "exception"
+    assert r["corr_id"] == "abc"
+
+
+def test_corr_id_list_stocks(patched_exchange):
+    # Bare list replies are wrapped so they can carry the corr_id
+    r = patched_exchange.recv({"message_type": "list_stocks", "corr_id": 1})
+    assert r["response_type"] == "list_stocks"
+    assert r["response_code"] == 0
+    assert r["stocks"] == sorted(["TEST", "STI."])
+    assert r["corr_id"] == 1
+
+
 def test_add_limit_order_ok(patched_exchange):
     msg = {
         "txid": 1,
@@ -356,3 +379,140 @@ def test_format_instrument_orderbook_empty(patched_exchange):
     assert r["buy_book"] == order_books["buy_book"]
     assert r["sell_book"] == order_books["sell_book"]
 
+
+
+def test_instrument_snapshot_unknown_stock(patched_exchange):
+    msg = {"txid": 1, "message_type": "instrument_snapshot", "symbol": "TSI."}
+    r = patched_exchange.recv(msg)
+    assert r["response_type"] == "exception"
+    assert r["response_code"] == 404
+    assert r["msg"] == "unknown symbol"
+
+
+def test_instrument_snapshot_matches_queries(patched_exchange):
+    for i, price in enumerate(["1.01", "1.03", "1.02"]):
+        patched_exchange.recv({
+            "txid": "snap%d" % i,
+            "message_type": "new_order",
+            "broker_id": "MAGENTA",
+            "account_id": 1,
+            "side": "BUY",
+            "symbol": "STI.",
+            "price": price,
+            "volume": 100,
+            "sender_ts": int(time.time()),
+        })
+
+    r = patched_exchange.recv({"message_type": "instrument_snapshot", "symbol": "STI.", "depth": 2, "history": 5})
+    assert r["response_type"] == "instrument_snapshot"
+    assert r["response_code"] == 0
+    assert r["msg"] == "ok"
+    assert r["symbol"] == "STI."
+
+    summary = patched_exchange.recv({"message_type": "instrument_summary", "symbol": "STI."})
+    for key in ["min_price", "max_price", "num_trades", "vol_trades", "last_trade_price"]:
+        assert r["summary"][key] == summary[key]
+
+    book_summary = patched_exchange.recv({"message_type": "instrument_orderbook_summary", "symbol": "STI."})
+    for key, value in r["orderbook_summary"].items():
+        assert book_summary[key] == value
+
+    order_books = orderbook.get_serialised_order_books_for_symbol("STI.", n=2)
+    assert r["buy_book"] == order_books["buy_book"]
+    assert r["sell_book"] == order_books["sell_book"]
+    assert [order["price"] for order in r["buy_book"]] == [1.03, 1.02]
+
+    assert r["trade_history"] == []
+
+
+def test_instrument_snapshot_malformed_depth(patched_exchange):
+    for depth in ["2", -1, 1.5, True, None]:
+        r = patched_exchange.recv({"message_type": "instrument_snapshot", "symbol": "STI.", "depth": depth})
+        assert r["response_type"] == "exception"
+        assert r["response_code"] == 1
+        assert r["msg"] == "malformed depth"
+
+    r = patched_exchange.recv({"message_type": "instrument_snapshot", "symbol": "STI.", "history": "all"})
+    assert r["response_code"] == 1
+    assert r["msg"] == "malformed history"
+
+
+def test_instrument_snapshot_caps_depth(patched_exchange, monkeypatch):
+    monkeypatch.setattr("stexs.services.exchange.MAX_SNAPSHOT_DEPTH", 2)
+    for i, price in enumerate(["1.01", "1.03", "1.02"]):
+        patched_exchange.recv({
+            "txid": "cap%d" % i,
+            "message_type": "new_order",
+            "broker_id": "MAGENTA",
+            "account_id": 1,
+            "side": "BUY",
+            "symbol": "STI.",
+            "price": price,
+            "volume": 100,
+            "sender_ts": int(time.time()),
+        })
+
+    r = patched_exchange.recv({"message_type": "instrument_snapshot", "symbol": "STI.", "depth": 10 ** 9, "history": 10 ** 9})
+    assert r["response_code"] == 0
+    assert [order["price"] for order in r["buy_book"]] == [1.03, 1.02]
+
+
+def test_trade_history_last_n(patched_exchange):
+    stall = model.MarketStall(stock=model.Stock(symbol="STI.", name="Sam and Tom Industrys"))
+    for i in range(3):
+        stall.log_trade(model.Trade(tid=str(i), symbol="STI.", buy_txid=i, total_price=1, avg_price=1, volume=1, ts=i))
+
+    assert [t["tid"] for t in patched_exchange.get_trade_history(stall, n=2)] == ["1", "2"]
+    assert patched_exchange.get_trade_history(stall, n=0) == []
+    assert len(patched_exchange.get_trade_history(stall)) == 3
+
+
+def test_trade_history_windows(patched_exchange):
+    stall = model.MarketStall(stock=model.Stock(symbol="STI.", name="Sam and Tom Industrys"))
+    for i in range(10):
+        stall.log_trade(model.Trade(tid=str(i), symbol="STI.", buy_txid=i, total_price=1, avg_price=1, volume=1, ts=100 + i // 2))
+
+    # Seqs count from 1 so since_seq=3 starts at the fourth trade
+    assert stall.trade_window(since_seq=3, limit=4) == (3, 7)
+    assert stall.trade_window(since_ts=102) == (4, 10)
+    assert stall.trade_window(since_ts=101, until_ts=103) == (2, 6)
+    assert stall.trade_window(until_ts=104, limit=3) == (5, 8)
+    assert stall.trade_window(since_seq=10) == (10, 10)
+    assert [t["tid"] for t in patched_exchange.get_trade_history(stall, n=2, since_ts=103)] == ["6", "7"]
+
+
+def test_throttled_order_rejected_before_screening(patched_exchange):
+    patched_exchange.admission = AdmissionControl(account_limit=(0, 1))
+    screened = []
+    reserve_order = patched_exchange.brokers["MAGENTA"].reserve_order
+    def record_screening(order, reference_price=None):
+        screened.append(order.txid)
+        return reserve_order(order, reference_price=reference_price)
+    patched_exchange.brokers["MAGENTA"].reserve_order = record_screening
+
+    msg = {
+        "txid": 1,
+        "message_type": "new_order",
+        "broker_id": "MAGENTA",
+        "account_id": 1,
+        "side": "BUY",
+        "symbol": "STI.",
+        "price": "1.00",
+        "volume": 100,
+        "sender_ts": int(time.time()),
+    }
+    assert patched_exchange.recv(msg)["response_code"] == 0
+
+    msg = dict(msg, txid=2)
+    r = patched_exchange.recv(msg)
+    assert r["response_type"] == "exception"
+    assert r["response_code"] == 429
+    assert screened == [1]
+
+    # The throttled txid was never used so it can be sent again once admitted
+    patched_exchange.admission.set_account_limit("MAGENTA", 1, 0, 1)
+    assert patched_exchange.recv(msg)["response_code"] == 0
+
+    metrics = patched_exchange.recv({"message_type": "exchange_metrics"})
+    assert metrics["admission"]["throttled"] == 1
+    assert metrics["admission"]["throttled_accounts"] == {"MAGENTA/1": 1}
@@ -1,14 +1,24 @@
 import pytest
+import sys
+import threading
 import time
 
 from stexs.domain.model import Stock
-from stexs.domain.broker import Client
+from stexs.io.journal import JournalWriter, read_journal, KIND_TRADE
+from stexs.io.wire import BINARY_CODEC
+from stexs.io.wire.codec import TAG_ORDER_ACK
+from stexs.domain.broker import CASH, Client, LedgerEntry
 from stexs.services.broker import Broker
 from stexs.services.exchange import Exchange
+from stexs.services.replay import ReplayClock, replay_journal
 import stexs.io.persistence as iop
 
-@pytest.fixture
-def e2e_broker():
+def _make_e2e_broker():
+    # Reset clients
+    repo = iop.base.GenericMemoryRepository(prefix="clients")
+    if len(repo.list()) > 0:
+        repo.clear()
+
     broker = Broker("MAGENTA", "Magenta Holdings Corporation")
     broker.user_uow = iop.user.MemoryClientUoW
     broker.add_users([
@@ -19,12 +29,17 @@ def e2e_broker():
     return broker
 
 @pytest.fixture
-def e2e_exchange(e2e_broker):
-    stex = Exchange()
+def e2e_broker():
+    return _make_e2e_broker()
+
+def _make_e2e_exchange(broker, **kwargs):
+    stex = Exchange(**kwargs)
 
     # Clear orders
     with iop.order.OrderMemoryUoW() as uow:
         uow.orders.clear()
+    with iop.order.MatcherMemoryUoW() as uow:
+        uow.orders.clear()
 
     # Reset stocks
     stex.stock_uow = iop.stock.MemoryStockUoW
@@ -35,11 +50,21 @@ def e2e_exchange(e2e_broker):
         Stock(symbol="STI.", name="Sam and Tom Industrys"),
     ])
 
-    stex.brokers["MAGENTA"] = e2e_broker
+    stex.brokers["MAGENTA"] = broker
 
     return stex
 
-def test_basic_trade(e2e_exchange):
+@pytest.fixture
+def e2e_exchange(e2e_broker):
+    return _make_e2e_exchange(e2e_broker)
+
+@pytest.fixture
+def e2e_async_exchange(e2e_broker):
+    stex = _make_e2e_exchange(e2e_broker, async_settlement=True)
+    yield stex
+    stex.close()
+
+def _submit_basic_trade(stex):
 
     # Submit three orders such that the first order is satisfied by a combination
     # of the entire second order and third partial order
@@ -57,7 +82,7 @@ def test_basic_trade(e2e_exchange):
         "volume": 100,
         "sender_ts": ts,
     }
-    r = e2e_exchange.recv(msg)
+    r = stex.recv(msg)
     print(r)
 
     msg = {
@@ -71,7 +96,7 @@ def test_basic_trade(e2e_exchange):
         "volume": 50,
         "sender_ts": ts+10,
     }
-    r = e2e_exchange.recv(msg)
+    r = stex.recv(msg)
     print(r)
 
     msg = {
@@ -85,17 +110,489 @@ def test_basic_trade(e2e_exchange):
         "volume": 100,
         "sender_ts": ts+20,
     }
-    r = e2e_exchange.recv(msg)
+    r = stex.recv(msg)
     print(r)
 
-    test_uow = e2e_exchange.brokers["MAGENTA"].user_uow()
-    with test_uow:
-        sam = test_uow.users.get("1")
-        tom = test_uow.users.get("2")
+def _assert_basic_trade_settled(stex):
+    # Every leg of the trade executes at the one price
+    trade_price = stex.stalls["STI."].last_price
+
+    sam = stex.brokers["MAGENTA"].get_user("1")
+    tom = stex.brokers["MAGENTA"].get_user("2")
+
+    assert sam.balance == 100 - (trade_price*100)
+    assert tom.balance == 100 + (trade_price*100)
+
+    assert sam.holdings["STI."] == 200
+    assert tom.holdings["STI."] == 50
+
+    # The unfilled 50 of Tom's second sell are still reserved
+    ledger = stex.brokers["MAGENTA"].ledger
+    assert ledger.get("1", CASH).reserved == 0
+    assert ledger.get("2", "STI.").reserved == 50
+    assert ledger.get("2", "STI.").available == 0
+
+
+def test_basic_trade(e2e_exchange):
+    _submit_basic_trade(e2e_exchange)
+    _assert_basic_trade_settled(e2e_exchange)
+
+def test_basic_trade_async_settlement(e2e_async_exchange):
+    _submit_basic_trade(e2e_async_exchange)
+    assert e2e_async_exchange.flush_settlement(timeout=1)
+    assert e2e_async_exchange.settlement_lag()["pending"] == 0
+    _assert_basic_trade_settled(e2e_async_exchange)
+
+    r = e2e_async_exchange.recv({"message_type": "exchange_metrics"})
+    assert r["response_code"] == 0
+    assert r["settlement"]["settled_seq"] == 1
+
+def test_basic_trade_market_data(e2e_exchange):
+    r = e2e_exchange.recv({"message_type": "market_data_subscribe", "symbols": ["STI."]})
+    assert r["response_type"] == "market_data_subscribe"
+    assert r["response_code"] == 0
+    sub = e2e_exchange.feed.get_subscription(r["subscription_id"])
+
+    _submit_basic_trade(e2e_exchange)
+
+    # Rebuild the book from the snapshot and deltas
+    msgs = sub.drain()
+    assert msgs[0]["response_type"] == "book_snapshot"
+    levels = {"BUY": {}, "SELL": {}}
+    seq = msgs[0]["seq"]
+    trades = []
+    for msg in msgs[1:]:
+        assert msg["seq"] == seq + 1
+        seq = msg["seq"]
+        if msg["response_type"] == "book_delta":
+            for delta in msg["deltas"]:
+                levels[delta["side"]][delta["price"]] = delta["volume"]
+        elif msg["response_type"] == "trade":
+            trades.append(msg)
+
+    assert len(trades) == 1
+    assert trades[0]["buy_txid"] == "1"
+    assert trades[0]["sell_txids"] == ["2", "3"]
+    assert levels["BUY"] == {"1.0": 0}
+    assert levels["SELL"] == {"0.5": 0, "0.75": 50}
+
+    snapshot = e2e_exchange.feed.snapshot("STI.")
+    assert snapshot["seq"] == seq
+    assert snapshot["sell_levels"] == [["0.75", 50]]
+
+    r = e2e_exchange.recv({"message_type": "market_data_unsubscribe", "subscription_id": sub.sid})
+    assert r["response_code"] == 0
+
+def test_market_data_subscribe_unknown_symbol(e2e_exchange):
+    r = e2e_exchange.recv({"message_type": "market_data_subscribe", "symbols": ["STI.", "TSI."]})
+    assert r["response_type"] == "exception"
+    assert r["response_code"] == 404
+
+def _order_msg(txid, account_id, side, price, volume):
+    return {
+        "txid": txid,
+        "message_type": "new_order",
+        "broker_id": "MAGENTA",
+        "account_id": account_id,
+        "side": side,
+        "symbol": "STI.",
+        "price": price,
+        "volume": volume,
+        "sender_ts": int(time.time()),
+    }
+
+def test_fractional_volume_rejected(e2e_exchange):
+    ledger = e2e_exchange.brokers["MAGENTA"].ledger
+    r = e2e_exchange.recv(_order_msg("1", 2, "SELL", "1.00", 1.5))
+    assert (r["response_code"], r["msg"]) == (1, "malformed volume")
+    r = e2e_exchange.recv(_order_msg("2", 1, "BUY", "1.00", 1.5))
+    assert (r["response_code"], r["msg"]) == (1, "malformed volume")
+    assert ledger.get("1", CASH).reserved == ledger.get("2", "STI.").reserved == 0
+    assert len(e2e_exchange.open_orders) == 0
+
+def test_order_ack_encodes_binary(e2e_exchange):
+    # Acks as the exchange makes them fit the binary record
+    for msg in [
+        _order_msg("1", "2", "SELL", "1.00", 10),
+        dict(_order_msg("2", "2", "SELL", "1.50", 10), time_in_force="GTT", expire_ts=time.time() + 60),
+    ]:
+        ack = e2e_exchange.recv(msg)
+        assert ack["response_code"] == 0, ack
+        payload = BINARY_CODEC.encode(ack)
+        assert payload[0] == TAG_ORDER_ACK
+        decoded = BINARY_CODEC.decode(payload)
+        assert decoded["order"] == dict(ack["order"], price=float(ack["order"]["price"]))
+
+def test_cancel_and_amend(e2e_exchange):
+    ledger = e2e_exchange.brokers["MAGENTA"].ledger
+    assert e2e_exchange.recv(_order_msg("1", 1, "BUY", "0.50", 100))["response_code"] == 0
+    assert e2e_exchange.recv(_order_msg("2", 1, "BUY", "0.50", 100))["response_code"] == 0
+    assert ledger.get("1", CASH).reserved == 100
+
+    # Amending down keeps the first buy ahead of the second
+    r = e2e_exchange.recv({"message_type": "amend_order", "broker_id": "MAGENTA", "account_id": 1, "order_txid": "1", "volume": 60})
+    assert r["response_code"] == 0
+    assert r["order"]["volume"] == 60
+    assert ledger.get("1", CASH).reserved == 80
+    assert e2e_exchange.feed.snapshot("STI.")["buy_levels"] == [["0.5", 160]]
+
+    r = e2e_exchange.recv({"message_type": "amend_order", "broker_id": "MAGENTA", "account_id": 1, "order_txid": "1", "volume": 80})
+    assert r["response_code"] == 1
+
+    assert e2e_exchange.recv(_order_msg("3", 2, "SELL", "0.50", 60))["response_code"] == 0
+    assert e2e_exchange.stalls["STI."].order_history[-1].buy_txid == "1"
+
+    # Only the owner can cancel
+    r = e2e_exchange.recv({"message_type": "cancel_order", "broker_id": "MAGENTA", "account_id": 2, "order_txid": "2"})
+    assert r["response_code"] == 404
+    r = e2e_exchange.recv({"message_type": "cancel_order", "broker_id": "MAGENTA", "account_id": 1, "order_txid": "2"})
+    assert r["response_code"] == 0
+    assert r["order"]["txid"] == "2"
+
+    # Gone from the store, the matcher, the reservations and the feed
+    r = e2e_exchange.recv({"message_type": "cancel_order", "broker_id": "MAGENTA", "account_id": 1, "order_txid": "2"})
+    assert r["response_code"] == 404
+    assert e2e_exchange.recv({"message_type": "instrument_orderbook", "symbol": "STI."})["buy_book"] == []
+    assert iop.order.MatcherMemoryUoW().orders.get_book("STI.").buy_book == []
+    assert ledger.get("1", CASH).reserved == 0
+    assert e2e_exchange.feed.snapshot("STI.")["buy_levels"] == []
+
+def test_cancel_split_remainder(e2e_exchange):
+    ledger = e2e_exchange.brokers["MAGENTA"].ledger
+    e2e_exchange.recv(_order_msg("1", 2, "SELL", "0.50", 100))
+    e2e_exchange.recv(_order_msg("2", 1, "BUY", "0.50", 40))
+    assert ledger.get("2", "STI.").reserved == 60
+
+    # The original txid still finds the resting remainder
+    r = e2e_exchange.recv({"message_type": "cancel_order", "broker_id": "MAGENTA", "account_id": 2, "order_txid": "1"})
+    assert r["response_code"] == 0
+    assert r["order"]["txid"] == "1/1"
+    assert r["order"]["volume"] == 60
+    assert ledger.get("2", "STI.") == LedgerEntry(settled=110, reserved=0)
+
+def test_mass_cancel(e2e_exchange):
+    e2e_exchange.brokers["MAGENTA"].adjust_holding("2", "TEST", 100)
+    for i in range(5):
+        e2e_exchange.recv(_order_msg("b%d" % i, 1, "BUY", "0.10", 10))
+        e2e_exchange.recv(_order_msg("s%d" % i, 2, "SELL", "2.00", 10))
+    e2e_exchange.recv(dict(_order_msg("t1", 2, "SELL", "2.00", 10), symbol="TEST"))
+    # Partly fill s0 so its remainder rests under a split txid
+    e2e_exchange.recv(_order_msg("b5", 1, "BUY", "2.00", 4))
+    assert "s0/1" in e2e_exchange.open_orders
+    assert len(e2e_exchange.open_orders) == 11
+
+    r = e2e_exchange.recv({"message_type": "mass_cancel", "broker_id": "MAGENTA", "symbol": "STI."})
+    assert r["response_code"] == 1
+
+    r = e2e_exchange.recv({"message_type": "mass_cancel", "broker_id": "MAGENTA", "account_id": 2, "symbol": "STI."})
+    assert r["response_code"] == 0
+    assert sorted(r["txids"]) == ["s0/1", "s1", "s2", "s3", "s4"]
+    assert e2e_exchange.recv({"message_type": "instrument_orderbook", "symbol": "STI."})["sell_book"] == []
+    assert e2e_exchange.feed.snapshot("STI.")["sell_levels"] == []
+    assert e2e_exchange.brokers["MAGENTA"].ledger.get("2", "STI.").reserved == 0
+    assert e2e_exchange.brokers["MAGENTA"].ledger.get("2", "TEST").reserved == 10
+
+    r = e2e_exchange.recv({"message_type": "mass_cancel", "broker_id": "MAGENTA"})
+    assert r["n_cancelled"] == 6
+    assert len(e2e_exchange.open_orders) == 0
+    assert iop.order.MatcherMemoryUoW().orders.get_book("STI.").buy_book == []
+    assert e2e_exchange.brokers["MAGENTA"].ledger.get("1", CASH).reserved == 0
+
+def test_ioc_remainder_never_rests(e2e_exchange):
+    ledger = e2e_exchange.brokers["MAGENTA"].ledger
+    e2e_exchange.recv(_order_msg("1", 1, "BUY", "1.00", 40))
+    r = e2e_exchange.recv(dict(_order_msg("2", 2, "SELL", "1.00", 100), time_in_force="IOC"))
+    assert r["response_code"] == 0
+    assert r["cancelled_volume"] == 60
+
+    book = e2e_exchange.recv({"message_type": "instrument_orderbook", "symbol": "STI."})
+    assert book["buy_book"] == book["sell_book"] == []
+    assert len(e2e_exchange.open_orders) == 0
+    assert ledger.get("2", "STI.") == LedgerEntry(settled=110, reserved=0)
+
+    # Buys fill in full or not at all so an IOC buy either trades or is dropped
+    r = e2e_exchange.recv(dict(_order_msg("3", 1, "BUY", "1.00", 10), time_in_force="IOC"))
+    assert r["cancelled_volume"] == 10
+    assert ledger.get("1", CASH).reserved == 0
+
+def test_fok_fills_in_full_or_is_killed(e2e_exchange):
+    e2e_exchange.recv(_order_msg("1", 2, "SELL", "1.00", 30))
+    e2e_exchange.recv(_order_msg("2", 2, "SELL", "2.00", 30))
+
+    # Only 30 at or under 1.00
+    r = e2e_exchange.recv(dict(_order_msg("3", 1, "BUY", "1.00", 50), time_in_force="FOK"))
+    assert r["msg"] == "killed"
+    assert r["cancelled_volume"] == 50
+    assert e2e_exchange.stalls["STI."].n_trades == 0
+    assert e2e_exchange.brokers["MAGENTA"].ledger.get("1", CASH).reserved == 0
+
+    r = e2e_exchange.recv(dict(_order_msg("4", 1, "BUY", "2.00", 50), time_in_force="FOK"))
+    assert r["msg"] == "ok"
+    assert r["cancelled_volume"] == 0
+    assert e2e_exchange.stalls["STI."].v_trades == 50
+
+def test_gtt_orders_expire(e2e_exchange):
+    now = time.time()
+    r = e2e_exchange.recv(dict(_order_msg("0", 1, "BUY", "0.10", 10), time_in_force="GTT", expire_ts=now - 1))
+    assert r["response_code"] == 1
+
+    e2e_exchange.recv(dict(_order_msg("1", 2, "SELL", "1.00", 100), time_in_force="GTT", expire_ts=now + 30))
+    e2e_exchange.recv(dict(_order_msg("2", 1, "BUY", "0.50", 10), time_in_force="GTD", expire_ts=now + 60))
+    e2e_exchange.recv(_order_msg("3", 1, "BUY", "0.50", 10))
+    # Part fill, the remainder keeps the expiry
+    e2e_exchange.recv(_order_msg("4", 1, "BUY", "1.00", 40))
+    assert "1/1" in e2e_exchange.expiries
+
+    assert e2e_exchange.expire_orders(now=now + 10) == []
+    assert [order.txid for order in e2e_exchange.expire_orders(now=now + 31)] == ["1/1"]
+    assert [order.txid for order in e2e_exchange.expire_orders(now=now + 61)] == ["2"]
+
+    book = e2e_exchange.recv({"message_type": "instrument_orderbook", "symbol": "STI."})
+    assert book["sell_book"] == []
+    assert [order["txid"] for order in book["buy_book"]] == ["3"]
+    assert e2e_exchange.brokers["MAGENTA"].ledger.get("2", "STI.").reserved == 0
+
+def test_stop_orders_trigger_in_the_same_step(e2e_exchange):
+    ledger = e2e_exchange.brokers["MAGENTA"].ledger
+
+    # Sell stop market for when the price falls to 0.90
+    r = e2e_exchange.recv(dict(_order_msg("1", 2, "SELL", None, 20), stop_price=0.90))
+    assert r["response_code"] == 0
+    assert r["triggered"] is False
+    assert ledger.get("2", "STI.").reserved == 20
+
+    # Buy stop limit that is never reached, reserved at its limit
+    r = e2e_exchange.recv(dict(_order_msg("2", 1, "BUY", "2.00", 5), stop_price=1.50))
+    assert r["triggered"] is False
+    assert ledger.get("1", CASH).reserved == 10
+
+    r = e2e_exchange.recv(dict(_order_msg("3", 1, "BUY", "1.00", 5), stop_price=-1))
+    assert r["response_code"] == 1
+
+    e2e_exchange.recv(_order_msg("4", 1, "BUY", "0.80", 10))
+    e2e_exchange.recv(_order_msg("5", 1, "BUY", "0.70", 20))
+    book = e2e_exchange.recv({"message_type": "instrument_orderbook", "symbol": "STI."})
+    assert book["sell_book"] == []
+
+    # Trading at 0.80 sets off the sell stop, which takes the bid at 0.70
+    e2e_exchange.recv(_order_msg("6", 2, "SELL", "0.80", 10))
+    assert e2e_exchange.stalls["STI."].n_trades == 2
+    assert e2e_exchange.stalls["STI."].order_history[-1].buy_txid == "5"
+    assert "1" not in e2e_exchange.stop_books["STI."]
+    assert ledger.get("2", "STI.") == LedgerEntry(settled=120, reserved=0)
+
+    # Stops yet to trigger can be cancelled but not amended
+    r = e2e_exchange.recv({"message_type": "amend_order", "broker_id": "MAGENTA", "account_id": 1, "order_txid": "2", "volume": 1})
+    assert r["response_code"] == 404
+    r = e2e_exchange.recv({"message_type": "cancel_order", "broker_id": "MAGENTA", "account_id": 1, "order_txid": "2"})
+    assert r["response_code"] == 0
+    assert len(e2e_exchange.stop_books["STI."]) == 0
+    assert len(e2e_exchange.open_orders) == 0
+    assert ledger.get("1", CASH).reserved == 0
+
+def test_threaded_symbols_lose_no_updates(e2e_exchange):
+    # A buyer per symbol and one seller shared by every symbol, each on its
+    # own thread, so books are contended per symbol and the seller's client
+    # state across all of them
+    symbols = ["THR%d" % i for i in range(4)]
+    n_orders = 100
+    e2e_exchange.add_stocks([Stock(symbol=symbol, name=symbol) for symbol in symbols])
+    broker = e2e_exchange.brokers["MAGENTA"]
+    broker.add_users([Client(csid="B%d" % i, name="Buyer", balance=1000) for i in range(len(symbols))])
+    broker.add_users([Client(csid="S", name="Seller", balance=0, holdings={symbol: 1000 for symbol in symbols})])
+
+    errors = []
+    def send(account_id, side, symbol):
+        try:
+            for i in range(n_orders):
+                msg = dict(_order_msg("%s-%s-%d" % (account_id, symbol, i), account_id, side, "1.00", 1), symbol=symbol)
+                r = e2e_exchange.recv(msg)
+                assert r["response_code"] == 0, r
+        except Exception as e:
+            errors.append(e)
+
+    # Readers walk the books of each symbol while it trades
+    done = threading.Event()
+    def read(symbol):
+        try:
+            while not done.is_set():
+                for message_type in ["instrument_orderbook_summary", "instrument_orderbook"]:
+                    r = e2e_exchange.recv({"message_type": message_type, "symbol": symbol})
+                    assert r["response_code"] == 0, r
+        except Exception as e:
+            errors.append(e)
+
+    threads = []
+    for i, symbol in enumerate(symbols):
+        threads.append(threading.Thread(target=send, args=("B%d" % i, "BUY", symbol)))
+        threads.append(threading.Thread(target=send, args=("S", "SELL", symbol)))
+    readers = [threading.Thread(target=read, args=(symbol,)) for symbol in symbols]
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for thread in threads + readers:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
+
+    for i, symbol in enumerate(symbols):
+        assert e2e_exchange.stalls[symbol].v_trades == n_orders
+        buyer = broker.get_user("B%d" % i)
+        assert buyer.balance == pytest.approx(1000 - n_orders)
+        assert buyer.holdings[symbol] == n_orders
+        assert broker.ledger.get("B%d" % i, symbol) == LedgerEntry(settled=n_orders, reserved=0)
+
+    seller = broker.get_user("S")
+    assert seller.balance == pytest.approx(len(symbols) * n_orders)
+    assert dict(seller.holdings) == {symbol: 1000 - n_orders for symbol in symbols}
+    assert broker.ledger.get("S", CASH).settled == pytest.approx(len(symbols) * n_orders)
+    assert len(e2e_exchange.open_orders) == 0
+
+def test_instrument_bars(e2e_exchange):
+    e2e_exchange.recv(_order_msg("1", 1, "BUY", "1.00", 10))
+    e2e_exchange.recv(_order_msg("2", 2, "SELL", "1.00", 10))
+    e2e_exchange.recv(_order_msg("3", 1, "BUY", "1.20", 5))
+    e2e_exchange.recv(_order_msg("4", 2, "SELL", "1.20", 5))
+
+    r = e2e_exchange.recv({"message_type": "instrument_bars", "symbol": "STI.", "interval": 300})
+    assert r["response_code"] == 0
+    assert len(r["bars"]) in [1, 2] # Unless the trades straddle a bar
+    assert sum(bar["volume"] for bar in r["bars"]) == 15
+    assert r["bars"][0]["open"] == "1.0"
+    assert r["bars"][-1]["close"] == "1.2"
+
+    r = e2e_exchange.recv({"message_type": "instrument_bars", "symbol": "STI.", "interval": 7})
+    assert r["response_code"] == 1
+    r = e2e_exchange.recv({"message_type": "instrument_bars", "symbol": "NOPE"})
+    assert r["response_code"] == 404
+
+    r = e2e_exchange.recv({"message_type": "instrument_bars", "symbol": "STI.", "interval": 300, "n": 10 ** 9})
+    assert r["response_code"] == 0
+    assert sum(bar["volume"] for bar in r["bars"]) == 15
+    for n in [0, -1, "5", 2.5, True]:
+        r = e2e_exchange.recv({"message_type": "instrument_bars", "symbol": "STI.", "interval": 300, "n": n})
+        assert r["response_code"] == 1
+        assert r["msg"] == "malformed n"
+
+def test_trade_history_polling(e2e_exchange):
+    for i in range(3):
+        e2e_exchange.recv(_order_msg("b%d" % i, 1, "BUY", "1.00", 1))
+        e2e_exchange.recv(_order_msg("s%d" % i, 2, "SELL", "1.00", 1))
+
+    r = e2e_exchange.recv({"message_type": "instrument_trade_history", "symbol": "STI.", "limit": 2})
+    assert (r["first_seq"], r["last_seq"]) == (2, 3)
+    assert [t["buy_txid"] for t in r["trade_history"]] == ["b1", "b2"]
+
+    # Polling from the last seq seen only returns what is new
+    r = e2e_exchange.recv({"message_type": "instrument_trade_history", "symbol": "STI.", "since_seq": 3})
+    assert r["trade_history"] == []
+    assert r["last_seq"] == 3
+    e2e_exchange.recv(_order_msg("b3", 1, "BUY", "1.00", 1))
+    e2e_exchange.recv(_order_msg("s3", 2, "SELL", "1.00", 1))
+    r = e2e_exchange.recv({"message_type": "instrument_trade_history", "symbol": "STI.", "since_seq": r["last_seq"]})
+    assert [t["buy_txid"] for t in r["trade_history"]] == ["b3"]
+    assert r["last_seq"] == 4
+
+    r = e2e_exchange.recv({"message_type": "instrument_trade_history", "symbol": "STI.", "limit": -1})
+    assert r["response_code"] == 1
+
+def test_instrument_summary_vwap_and_rolling(e2e_exchange):
+    e2e_exchange.recv(_order_msg("1", 1, "BUY", "1.00", 10))
+    e2e_exchange.recv(_order_msg("2", 2, "SELL", "1.00", 10))
+    e2e_exchange.recv(_order_msg("3", 1, "BUY", "2.00", 30))
+    e2e_exchange.recv(_order_msg("4", 2, "SELL", "2.00", 30))
+
+    r = e2e_exchange.recv({"message_type": "instrument_summary", "symbol": "STI."})
+    assert r["notional"] == pytest.approx(70)
+    assert float(r["vwap"]) == pytest.approx(70 / 40)
+    assert r["rolling"]["trades_100"]["volume"] == 40
+    assert r["rolling"]["trades_100"]["price_stddev"] == pytest.approx(0.5)
+    assert r["rolling"]["seconds_300"]["num_trades"] == 2
+
+def test_capture_and_replay(tmp_path):
+    clock = ReplayClock(1000.0)
+    journal = JournalWriter(tmp_path / "journal")
+    stex = _make_e2e_exchange(_make_e2e_broker(), clock=clock, journal=journal)
+
+    stex.recv(dict(_order_msg("1", 2, "SELL", "1.00", 50), time_in_force="GTT", expire_ts=1010.0))
+    clock.now += 1
+    stex.recv(_order_msg("2", 1, "BUY", "1.00", 20))
+    clock.now += 1
+    stex.recv(dict(_order_msg("3", 2, "SELL", None, 10), stop_price=0.90))
+    stex.recv(_order_msg("4", 1, "BUY", "0.80", 10))
+    stex.recv(_order_msg("5", 2, "SELL", "0.80", 10))
+    clock.now += 20
+    assert [order.txid for order in stex.tick()] == ["1/1"]
+    journal.close()
+
+    records = list(read_journal(tmp_path / "journal"))
+    assert sum(1 for r in records if r.kind == KIND_TRADE) == stex.stalls["STI."].n_trades == 2
+
+    report = replay_journal(records, lambda clock: _make_e2e_exchange(_make_e2e_broker(), clock=clock))
+    assert report["identical"], report["mismatch"]
+    assert (report["messages"], report["ticks"], report["trades"]) == (5, 1, 2)
+    assert report["exchange"].stalls["STI."].n_trades == 2
+
+    # A replay that trades differently is caught
+    for record in records:
+        if record.kind == KIND_TRADE:
+            record.payload["avg_price"] += 1
+            break
+    report = replay_journal(records, lambda clock: _make_e2e_exchange(_make_e2e_broker(), clock=clock))
+    assert not report["identical"]
+
+def _export_exchange_with_trades():
+    stex = _make_e2e_exchange(_make_e2e_broker())
+    stex.recv(_order_msg("1", 2, "SELL", "1.00", 50))
+    stex.recv(_order_msg("2", 1, "BUY", "1.00", 20))
+    stex.recv(_order_msg("3", 2, "SELL", "1.10", 10))
+    stex.recv(_order_msg("4", 1, "BUY", "1.00", 10))
+    stex.recv(dict(_order_msg("5", 1, "BUY", None, 10), stop_price=1.20))
+    return stex
+
+def test_export_npz(tmp_path):
+    np = pytest.importorskip("numpy")
+    from stexs.io.export import export_exchange
+    stex = _export_exchange_with_trades()
+
+    counts = export_exchange(stex, tmp_path, formats=["npz", "npy"], chunk_size=2)
+    assert counts == {"orders": 7, "trades": 2, "positions": 4}
+
+    with np.load(tmp_path / "exchange.npz") as npz:
+        orders, trades, positions = npz["orders"], npz["trades"], npz["positions"]
+    # The sell split by the first buy is there under each of its txids
+    assert sorted(orders["txid"].tolist()) == [b"1", b"1/1", b"1/2", b"2", b"3", b"4", b"5"]
+    stop = orders[orders["txid"] == b"5"][0]
+    assert np.isnan(stop["price"]) and stop["stop_price"] == 1.20 and not stop["closed"]
+    assert trades["seq"].tolist() == [1, 2]
+    assert trades["sell_txids"].tolist() == [b"1", b"1/1"]
+    assert trades["volume"].sum() == 30
+    assert dict(zip(zip(positions["csid"].tolist(), positions["asset"].tolist()), positions["settled"].tolist()))[(b"2", b"STI.")] == 120
+
+    # The .npy files asked for alongside load the same
+    assert (np.load(tmp_path / "trades.npy") == trades).all()
 
-        assert sam.balance == 0
-        assert tom.balance == 100 + (0.5*50) + (0.75*50)
+def test_export_parquet(tmp_path):
+    pytest.importorskip("numpy")
+    pq = pytest.importorskip("pyarrow.parquet")
+    from stexs.io.export import export_exchange
+    stex = _export_exchange_with_trades()
 
-        assert sam.holdings["STI."] == 200
-        assert tom.holdings["STI."] == 0
+    counts = export_exchange(stex, tmp_path, formats=["parquet"], chunk_size=2)
+    assert counts["orders"] == 7
+    orders = pq.read_table(tmp_path / "orders.parquet")
+    assert pq.ParquetFile(tmp_path / "orders.parquet").num_row_groups == 4
+    assert sorted(orders.column("txid").to_pylist()) == ["1", "1/1", "1/2", "2", "3", "4", "5"]
+    assert pq.read_table(tmp_path / "trades.parquet").column("buy_txid").to_pylist() == ["2", "4"]
 
+def test_export_unknown_format(tmp_path):
+    from stexs.io.export import export_exchange
+    with pytest.raises(ValueError):
+        export_exchange(_export_exchange_with_trades(), tmp_path, formats=["csv"])